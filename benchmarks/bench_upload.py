@@ -0,0 +1,142 @@
+"""Benchmark the database writes of a multi-file upload.
+
+Compares adding the package versions of an upload one by one (one package,
+channeldata and version transaction per file, as before) with
+:meth:`quetz.dao.Dao.create_versions` (a single transaction for the upload).
+
+Usage::
+
+    python benchmarks/bench_upload.py [--database-url URL] [N_FILES ...]
+
+By default a temporary sqlite database file is used, so that the cost of the
+commits is included.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import event
+
+from quetz import rest_models
+from quetz.dao import Dao
+from quetz.database import get_engine, get_session
+from quetz.db_models import Base, User
+
+
+def _versions(channel_name, n_files, n_packages):
+    versions = []
+    for i in range(n_files):
+        package_name = f"package-{i % n_packages}"
+        version = f"1.{i // n_packages}"
+        versions.append(
+            {
+                "package_name": package_name,
+                "package_format": "tarbz2",
+                "platform": "linux-64",
+                "version": version,
+                "build_number": 0,
+                "build_string": "h0",
+                "filename": f"{package_name}-{version}-h0.tar.bz2",
+                "info": "{}",
+                "sha256": uuid.uuid4().hex,
+                "md5": uuid.uuid4().hex,
+                "size": 1000,
+                "channeldata": {
+                    "packagename": package_name,
+                    "version": version,
+                    "subdirs": ["linux-64"],
+                },
+            }
+        )
+    return versions
+
+
+def _upload_one_by_one(dao, channel_name, versions, user_id):
+    for item in versions:
+        package_name = item["package_name"]
+        if not dao.get_package(channel_name, package_name):
+            dao.create_package(
+                channel_name,
+                rest_models.Package(name=package_name, summary="", description=""),
+                user_id,
+                "owner",
+            )
+        dao.update_package_channeldata(channel_name, package_name, item["channeldata"])
+        dao.create_version(
+            channel_name=channel_name,
+            package_name=package_name,
+            package_format=item["package_format"],
+            platform=item["platform"],
+            version=item["version"],
+            build_number=item["build_number"],
+            build_string=item["build_string"],
+            filename=item["filename"],
+            info=item["info"],
+            uploader_id=user_id,
+            sha256=item["sha256"],
+            md5=item["md5"],
+            size=item["size"],
+        )
+
+
+def _upload_in_one_transaction(dao, channel_name, versions, user_id):
+    dao.create_versions(channel_name, versions, user_id, role="owner")
+
+
+def run(database_url, n_files_list, n_packages=10):
+    Base.metadata.create_all(get_engine(database_url))
+    db = get_session(database_url)
+    dao = Dao(db)
+
+    commits = []
+
+    def count_commit(session):
+        commits.append(session)
+
+    event.listen(db, "after_commit", count_commit)
+
+    user = User(id=uuid.uuid4().bytes, username=f"bench-{uuid.uuid4().hex[:8]}")
+    db.add(user)
+    db.commit()
+
+    print(f"{'files':>6} {'method':>16} {'time (s)':>10} {'commits':>8}")
+    for n_files in n_files_list:
+        for method in (_upload_one_by_one, _upload_in_one_transaction):
+            channel_name = f"bench-{uuid.uuid4().hex[:8]}"
+            dao.create_channel(
+                rest_models.Channel(name=channel_name, private=False),
+                user.id,
+                "owner",
+            )
+            versions = _versions(channel_name, n_files, n_packages)
+
+            commits.clear()
+            start = time.monotonic()
+            method(dao, channel_name, versions, user.id)
+            elapsed = time.monotonic() - start
+
+            name = "one-by-one" if method is _upload_one_by_one else "single-txn"
+            print(f"{n_files:>6} {name:>16} {elapsed:>10.3f} {len(commits):>8}")
+
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("n_files", nargs="*", type=int, default=[1, 50, 500])
+    args = parser.parse_args()
+
+    if args.database_url:
+        run(args.database_url, args.n_files)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "bench.sqlite")
+            run(f"sqlite:///{db_path}", args.n_files)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark the extraction of the metadata of uploaded packages.
+
+Compares the thread pool used by the upload endpoints with the process pool
+enabled by ``upload.metadata_workers = "process"`` on many large ``.tar.bz2``
+packages.
+
+Usage::
+
+    python benchmarks/bench_upload_metadata.py [--packages N] [--size MB]
+        [--paths N] [--info-last]
+
+``--info-last`` stores the ``info/`` files at the end of the archives, so that
+the whole package is decompressed to find them.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from quetz.condainfo import CondaInfo, read_package_info
+
+
+def _add_file(tar, name, data):
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    tar.addfile(member, io.BytesIO(data))
+
+
+def make_package(path, index, size, n_paths, info_last):
+    name = f"bench-package-{index}"
+    info = {
+        "info/index.json": json.dumps(
+            {
+                "name": name,
+                "version": "1.0",
+                "build": "0",
+                "build_number": 0,
+                "subdir": "linux-64",
+            }
+        ),
+        "info/about.json": json.dumps({"summary": "benchmark package"}),
+        "info/paths.json": json.dumps(
+            {
+                "paths": [
+                    {
+                        "_path": f"lib/{name}/file-{i}.py",
+                        "path_type": "hardlink",
+                        "sha256": "0" * 64,
+                        "size_in_bytes": 1000,
+                    }
+                    for i in range(n_paths)
+                ],
+                "paths_version": 1,
+            }
+        ),
+        "info/files": "\n".join(f"lib/{name}/file-{i}.py" for i in range(n_paths)),
+    }
+
+    # compressible but not trivial content
+    chunk = os.urandom(1024).hex().encode()
+    data = chunk * (size // len(chunk))
+
+    with tarfile.open(path, "w:bz2") as tar:
+        if not info_last:
+            for member_name, content in info.items():
+                _add_file(tar, member_name, content.encode())
+        _add_file(tar, f"lib/{name}/data.bin", data)
+        if info_last:
+            for member_name, content in info.items():
+                _add_file(tar, member_name, content.encode())
+    return f"{name}-1.0-0.tar.bz2"
+
+
+def _parse_in_thread(path, filename):
+    with open(path, "rb") as fid:
+        return CondaInfo(fid, filename, hash_file=False)
+
+
+def run(executor, packages):
+    start = time.monotonic()
+    futures = [executor.submit(*args) for args in packages]
+    for future in futures:
+        future.result()
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--packages", type=int, default=20)
+    parser.add_argument("--size", type=int, default=20, help="MB of package data")
+    parser.add_argument("--paths", type=int, default=20000)
+    parser.add_argument("--info-last", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(args.packages):
+            path = os.path.join(tmp_dir, f"package-{i}.tar.bz2")
+            filename = make_package(
+                path, i, args.size * 1000000, args.paths, args.info_last
+            )
+            paths.append((path, filename))
+        total = sum(os.path.getsize(path) for path, _ in paths)
+        print(f"{args.packages} packages, {total / 1e6:.1f} MB compressed")
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            elapsed = run(
+                executor, [(_parse_in_thread, path, name) for path, name in paths]
+            )
+        print(f"{'threads (10)':<24} {elapsed:>8.2f} s")
+
+        workers = os.cpu_count()
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            # start the worker processes before measuring
+            list(executor.map(abs, range(workers)))
+            elapsed = run(
+                executor, [(read_package_info, path, name) for path, name in paths]
+            )
+        print(f"{f'processes ({workers})':<24} {elapsed:>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
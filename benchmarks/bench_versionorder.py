@@ -0,0 +1,128 @@
+"""Microbenchmarks of the parsing and comparison of version strings.
+
+Measures :class:`quetz.versionorder.VersionOrder` (and the memoized
+:func:`quetz.versionorder.version_order`) on a corpus of version strings
+shaped like the ones found on conda-forge. The implementation of conda is
+measured as well when it is installed.
+
+Usage::
+
+    python benchmarks/bench_versionorder.py [--repeat N]
+"""
+
+import argparse
+import itertools
+import random
+import timeit
+
+from quetz import versionorder
+
+# version strings as they appear in conda-forge packages
+SAMPLES = [
+    "0.1.0",
+    "0.24.2",
+    "1.0",
+    "1.21.5",
+    "1.7.3",
+    "2.0.0a0",
+    "2.0.0b1",
+    "2.0.0rc1",
+    "2.0.0.dev0",
+    "3.9.7",
+    "3.10.0",
+    "3.10.0rc2",
+    "4.10.3",
+    "0.24.2.post1",
+    "1.0.0.post20210101",
+    "2021.10.8",
+    "2021.02.24",
+    "20210806",
+    "1!2.3",
+    "1.1.1l",
+    "1.1.1_",
+    "9.4.0",
+    "11.2",
+    "5.3.0",
+    "0.9.6",
+    "1.4.32",
+    "7.79.1",
+    "2.32.0",
+    "4.19.112",
+    "1.21.0.dev0+4b7f1f0",
+    "3.0.0+cuda11.2",
+    "0.0.post0",
+    "1.2.3.4",
+    "5.0.0b3",
+    "0.5.0a1",
+    "3.7.4.3",
+    "1.14.6",
+    "0.19.0",
+]
+
+
+def corpus(size=10000, seed=0):
+    """Realistic version strings, with the repetitions of a channel index."""
+
+    rng = random.Random(seed)
+    versions = list(SAMPLES)
+    for major, minor in itertools.product(range(12), range(25)):
+        versions.append(f"{major}.{minor}")
+        versions.append(f"{major}.{minor}.{rng.randint(0, 30)}")
+        versions.append(f"{major}.{minor}.0{rng.choice(['a', 'b', 'rc'])}1")
+        versions.append(f"{major}.{minor}.0.post{rng.randint(1, 5)}")
+    # the same versions are built many times (platforms, build strings)
+    return [rng.choice(versions) for _ in range(size)]
+
+
+def bench(name, stmt, repeat, number=1):
+    best = min(timeit.repeat(stmt, repeat=repeat, number=number))
+    print(f"{name:<40} {best * 1000:>10.2f} ms")
+
+
+def bench_implementation(label, parse, versions, repeat):
+    print(f"--- {label}")
+    bench("parse", lambda: [parse(v) for v in versions], repeat)
+
+    parsed = [parse(v) for v in versions]
+    pairs = list(zip(parsed, parsed[1:]))
+    bench("compare (<)", lambda: [a < b for a, b in pairs], repeat)
+    bench("compare (==)", lambda: [a == b for a, b in pairs], repeat)
+    bench("sort parsed", lambda: sorted(parsed), repeat)
+    bench("parse and sort", lambda: sorted(versions, key=parse), repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--size", type=int, default=10000)
+    args = parser.parse_args()
+
+    versions = corpus(args.size)
+    print(f"{len(versions)} versions, {len(set(versions))} distinct")
+
+    bench_implementation(
+        "quetz.versionorder.VersionOrder",
+        versionorder.VersionOrder,
+        versions,
+        args.repeat,
+    )
+
+    versionorder.version_order.cache_clear()
+    bench_implementation(
+        "quetz.versionorder.version_order (memoized)",
+        versionorder.version_order,
+        versions,
+        args.repeat,
+    )
+
+    try:
+        from conda.exports import VersionOrder as CondaVersionOrder
+    except ImportError:
+        return
+    bench_implementation(
+        "conda.exports.VersionOrder", CondaVersionOrder, versions, args.repeat
+    )
+
+
+if __name__ == "__main__":
+    main()
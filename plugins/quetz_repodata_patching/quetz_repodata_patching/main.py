@@ -2,12 +2,9 @@ import bz2
 import json
 import tarfile
 from contextlib import contextmanager
-from io import BytesIO
-from zipfile import ZipFile
-
-import zstandard
 
 import quetz
+from quetz.condainfo import open_conda_tar, read_tar_members
 from quetz.config import Config
 from quetz.database import get_session
 from quetz.db_models import PackageFormatEnum, PackageVersion
@@ -66,32 +63,26 @@ def patch_repodata(repodata, patches):
 @contextmanager
 def extract_from_tarfile(fs):
     """extract patch_instruction.json from tar.bz2 package"""
-    with tarfile.open(mode='r:bz2', fileobj=fs) as patch_archive:
+    with tarfile.open(mode='r|bz2', fileobj=fs) as patch_archive:
         yield patch_archive
 
 
 @contextmanager
 def extract_from_conda(fs):
     """extract patch_instruction.json from .conda package"""
-    with ZipFile(fs) as zf:
-        pkgtars = [_ for _ in zf.namelist() if _.startswith("pkg-")]
-        pkgtar = pkgtars[0]
-        with zf.open(pkgtar) as zfobj:
-            if pkgtar.endswith(".zst"):
-                zstd = zstandard.ZstdDecompressor()
-                fobj = BytesIO(zstd.stream_reader(zfobj).read())
-            else:
-                fobj = zfobj
-            with tarfile.open(fileobj=fobj, mode="r") as tar:
-                yield tar
-
-
-def _load_instructions(tar, path):
-    try:
-        patch_instructions = json.load(tar.extractfile(path))
-    except KeyError:
-        return {}
-    return patch_instructions
+    with open_conda_tar(fs, "pkg-") as tar:
+        yield tar
+
+
+def _load_instructions(tar, subdirs):
+    """read the patch instructions of all the subdirs in a single pass
+
+    the archive is read forward only, so that large patch packages are not
+    decompressed in memory"""
+
+    paths = {f"{subdir}/patch_instructions.json": subdir for subdir in subdirs}
+    members = read_tar_members(tar, paths)
+    return {paths[path]: json.loads(content) for path, content in members.items()}
 
 
 @contextmanager
@@ -149,25 +140,25 @@ def post_package_indexing(
             add_entry_for_index(files, subdir, f"{path}.bz2", compressed_content)
 
         with extract_(fs) as tar:
+            instructions = _load_instructions(tar, subdirs)
 
-            for subdir in subdirs:
-                packages[subdir] = {}
-                path = f"{subdir}/patch_instructions.json"
+        for subdir in subdirs:
+            packages[subdir] = {}
 
-                patch_instructions = _load_instructions(tar, path)
+            patch_instructions = instructions.get(subdir, {})
 
-                fname = "repodata"
-                fs = pkgstore.serve_path(channel_name, f"{subdir}/{fname}.json")
+            fname = "repodata"
+            fs = pkgstore.serve_path(channel_name, f"{subdir}/{fname}.json")
 
-                repodata_str = fs.read()
-                repodata = json.loads(repodata_str)
+            repodata_str = fs.read()
+            repodata = json.loads(repodata_str)
 
-                _addfile(repodata_str, f"{fname}_from_packages.json")
+            _addfile(repodata_str, f"{fname}_from_packages.json")
 
-                patch_repodata(repodata, patch_instructions)
+            patch_repodata(repodata, patch_instructions)
 
-                packages[subdir].update(repodata["packages"])
-                packages[subdir].update(repodata["packages.conda"])
+            packages[subdir].update(repodata["packages"])
+            packages[subdir].update(repodata["packages.conda"])
 
-                patched_repodata_str = json.dumps(repodata)
-                _addfile(patched_repodata_str, f"{fname}.json")
+            patched_repodata_str = json.dumps(repodata)
+            _addfile(patched_repodata_str, f"{fname}.json")
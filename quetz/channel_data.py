@@ -3,7 +3,7 @@
 
 import json
 
-from conda.exports import VersionOrder
+from quetz.versionorder import version_order
 
 CHANNELDATA_OPTIONAL_FIELDS = (
     "description",
@@ -39,7 +39,7 @@ def combine(old_data, new_data):
         data = new_data
     else:
         data = {}
-        newer = VersionOrder(old_data.get("version", "0")) < VersionOrder(
+        newer = version_order(old_data.get("version", "0")) < version_order(
             new_data.get("version", "0")
         )
         for field in CHANNELDATA_BINARY_FIELDS:
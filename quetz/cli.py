@@ -11,7 +11,7 @@ import uuid
 from distutils.spawn import find_executable
 from enum import Enum
 from pathlib import Path
-from typing import Dict, NoReturn, Optional
+from typing import Dict, List, NoReturn, Optional
 
 import pkg_resources
 import typer
@@ -597,6 +597,106 @@ def list() -> NoReturn:
         typer.echo('\n'.join([p for p in deployments]))
 
 
+@app.command()
+def prewarm_cache(
+    path: str = typer.Argument(None, help="The path of the deployment"),
+    channel: str = typer.Argument(..., help="The name of the proxy channel"),
+    subdir: List[str] = typer.Option(
+        None, help="Subdir to prefetch (can be repeated), defaults to all subdirs"
+    ),
+    package: List[str] = typer.Option(
+        None, help="Package name pattern to prefetch (can be repeated)"
+    ),
+    latest: int = typer.Option(
+        None, help="Only prefetch the N latest versions of each package"
+    ),
+    concurrency: int = typer.Option(
+        None, help="Number of parallel downloads (default from config)"
+    ),
+    rate: float = typer.Option(
+        0, help="Maximum number of downloads started per second (0 - no limit)"
+    ),
+) -> NoReturn:
+    """Fill the cache of a proxy channel with packages from upstream repodata."""
+
+    from quetz.deps import get_remote_session
+    from quetz.tasks.mirror import prewarm_proxy_cache
+
+    config_file = _get_config(path)
+
+    config = Config(config_file)
+    os.chdir(path)
+    db = get_session(config.sqlalchemy_database_url)
+    dao = Dao(db)
+
+    proxy_channel = dao.get_channel(channel)
+    if not proxy_channel or proxy_channel.mirror_mode != "proxy":
+        typer.echo(f"No proxy channel {channel} found.", err=True)
+        raise typer.Abort()
+
+    stats = prewarm_proxy_cache(
+        channel,
+        dao,
+        get_remote_session(),
+        config,
+        subdirs=subdir,
+        package_patterns=package,
+        latest=latest,
+        max_workers=concurrency,
+        max_rate=rate,
+    )
+
+    typer.echo(
+        f"Prefetched {stats['files']} files ({stats['bytes']} bytes), "
+        f"{stats['cached']} already cached, {stats['failed']} failed."
+    )
+
+
+@app.command()
+def prune_mirror(
+    path: str = typer.Argument(None, help="The path of the deployment"),
+    channel: str = typer.Argument(..., help="The name of the mirror channel"),
+    subdir: List[str] = typer.Option(
+        None, help="Subdir to prune (can be repeated), defaults to all subdirs"
+    ),
+    dry_run: bool = typer.Option(
+        False, help="Only report the package files that would be removed"
+    ),
+) -> NoReturn:
+    """Remove the packages of a mirror channel that were deleted upstream."""
+
+    from quetz.deps import get_remote_session
+    from quetz.tasks.mirror import prune_mirror_channel
+
+    config_file = _get_config(path)
+
+    config = Config(config_file)
+    os.chdir(path)
+    db = get_session(config.sqlalchemy_database_url)
+    dao = Dao(db)
+
+    mirror_channel = dao.get_channel(channel)
+    if not mirror_channel or mirror_channel.mirror_mode != "mirror":
+        typer.echo(f"No mirror channel {channel} found.", err=True)
+        raise typer.Abort()
+
+    report = prune_mirror_channel(
+        channel,
+        dao,
+        config.get_package_store(),
+        get_remote_session(),
+        subdirs=subdir,
+        dry_run=dry_run,
+    )
+
+    verb = "Would remove" if dry_run else "Removed"
+    for arch, filenames in report.items():
+        for filename in filenames:
+            typer.echo(f"{arch}/{filename}")
+    n_files = sum(len(filenames) for filenames in report.values())
+    typer.echo(f"{verb} {n_files} package files.")
+
+
 @app.command()
 def plugin(
     cmd: str, path: str = typer.Argument(None, help="Path to the plugin folder")
@@ -6,7 +6,9 @@ import hashlib
 import json
 import tarfile
 import time
+from contextlib import contextmanager
 from io import BytesIO
+from typing import Dict, Iterable, Iterator, Optional
 from zipfile import ZipFile
 
 import zstandard
@@ -43,9 +45,110 @@ ABOUT_MAP_FIELDS = ("keywords", "identifiers", "tags")
 
 MAX_CONDA_TIMESTAMP = 253402300799
 
+INFO_MEMBERS = (
+    "info/index.json",
+    "info/about.json",
+    "info/paths.json",
+    "info/files",
+    "info/run_exports.json",
+)
+INFO_REQUIRED_MEMBERS = ("info/index.json", "info/files")
+
+
+def read_tar_members(
+    tar: tarfile.TarFile,
+    names: Iterable[str],
+    stop_prefix: Optional[str] = None,
+    required: Iterable[str] = (),
+) -> Dict[str, bytes]:
+    """Read the given members of a tar archive in a single forward pass.
+
+    The archive can be opened in stream mode (``"r|*"``), so that it is never
+    decompressed in memory. Reading stops once all the members were found, or
+    after the members starting with `stop_prefix` if it is given (the rest
+    of the archive is then not decompressed). Reading goes on past them as long
+    as some of the `required` members are missing, in case the members with
+    the prefix are not stored together."""
+
+    names = set(names)
+    required = set(required)
+    members = {}
+    seen_prefix = False
+    for member in tar:
+        if stop_prefix and member.name.startswith(stop_prefix):
+            seen_prefix = True
+        elif seen_prefix and required.issubset(members):
+            break
+        if member.name in names and member.isfile():
+            members[member.name] = tar.extractfile(member).read()
+            if len(members) == len(names):
+                break
+    return members
+
+
+def read_info_members(tar: tarfile.TarFile) -> Dict[str, bytes]:
+    """Read the metadata files of a package from a tar archive.
+
+    Reading stops after the ``info/`` directory, which conda-build stores at
+    the beginning of the archive."""
+
+    members = read_tar_members(
+        tar, INFO_MEMBERS, stop_prefix="info/", required=INFO_REQUIRED_MEMBERS
+    )
+    for name in INFO_REQUIRED_MEMBERS:
+        if name not in members:
+            raise PackageError(f"{name} is missing from the package")
+    return members
+
+
+@contextmanager
+def open_conda_tar(file, prefix: str) -> Iterator[tarfile.TarFile]:
+    """Open the ``info-`` or ``pkg-`` tarball of a ``.conda`` package.
+
+    The tarball is decompressed while it is read, it can only be read
+    forward (see :func:`read_tar_members`)."""
+
+    with ZipFile(file) as zf:
+        tarnames = [_ for _ in zf.namelist() if _.startswith(prefix)]
+        if not tarnames:
+            raise PackageError(f"no {prefix} tarball in the package")
+        tarname = tarnames[0]
+        with zf.open(tarname) as zfobj:
+            if tarname.endswith(".zst"):
+                zstd = zstandard.ZstdDecompressor()
+                with zstd.stream_reader(zfobj) as fobj:
+                    with tarfile.open(fileobj=fobj, mode="r|") as tar:
+                        yield tar
+            else:
+                with tarfile.open(fileobj=zfobj, mode="r|") as tar:
+                    yield tar
+
+
+def read_package_info(path: str, filename: str) -> "CondaInfo":
+    """Extract the metadata of the package file stored at `path`.
+
+    The file hashes are not computed. Used to parse the packages in worker
+    processes, which only get the path of the file the upload was spooled to."""
+
+    with open(path, "rb") as fid:
+        return CondaInfo(fid, filename, hash_file=False)
+
 
 class CondaInfo:
-    def __init__(self, file, filename):
+    def __init__(
+        self,
+        file,
+        filename,
+        file_hashes: Optional[dict] = None,
+        hash_file: bool = True,
+    ):
+        """Extract metadata from a package file.
+
+        :param file_hashes: ``size``, ``md5`` and ``sha256`` of the file if they
+            are already known (then the file is only read to extract metadata)
+        :param hash_file: if False, the file hashes are not computed, they are
+            expected to be set later with :meth:`set_file_hashes`
+        """
         self.channeldata = {}
         self.package_format = None
         self.info = {}
@@ -53,7 +156,39 @@ class CondaInfo:
         self.paths = {}
         self.run_exports = {}
         self.files = {}
-        self._parse_conda(file, filename)
+        self._parse_conda(file, filename, file_hashes, hash_file)
+
+    @classmethod
+    def from_repodata(
+        cls, filename: str, info: dict, package_channeldata: Optional[dict] = None
+    ) -> "CondaInfo":
+        """Build the metadata from the repodata.json entry of a package file.
+
+        The package file is not read: ``about`` and ``run_exports`` are taken from
+        the channeldata.json entry of the package, the list of files and paths
+        is not available."""
+
+        package_channeldata = package_channeldata or {}
+
+        self = cls.__new__(cls)
+        if filename.endswith(".conda"):
+            self.package_format = db_models.PackageFormatEnum.conda
+        else:
+            self.package_format = db_models.PackageFormatEnum.tarbz2
+        self.info = dict(sorted(info.items(), key=lambda item: item[0]))
+        self.about = {
+            field: package_channeldata[field]
+            for field in ABOUT_OPTIONAL_FIELDS + ABOUT_MAP_FIELDS
+            if package_channeldata.get(field) is not None
+        }
+        self.paths = {}
+        self.files = []
+        run_exports = package_channeldata.get("run_exports") or {}
+        self.run_exports = run_exports.get(self.info.get("version"), {})
+        self._map_channeldata()
+        for field in INFO_BOOLEAN_FIELDS:
+            self.channeldata[field] = bool(package_channeldata.get(field, False))
+        return self
 
     def _map_channeldata(self):
         channeldata = {}
@@ -106,8 +241,8 @@ class CondaInfo:
 
         self.channeldata = channeldata
 
-    def _load_jsons(self, tar):
-        self.info = json.load(tar.extractfile("info/index.json"))
+    def _load_jsons(self, members: Dict[str, bytes]):
+        self.info = json.loads(members["info/index.json"])
 
         subdir = self.info.get("subdir", None)
         if not subdir:
@@ -117,23 +252,20 @@ class CondaInfo:
                 subdir = platform + '-64'
             self.info['subdir'] = subdir
 
-        try:
-            self.about = json.load(tar.extractfile("info/about.json"))
-        except KeyError:
+        if "info/about.json" in members:
+            self.about = json.loads(members["info/about.json"])
+        else:
             self.about = {}
-        try:
-            self.paths = json.load(tar.extractfile("info/paths.json"))
-        except KeyError:
+        if "info/paths.json" in members:
+            self.paths = json.loads(members["info/paths.json"])
+        else:
             self.paths = {}
-        with tar.extractfile("info/files") as fp:
-            self.files = fp.readlines()
+        self.files = BytesIO(members["info/files"]).readlines()
 
-        try:
-            exports_file = tar.extractfile("info/run_exports.json")
-        except KeyError:
-            self.run_exports = {}
+        if "info/run_exports.json" in members:
+            self.run_exports = json.loads(members["info/run_exports.json"])
         else:
-            self.run_exports = json.load(exports_file)
+            self.run_exports = {}
 
         self._map_channeldata()
 
@@ -155,7 +287,12 @@ class CondaInfo:
         self.info["md5"] = md5.hexdigest()
         self.info["sha256"] = sha.hexdigest()
 
-    def _parse_conda(self, file, filename):
+    def set_file_hashes(self, file_hashes: dict):
+        """Set the ``size``, ``md5`` and ``sha256`` of the package file."""
+        self.info.update(file_hashes)
+        self.info = dict(sorted(self.info.items(), key=lambda item: item[0]))
+
+    def _parse_conda(self, file, filename, file_hashes=None, hash_file=True):
 
         # workaround for https://github.com/python/cpython/pull/3249
         if not hasattr(file, "seekable"):
@@ -165,27 +302,24 @@ class CondaInfo:
         filehandle = file
         if filename.endswith(".conda"):
             self.package_format = db_models.PackageFormatEnum.conda
-            with ZipFile(filehandle) as zf:
-                infotars = [_ for _ in zf.namelist() if _.startswith("info-")]
-                infotar = infotars[0]
-                with zf.open(infotar) as zfobj:
-                    if infotar.endswith(".zst"):
-                        zstd = zstandard.ZstdDecompressor()
-                        # zstandard.stream_reader cannot seek backwards
-                        # and tarfile.extractfile() seeks backwards
-                        fobj = BytesIO(zstd.stream_reader(zfobj).read())
-                    else:
-                        fobj = zfobj
-                    with tarfile.open(fileobj=fobj, mode="r") as tar:
-                        self._load_jsons(tar)
+            with open_conda_tar(filehandle, "info-") as tar:
+                members = read_info_members(tar)
+            self._load_jsons(members)
         else:
             self.package_format = db_models.PackageFormatEnum.tarbz2
+            if filehandle.read(3) != b"BZh":
+                raise PackageError("not a bzip2 file")
+            filehandle.seek(0)
             try:
-                with tarfile.open(fileobj=filehandle, mode="r:bz2") as tar:
-                    self._load_jsons(tar)
-            except tarfile.ReadError as e:
-                raise PackageError(e.args[0])
+                with tarfile.open(fileobj=filehandle, mode="r|bz2") as tar:
+                    members = read_info_members(tar)
+            except (tarfile.ReadError, EOFError, OSError) as e:
+                raise PackageError(str(e))
+            self._load_jsons(members)
 
-        self._calculate_file_hashes(file)
+        if file_hashes:
+            self.info.update(file_hashes)
+        elif hash_file:
+            self._calculate_file_hashes(file)
 
         self.info = dict(sorted(self.info.items(), key=lambda item: item[0]))
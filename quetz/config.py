@@ -86,6 +86,7 @@ class Config:
                 ConfigEntry("region", str, default=""),
                 ConfigEntry("bucket_prefix", str, default=""),
                 ConfigEntry("bucket_suffix", str, default=""),
+                ConfigEntry("blobs_bucket", str, default=""),
             ],
             required=False,
         ),
@@ -125,6 +126,22 @@ class Config:
             ],
             required=False,
         ),
+        ConfigSection(
+            "pkgstore",
+            [
+                ConfigEntry("deduplicate", bool, default=False),
+            ],
+        ),
+        ConfigSection(
+            "upload",
+            [
+                ConfigEntry("metadata_workers", str, default="thread"),
+                ConfigEntry("metadata_processes", int, default=0),
+                ConfigEntry("metadata_process_min_size", int, default=int(1e6)),
+                ConfigEntry("session_expiry", int, default=86400),
+                ConfigEntry("job_timeout", int, default=3600),
+            ],
+        ),
         ConfigSection(
             "plugins",
             [
@@ -136,7 +153,24 @@ class Config:
             [
                 ConfigEntry("batch_length", int, default=10),
                 ConfigEntry("batch_size", int, default=int(1e8)),
+                ConfigEntry("index_update_packages", int, default=0),
+                ConfigEntry("index_update_interval", float, default=0),
                 ConfigEntry("num_parallel_downloads", int, default=int(10)),
+                ConfigEntry("num_parallel_subdirs", int, default=1),
+                ConfigEntry("max_parallel_downloads", int, default=0),
+                ConfigEntry("adaptive_downloads", bool, default=False),
+                ConfigEntry("min_adaptive_downloads", int, default=1),
+                ConfigEntry("max_adaptive_downloads", int, default=32),
+                ConfigEntry("queue_size", int, default=20),
+                ConfigEntry("stream_packages", bool, default=False),
+                ConfigEntry("trust_repodata", bool, default=False),
+                ConfigEntry("prune", bool, default=False),
+                ConfigEntry("sync_poll_interval", int, default=60),
+                ConfigEntry("sync_jitter", float, default=0.1),
+                ConfigEntry("sync_max_backoff", int, default=86400),
+                ConfigEntry("sync_timeout", int, default=86400),
+                ConfigEntry("proxy_cache", str, default="local"),
+                ConfigEntry("proxy_cache_local_size", int, default=0),
             ],
         ),
     ]
@@ -294,10 +328,14 @@ class Config:
                     'region': self.s3_region,
                     'bucket_prefix': self.s3_bucket_prefix,
                     'bucket_suffix': self.s3_bucket_suffix,
+                    'blobs_bucket': self.s3_blobs_bucket,
+                    'deduplicate': self.pkgstore_deduplicate,
                 }
             )
         else:
-            return pkgstores.LocalStore({'channels_dir': 'channels'})
+            return pkgstores.LocalStore(
+                {'channels_dir': 'channels', 'deduplicate': self.pkgstore_deduplicate}
+            )
 
     def configured_section(self, section: str) -> bool:
         """Return if a given section has been configured.
@@ -4,8 +4,8 @@
 import json
 import logging
 import uuid
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import List, Optional
 
 from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
@@ -15,18 +15,26 @@ from quetz import channel_data, errors, rest_models, versionorder
 
 from .db_models import (
     ApiKey,
+    Base,
     Channel,
     ChannelMember,
     Identity,
+    MirrorSyncCheckpoint,
+    MirrorSyncSchedule,
     Package,
     PackageMember,
     PackageVersion,
     Profile,
+    UploadJob,
+    UploadSession,
     User,
 )
 
 logger = logging.getLogger("quetz")
 
+# maximum number of values in the IN clause of bulk queries
+BULK_CHUNK_SIZE = 500
+
 
 def get_paginated_result(query: Query, skip: int, limit: int):
     return {
@@ -39,6 +47,17 @@ def get_paginated_result(query: Query, skip: int, limit: int):
     }
 
 
+def _get_file_checksums(info: str):
+    """get sha256, md5 and size of a package file from its info"""
+    try:
+        data = json.loads(info)
+    except (TypeError, ValueError):
+        return None, None, None
+    if not isinstance(data, dict):
+        return None, None, None
+    return data.get("sha256"), data.get("md5"), data.get("size")
+
+
 class Dao:
     def __init__(self, db: Session):
         self.db = db
@@ -116,6 +135,7 @@ class Dao:
             mirror_channel_url=data.mirror_channel_url,
             mirror_mode=data.mirror_mode,
             private=data.private,
+            sync_interval=data.sync_interval,
         )
 
         self.db.add(channel)
@@ -124,6 +144,16 @@ class Dao:
             member = ChannelMember(channel=channel, user_id=user_id, role=role)
             self.db.add(member)
 
+        if data.sync_interval:
+            # the first periodic synchronisation is run one interval after
+            # the synchronisation triggered by the channel creation
+            schedule = MirrorSyncSchedule(
+                channel=channel,
+                user_id=user_id,
+                next_run=datetime.utcnow() + timedelta(seconds=data.sync_interval),
+            )
+            self.db.add(schedule)
+
         self.db.commit()
 
         return channel
@@ -365,16 +395,12 @@ class Dao:
         info,
         uploader_id,
         upsert: bool = False,
+        sha256: Optional[str] = None,
+        md5: Optional[str] = None,
+        size: Optional[int] = None,
     ):
-        # hold a lock on the package
-        package = (  # noqa
-            self.db.query(Package)
-            .with_for_update()
-            .filter(Package.channel_name == channel_name)
-            .filter(Package.name == package_name)
-            .filter(PackageVersion.package_format == package_format)
-            .filter(PackageVersion.platform == platform)
-        ).first()
+        if sha256 is None and md5 is None and size is None:
+            sha256, md5, size = _get_file_checksums(info)
 
         existing_versions = (
             self.db.query(PackageVersion)
@@ -390,38 +416,6 @@ class Dao:
 
         if not package_version:
 
-            all_existing_versions = (
-                self.db.query(PackageVersion)
-                .filter(PackageVersion.channel_name == channel_name)
-                .filter(PackageVersion.package_name == package_name)
-                .order_by(PackageVersion.version_order.asc())
-            ).all()
-
-            version_order = 0
-
-            if all_existing_versions:
-                new_version = versionorder.VersionOrder(version)
-                for v in all_existing_versions:
-                    other = versionorder.VersionOrder(v.version)
-                    is_newer = other < new_version or (
-                        other == new_version and v.build_number < build_number
-                    )
-                    if is_newer:
-                        break
-                version_order = v.version_order if is_newer else v.version_order + 1
-
-                (
-                    self.db.query(PackageVersion)
-                    .filter(PackageVersion.channel_name == channel_name)
-                    .filter(PackageVersion.package_name == package_name)
-                    .filter(PackageVersion.package_format == package_format)
-                    .filter(PackageVersion.platform == platform)
-                    .filter(PackageVersion.version_order >= version_order)
-                    .update(
-                        {"version_order": PackageVersion.version_order + 1},
-                    )
-                )
-
             package_version = PackageVersion(
                 id=uuid.uuid4().bytes,
                 channel_name=channel_name,
@@ -433,7 +427,10 @@ class Dao:
                 build_string=build_string,
                 filename=filename,
                 info=info,
-                version_order=version_order,
+                sha256=sha256,
+                md5=md5,
+                size=size,
+                sort_key=versionorder.sort_key(version, build_number),
                 uploader_id=uploader_id,
             )
 
@@ -448,6 +445,9 @@ class Dao:
                 {
                     "filename": filename,
                     "info": info,
+                    "sha256": sha256,
+                    "md5": md5,
+                    "size": size,
                     "uploader_id": uploader_id,
                     "time_modified": datetime.utcnow(),
                 },
@@ -460,6 +460,159 @@ class Dao:
 
         return package_version
 
+    def create_versions(
+        self,
+        channel_name: str,
+        versions: List[dict],
+        uploader_id: bytes,
+        role: Optional[str] = None,
+        upsert: bool = False,
+    ) -> List[PackageVersion]:
+        """add several package versions in a single transaction
+
+        each item of `versions` holds the arguments of :meth:`create_version`
+        (``package_name``, ``package_format``, ``platform``, ``version``,
+        ``build_number``, ``build_string``, ``filename``, ``info``, ``sha256``,
+        ``md5`` and ``size``) and the ``channeldata`` of the package version.
+        Missing packages are created (the uploader gets the `role` in them) with
+        the optional ``summary`` and ``description`` of the item.
+
+        the channeldata of each package is merged once for all the new
+        versions. Raises IntegrityError (and adds
+        nothing) if a version exists already and `upsert` is not set."""
+
+        def version_key(v):
+            # the format is a string until the version is loaded from the database
+            return (
+                v["package_name"],
+                getattr(v["package_format"], "name", v["package_format"]),
+                v["platform"],
+                v["version"],
+                v["build_number"],
+                v["build_string"],
+            )
+
+        def load_versions(query):
+            return (
+                query.filter(PackageVersion.channel_name == channel_name)
+                .filter(PackageVersion.package_name.in_(package_names))
+                .all()
+            )
+
+        package_names = sorted({item["package_name"] for item in versions})
+
+        if not upsert:
+            # check the duplicates before anything is modified
+            new_keys = [version_key(item) for item in versions]
+            existing_keys = {
+                version_key(v._asdict())
+                for v in load_versions(
+                    self.db.query(
+                        PackageVersion.package_name,
+                        PackageVersion.package_format,
+                        PackageVersion.platform,
+                        PackageVersion.version,
+                        PackageVersion.build_number,
+                        PackageVersion.build_string,
+                    )
+                )
+            }
+            if len(set(new_keys)) < len(new_keys) or existing_keys.intersection(
+                new_keys
+            ):
+                raise IntegrityError("duplicate package version", None, None)
+
+        # hold a lock on the existing packages while merging their channeldata
+        packages = {
+            package.name: package
+            for package in self.db.query(Package)
+            .with_for_update()
+            .filter(Package.channel_name == channel_name)
+            .filter(Package.name.in_(package_names))
+        }
+
+        for item in versions:
+            package_name = item["package_name"]
+            if package_name in packages:
+                continue
+            package = Package(
+                name=package_name,
+                channel_name=channel_name,
+                summary=item.get("summary"),
+                description=item.get("description"),
+                channeldata="{}",
+            )
+            self.db.add(package)
+            if role and uploader_id:
+                self.db.add(
+                    PackageMember(
+                        channel_name=channel_name,
+                        package=package,
+                        user_id=uploader_id,
+                        role=role,
+                    )
+                )
+            packages[package_name] = package
+
+        channeldata = {}
+        for item in versions:
+            package_name = item["package_name"]
+            if package_name not in channeldata:
+                old_data = packages[package_name].channeldata
+                channeldata[package_name] = json.loads(old_data) if old_data else None
+            channeldata[package_name] = channel_data.combine(
+                channeldata[package_name], item["channeldata"]
+            )
+        for package_name, data in channeldata.items():
+            packages[package_name].channeldata = json.dumps(data)
+
+        existing = {
+            version_key(v.__dict__): v
+            for v in load_versions(self.db.query(PackageVersion))
+        }
+
+        created = []
+        for item in versions:
+            key = version_key(item)
+            if key in existing:
+                package_version = existing[key]
+                for column in ("filename", "info", "sha256", "md5", "size"):
+                    setattr(package_version, column, item.get(column))
+                package_version.uploader_id = uploader_id
+                package_version.time_modified = datetime.utcnow()
+            else:
+                package_version = PackageVersion(
+                    id=uuid.uuid4().bytes,
+                    channel_name=channel_name,
+                    package_name=item["package_name"],
+                    package_format=item["package_format"],
+                    platform=item["platform"],
+                    version=item["version"],
+                    build_number=item["build_number"],
+                    build_string=item["build_string"],
+                    filename=item["filename"],
+                    info=item["info"],
+                    sha256=item.get("sha256"),
+                    md5=item.get("md5"),
+                    size=item.get("size"),
+                    sort_key=versionorder.sort_key(
+                        item["version"], item["build_number"]
+                    ),
+                    uploader_id=uploader_id,
+                )
+                self.db.add(package_version)
+                existing[key] = package_version
+            created.append(package_version)
+
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # a concurrent upload added one of the versions
+            self.db.rollback()
+            raise
+
+        return created
+
     def get_package_versions(self, package, time_created_ge: datetime = None):
         ApiKeyProfile = aliased(Profile)
 
@@ -470,7 +623,7 @@ class Dao:
             .outerjoin(ApiKeyProfile, ApiKey.owner_id == ApiKeyProfile.user_id)
             .filter(PackageVersion.channel_name == package.channel_name)
             .filter(PackageVersion.package_name == package.name)
-            .order_by(PackageVersion.version_order.asc())
+            .order_by(PackageVersion.sort_key.desc())
         )
 
         if time_created_ge:
@@ -492,6 +645,21 @@ class Dao:
 
         return query.one_or_none()
 
+    def get_package_versions_by_filenames(
+        self, channel_name: str, platform: str, filenames: List[str]
+    ) -> List[PackageVersion]:
+        versions = []
+        for start in range(0, len(filenames), BULK_CHUNK_SIZE):
+            chunk = filenames[start : start + BULK_CHUNK_SIZE]  # noqa: E203
+            versions.extend(
+                self.db.query(PackageVersion)
+                .options(joinedload(PackageVersion.package))
+                .filter(PackageVersion.channel_name == channel_name)
+                .filter(PackageVersion.platform == platform)
+                .filter(PackageVersion.filename.in_(chunk))
+            )
+        return versions
+
     def is_active_platform(self, channel_name: str, platform: str):
         if platform == 'noarch':
             return True
@@ -526,6 +694,291 @@ class Dao:
             .order_by(Package.name)
         )
 
+    def delete_package_versions(
+        self, channel_name: str, platform: str, filenames: List[str]
+    ) -> int:
+        """delete package versions in bulk
+
+        rows of other tables (for example of plugins) referencing the package
+        versions are deleted as well"""
+
+        dependent_columns = [
+            (table, foreign_key.parent)
+            for table in Base.metadata.sorted_tables
+            for foreign_key in table.foreign_keys
+            if foreign_key.column is PackageVersion.__table__.c.id
+        ]
+
+        n_deleted = 0
+        for start in range(0, len(filenames), BULK_CHUNK_SIZE):
+            chunk = filenames[start : start + BULK_CHUNK_SIZE]  # noqa: E203
+            version_ids = [
+                version_id
+                for version_id, in self.db.query(PackageVersion.id)
+                .filter(PackageVersion.channel_name == channel_name)
+                .filter(PackageVersion.platform == platform)
+                .filter(PackageVersion.filename.in_(chunk))
+            ]
+            if not version_ids:
+                continue
+            for table, column in dependent_columns:
+                self.db.execute(table.delete().where(column.in_(version_ids)))
+            n_deleted += (
+                self.db.query(PackageVersion)
+                .filter(PackageVersion.id.in_(version_ids))
+                .delete(synchronize_session=False)
+            )
+        self.db.commit()
+        return n_deleted
+
+    def get_mirror_sync_checkpoints(self, channel_name: str):
+        return (
+            self.db.query(MirrorSyncCheckpoint)
+            .filter(MirrorSyncCheckpoint.channel_name == channel_name)
+            .order_by(MirrorSyncCheckpoint.subdir)
+            .all()
+        )
+
+    def get_mirror_sync_checkpoint(self, channel_name: str, subdir: str):
+        return self.db.query(MirrorSyncCheckpoint).get((channel_name, subdir))
+
+    def update_mirror_sync_checkpoint(self, channel_name: str, subdir: str, **data):
+        """create or update the checkpoint of a subdir synchronisation"""
+        checkpoint = self.get_mirror_sync_checkpoint(channel_name, subdir)
+        if checkpoint is None:
+            checkpoint = MirrorSyncCheckpoint(channel_name=channel_name, subdir=subdir)
+            self.db.add(checkpoint)
+        for key, value in data.items():
+            setattr(checkpoint, key, value)
+        self.db.commit()
+        return checkpoint
+
+    def get_mirror_sync_schedule(self, channel_name: str):
+        return self.db.query(MirrorSyncSchedule).get(channel_name)
+
+    def set_mirror_sync_interval(
+        self, channel_name: str, interval: Optional[int], user_id: Optional[bytes]
+    ):
+        """set the interval of the periodic synchronisation of a mirror channel
+
+        the synchronisations are run on behalf of the user `user_id`"""
+
+        channel = self.get_channel(channel_name)
+        channel.sync_interval = interval
+
+        schedule = self.get_mirror_sync_schedule(channel_name)
+        if schedule is None:
+            schedule = MirrorSyncSchedule(channel_name=channel_name, failures=0)
+            self.db.add(schedule)
+        schedule.user_id = user_id
+        if interval:
+            schedule.next_run = datetime.utcnow() + timedelta(seconds=interval)
+        else:
+            schedule.next_run = None
+        self.db.commit()
+        return schedule
+
+    def get_due_mirror_syncs(self, now: datetime, stale_before: datetime) -> List[str]:
+        """names of the mirror channels whose periodic synchronisation is due
+
+        synchronisations still running since before `stale_before` are assumed
+        to have been interrupted"""
+
+        return [
+            channel_name
+            for channel_name, in self.db.query(MirrorSyncSchedule.channel_name)
+            .join(Channel)
+            .filter(Channel.sync_interval.isnot(None))
+            .filter(MirrorSyncSchedule.next_run <= now)
+            .filter(
+                or_(
+                    MirrorSyncSchedule.status != "running",
+                    MirrorSyncSchedule.last_started < stale_before,
+                )
+            )
+            .order_by(MirrorSyncSchedule.next_run)
+        ]
+
+    def claim_mirror_sync(
+        self, channel_name: str, now: datetime, stale_before: datetime
+    ) -> bool:
+        """mark the periodic synchronisation of a channel as running
+
+        the update is conditional so that a synchronisation is claimed by one
+        scheduler only, returns False if it was claimed by another one"""
+
+        n_claimed = (
+            self.db.query(MirrorSyncSchedule)
+            .filter(MirrorSyncSchedule.channel_name == channel_name)
+            .filter(MirrorSyncSchedule.next_run <= now)
+            .filter(
+                or_(
+                    MirrorSyncSchedule.status != "running",
+                    MirrorSyncSchedule.last_started < stale_before,
+                )
+            )
+            .update(
+                {"status": "running", "last_started": now},
+                synchronize_session=False,
+            )
+        )
+        self.db.commit()
+        return n_claimed == 1
+
+    def finish_mirror_sync(
+        self, channel_name: str, next_run: datetime, error: Optional[str] = None
+    ):
+        """store the result of a periodic synchronisation and schedule the next one"""
+
+        schedule = self.get_mirror_sync_schedule(channel_name)
+        schedule.status = "idle"
+        schedule.last_finished = datetime.utcnow()
+        schedule.last_error = error
+        schedule.failures = (schedule.failures or 0) + 1 if error else 0
+        schedule.next_run = next_run
+        self.db.commit()
+        return schedule
+
+    def create_upload_session(
+        self,
+        session_id: bytes,
+        channel_name: str,
+        user_id: bytes,
+        data: rest_models.UploadSessionCreate,
+        store_upload_id: Optional[str] = None,
+        time_expires: Optional[datetime] = None,
+    ) -> UploadSession:
+        upload_session = UploadSession(
+            id=session_id,
+            channel_name=channel_name,
+            user_id=user_id,
+            filename=data.filename,
+            size=data.size,
+            sha256=data.sha256,
+            offset=0,
+            store_upload_id=store_upload_id,
+            parts="[]",
+            time_expires=time_expires,
+        )
+        self.db.add(upload_session)
+        self.db.commit()
+        return upload_session
+
+    def get_upload_session(self, session_id: bytes) -> Optional[UploadSession]:
+        return self.db.query(UploadSession).get(session_id)
+
+    def add_upload_session_part(
+        self,
+        upload_session: UploadSession,
+        offset: int,
+        size: int,
+        part: Optional[dict],
+        time_expires: Optional[datetime] = None,
+    ) -> bool:
+        """record a part of the file stored at `offset`
+
+        the update is conditional so that a part uploaded twice concurrently
+        is recorded once, returns False if the session moved past `offset`"""
+
+        parts = json.loads(upload_session.parts)
+        parts.append(part)
+        values = {"offset": offset + size, "parts": json.dumps(parts)}
+        if time_expires is not None:
+            values["time_expires"] = time_expires
+        n_updated = (
+            self.db.query(UploadSession)
+            .filter(UploadSession.id == upload_session.id)
+            .filter(UploadSession.offset == offset)
+            .update(values, synchronize_session=False)
+        )
+        self.db.commit()
+        self.db.refresh(upload_session)
+        return n_updated == 1
+
+    def delete_upload_session(self, upload_session: UploadSession):
+        self.db.delete(upload_session)
+        self.db.commit()
+
+    def get_expired_upload_sessions(
+        self, now: datetime, limit: int = 100
+    ) -> List[UploadSession]:
+        return (
+            self.db.query(UploadSession)
+            .filter(UploadSession.time_expires < now)
+            .order_by(UploadSession.time_expires)
+            .limit(limit)
+            .all()
+        )
+
+    def create_upload_job(
+        self,
+        job_id: bytes,
+        channel_name: str,
+        user_id: bytes,
+        filenames: List[str],
+        force: bool = False,
+        package_name: Optional[str] = None,
+    ) -> UploadJob:
+        upload_job = UploadJob(
+            id=job_id,
+            channel_name=channel_name,
+            package_name=package_name,
+            user_id=user_id,
+            force=bool(force),
+            status="pending",
+            files=json.dumps(
+                [{"filename": filename, "status": "pending"} for filename in filenames]
+            ),
+        )
+        self.db.add(upload_job)
+        self.db.commit()
+        return upload_job
+
+    def get_upload_job(self, job_id: bytes) -> Optional[UploadJob]:
+        return self.db.query(UploadJob).get(job_id)
+
+    def update_upload_job(
+        self, upload_job: UploadJob, status: str, files: Optional[List[dict]] = None
+    ) -> UploadJob:
+        upload_job.status = status
+        if files is not None:
+            upload_job.files = json.dumps(files)
+        if status in ("success", "failed"):
+            upload_job.time_finished = datetime.utcnow()
+        self.db.commit()
+        return upload_job
+
+    def expire_upload_job(
+        self, upload_job: UploadJob, stale_before: datetime, detail: str
+    ) -> bool:
+        """mark a job created before `stale_before` and not finished as failed
+
+        its pending files fail with `detail`; the update is conditional so that
+        a job finishing concurrently is not overwritten, returns True if the
+        job expired"""
+
+        files = json.loads(upload_job.files)
+        for item in files:
+            if item["status"] == "pending":
+                item.update(status="failed", detail=detail)
+        n_updated = (
+            self.db.query(UploadJob)
+            .filter(UploadJob.id == upload_job.id)
+            .filter(UploadJob.status.in_(["pending", "running"]))
+            .filter(UploadJob.time_created < stale_before)
+            .update(
+                {
+                    "status": "failed",
+                    "files": json.dumps(files),
+                    "time_finished": datetime.utcnow(),
+                },
+                synchronize_session=False,
+            )
+        )
+        self.db.commit()
+        self.db.refresh(upload_job)
+        return n_updated == 1
+
     def create_user_with_role(self, user_name: str, role: Optional[str] = None):
         """create a user without a profile or return a user if already exists and replace
         role"""
@@ -4,10 +4,12 @@
 import enum
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
     Index,
     Integer,
@@ -79,6 +81,8 @@ class Channel(Base):
     mirror_channel_url = Column(String)
     mirror_mode = Column(String)
     timestamp_mirror_sync = Column(Integer, default=0)
+    # interval (in seconds) of the periodic synchronisation of a mirror channel
+    sync_interval = Column(Integer)
 
     packages = relationship('Package', back_populates='channel', cascade="all,delete")
 
@@ -220,10 +224,14 @@ class PackageVersion(Base):
     build_string = Column(String)
     build_number = Column(Integer)
 
-    version_order = Column(Integer, default=0)
+    # versionorder.sort_key of the version and build number
+    sort_key = Column(LargeBinary)
 
     filename = Column(String)
     info = Column(String)
+    sha256 = Column(String, index=True)
+    md5 = Column(String, index=True)
+    size = Column(BigInteger)
     uploader_id = Column(UUID, ForeignKey('users.id'))
     time_created = Column(DateTime(timezone=True), server_default=func.now())
     time_modified = Column(DateTime(timezone=True), server_default=func.now())
@@ -240,6 +248,13 @@ Index(
     PackageVersion.package_name,
 )
 
+Index(
+    'package_version_sort_index',
+    PackageVersion.channel_name,
+    PackageVersion.package_name,
+    PackageVersion.sort_key,
+)
+
 UniqueConstraint(
     PackageVersion.channel_name,
     PackageVersion.package_name,
@@ -250,3 +265,115 @@ UniqueConstraint(
     PackageVersion.build_number,
     name='package_version_index',
 )
+
+
+class MirrorSyncCheckpoint(Base):
+    """Progress of the synchronisation of a subdir of a mirror channel."""
+
+    __tablename__ = 'mirror_sync_checkpoints'
+
+    channel_name = Column(String, ForeignKey('channels.name'), primary_key=True)
+    subdir = Column(String, primary_key=True)
+    status = Column(String)
+    repodata_etag = Column(String)
+    # number of repodata entries processed from the beginning of the repodata
+    position = Column(Integer, default=0)
+    last_filename = Column(String)
+    batch = Column(Integer, default=0)
+    n_packages = Column(Integer, default=0)
+    # last upstream repodata applied: hash of the file and compressed
+    # filename -> checksum map of its entries
+    repodata_sha256 = Column(String)
+    repodata_snapshot = Column(LargeBinary)
+    # duration of the last complete synchronisation (in seconds)
+    duration = Column(Float)
+    # current limit of concurrent downloads (with adaptive downloads)
+    download_concurrency = Column(Integer)
+    time_modified = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    channel = relationship(
+        'Channel',
+        backref=backref("mirror_sync_checkpoints", cascade="all,delete-orphan"),
+    )
+
+
+class MirrorSyncSchedule(Base):
+    """State of the periodic synchronisation of a mirror channel."""
+
+    __tablename__ = 'mirror_sync_schedules'
+
+    channel_name = Column(String, ForeignKey('channels.name'), primary_key=True)
+    # user on behalf of whom the synchronisations are run
+    user_id = Column(UUID, ForeignKey('users.id'))
+    status = Column(String, default="idle")
+    next_run = Column(DateTime)
+    last_started = Column(DateTime)
+    last_finished = Column(DateTime)
+    last_error = Column(String)
+    # number of consecutive failed synchronisations
+    failures = Column(Integer, default=0)
+
+    channel = relationship(
+        'Channel',
+        backref=backref(
+            "mirror_sync_schedule", uselist=False, cascade="all,delete-orphan"
+        ),
+    )
+    user = relationship('User')
+
+
+class UploadSession(Base):
+    """Package file uploaded in several chunks."""
+
+    __tablename__ = 'upload_sessions'
+
+    id = Column(UUID, primary_key=True)
+    channel_name = Column(String, ForeignKey('channels.name'), index=True)
+    user_id = Column(UUID, ForeignKey('users.id'))
+    filename = Column(String)
+    size = Column(BigInteger)
+    # number of bytes already stored
+    offset = Column(BigInteger, default=0)
+    # expected checksum of the file (optional)
+    sha256 = Column(String)
+    # id of the upload in the package store (S3 multipart upload id)
+    store_upload_id = Column(String)
+    # JSON list of the parts already uploaded to the package store
+    parts = Column(Text)
+    time_created = Column(DateTime(timezone=True), server_default=func.now())
+    # the session and its chunks are discarded after this time (UTC), every
+    # chunk uploaded extends it
+    time_expires = Column(DateTime, index=True)
+
+    channel = relationship(
+        'Channel',
+        backref=backref("upload_sessions", cascade="all,delete-orphan"),
+    )
+    user = relationship('User')
+
+
+class UploadJob(Base):
+    """Package files uploaded to a channel and added by a worker."""
+
+    __tablename__ = 'upload_jobs'
+
+    id = Column(UUID, primary_key=True)
+    channel_name = Column(String, ForeignKey('channels.name'), index=True)
+    # upload restricted to a package (optional)
+    package_name = Column(String)
+    user_id = Column(UUID, ForeignKey('users.id'))
+    force = Column(Boolean, default=False)
+    # pending, running, success or failed
+    status = Column(String, default="pending")
+    # JSON list of the files with their status and error
+    files = Column(Text)
+    time_created = Column(DateTime(timezone=True), server_default=func.now())
+    time_finished = Column(DateTime)
+
+    channel = relationship(
+        'Channel',
+        backref=backref("upload_jobs", cascade="all,delete-orphan"),
+    )
+    user = relationship('User')
@@ -12,13 +12,9 @@ from quetz import authorization
 from quetz.config import Config
 from quetz.dao import Dao
 from quetz.database import get_session as get_db_session
+from quetz.tasks import mirror
 from quetz.tasks.common import Task
-from quetz.tasks.workers import (
-    RQManager,
-    SubprocessWorker,
-    ThreadingWorker,
-    rq_available,
-)
+from quetz.tasks.workers import get_worker
 
 DEFAULT_TIMEOUT = 5  # seconds
 MAX_RETRIES = 3
@@ -76,6 +72,10 @@ def get_remote_session() -> requests.Session:
     return session
 
 
+def get_proxy_cache(channel_name: str, config: Config = Depends(get_config)):
+    return mirror.make_proxy_cache(channel_name, config)
+
+
 def get_rules(
     request: Request,
     session: dict = Depends(get_session),
@@ -92,28 +92,6 @@ def get_tasks_worker(
     config: Config = Depends(get_config),
 ) -> Task:
 
-    if config.configured_section("worker"):
-        worker = config.worker_type
-    else:
-        worker = "thread"
-
-    if worker == "thread":
-        worker = ThreadingWorker(background_tasks, dao, auth, session, config)
-    elif worker == "subprocess":
-        worker = SubprocessWorker(auth.API_key, auth.session, config)
-    elif worker == "redis":
-        if rq_available:
-            worker = RQManager(
-                config.worker_redis_ip,
-                config.worker_redis_port,
-                config.worker_redis_db,
-                auth.API_key,
-                auth.session,
-                config,
-            )
-        else:
-            raise ValueError("redis and rq not installed on machine")
-    else:
-        raise ValueError("wrong configuration in worker.type")
+    worker = get_worker(config, background_tasks, dao, auth, session)
 
     return Task(auth, worker)
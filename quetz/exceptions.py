@@ -1,5 +1,7 @@
 class PackageError(Exception):
     def __init__(self, detail: str) -> None:
+        # passed to Exception so that the error can be pickled
+        super().__init__(detail)
         self.detail = detail
 
     def __repr__(self) -> str:
@@ -1,14 +1,18 @@
 # Copyright 2020 QuantStack
 # Distributed under the terms of the Modified BSD License.
+import asyncio
 import datetime
 import json
 import logging
+import multiprocessing
 import os
 import re
 import secrets
 import sys
+import tempfile
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Optional
 
 import requests
@@ -20,11 +24,14 @@ from fastapi import (
     File,
     Form,
     HTTPException,
+    Request,
+    Response,
     UploadFile,
     status,
 )
 from fastapi.responses import StreamingResponse
 from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import RedirectResponse
@@ -43,6 +50,7 @@ from quetz.dao import Dao
 from quetz.deps import (
     get_dao,
     get_db,
+    get_proxy_cache,
     get_remote_session,
     get_rules,
     get_session,
@@ -50,11 +58,21 @@ from quetz.deps import (
 )
 from quetz.rest_models import ChannelActionEnum
 from quetz.tasks import indexing
+from quetz.tasks.assertions import can_channel_synchronize
 from quetz.tasks.common import Task
-from quetz.tasks.mirror import LocalCache, RemoteRepository, get_from_cache_or_download
-from quetz.utils import TicToc
+from quetz.tasks.mirror import RemoteRepository, get_from_cache_or_download
+from quetz.tasks.scheduler import MirrorSyncScheduler
+from quetz.tasks.uploads import (
+    UPLOAD_JOB_TIMEOUT_DETAIL,
+    UPLOADS_DIR,
+    cleanup_upload_sessions,
+    ingest_upload_job,
+    upload_job_path,
+    upload_session_path,
+)
+from quetz.utils import HashingReader, TicToc
 
-from .condainfo import CondaInfo
+from .condainfo import CondaInfo, read_package_info
 
 app = FastAPI()
 
@@ -116,6 +134,41 @@ if config.configured_section("google"):
     app.include_router(auth_google.router)
 
 
+@app.on_event("startup")
+async def start_mirror_sync_scheduler():
+    if config.mirroring_sync_poll_interval:
+        scheduler = MirrorSyncScheduler(config)
+        asyncio.ensure_future(scheduler.run())
+
+
+_metadata_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_metadata_executor() -> Optional[ProcessPoolExecutor]:
+    """Process pool extracting the metadata of uploaded packages.
+
+    Returns None unless ``upload.metadata_workers`` is ``"process"``."""
+
+    global _metadata_executor
+    if config.upload_metadata_workers != "process":
+        return None
+    if _metadata_executor is None:
+        # the server runs threads, do not fork it
+        _metadata_executor = ProcessPoolExecutor(
+            max_workers=config.upload_metadata_processes or None,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _metadata_executor
+
+
+@app.on_event("shutdown")
+def stop_metadata_executor():
+    global _metadata_executor
+    if _metadata_executor is not None:
+        _metadata_executor.shutdown()
+        _metadata_executor = None
+
+
 class ChannelChecker:
     def __init__(
         self,
@@ -190,6 +243,42 @@ def get_package_or_fail(
     return package
 
 
+def get_upload_session_or_fail(
+    session_id: uuid.UUID,
+    channel: db_models.Channel = Depends(
+        ChannelChecker(allow_proxy=False, allow_mirror=False)
+    ),
+    dao: Dao = Depends(get_dao),
+    auth: authorization.Rules = Depends(get_rules),
+) -> db_models.UploadSession:
+
+    user_id = auth.assert_user()
+    upload_session = dao.get_upload_session(session_id.bytes)
+
+    if not upload_session or upload_session.channel_name != channel.name:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Upload session {session_id} not found",
+        )
+
+    if (
+        upload_session.time_expires
+        and upload_session.time_expires < datetime.datetime.utcnow()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Upload session {session_id} expired",
+        )
+
+    if upload_session.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Upload session of another user",
+        )
+
+    return upload_session
+
+
 # helper functions
 
 
@@ -422,7 +511,7 @@ def put_mirror_channel_actions(
     task: Task = Depends(get_tasks_worker),
 ):
 
-    task.execute_channel_action(action.action, channel)
+    task.execute_channel_action(action.action, channel, action)
 
 
 @api_router.post("/channels", status_code=201, tags=["channels"])
@@ -568,6 +657,73 @@ def post_package(
     dao.create_package(channel.name, new_package, user_id, authorization.OWNER)
 
 
+@api_router.get(
+    "/channels/{channel_name}/sync",
+    response_model=List[rest_models.MirrorSyncProgress],
+    tags=["channels"],
+)
+def get_mirror_sync_progress(
+    channel: db_models.Channel = Depends(get_channel_or_fail),
+    dao: Dao = Depends(get_dao),
+):
+    """Progress of the synchronisation of each subdir of a mirror channel."""
+
+    return dao.get_mirror_sync_checkpoints(channel.name)
+
+
+@api_router.get(
+    "/channels/{channel_name}/sync/schedule",
+    response_model=rest_models.MirrorSyncSchedule,
+    tags=["channels"],
+)
+def get_mirror_sync_schedule(
+    channel: db_models.Channel = Depends(get_channel_or_fail),
+    dao: Dao = Depends(get_dao),
+):
+    """State of the periodic synchronisation of a mirror channel."""
+
+    schedule = dao.get_mirror_sync_schedule(channel.name)
+    if schedule is None:
+        return rest_models.MirrorSyncSchedule(interval=channel.sync_interval)
+
+    sync_schedule = rest_models.MirrorSyncSchedule.from_orm(schedule)
+    sync_schedule.interval = channel.sync_interval
+    return sync_schedule
+
+
+@api_router.put(
+    "/channels/{channel_name}/sync/schedule",
+    response_model=rest_models.MirrorSyncSchedule,
+    tags=["channels"],
+)
+def put_mirror_sync_schedule(
+    sync_interval: rest_models.MirrorSyncInterval,
+    channel: db_models.Channel = Depends(get_channel_or_fail),
+    dao: Dao = Depends(get_dao),
+    auth: authorization.Rules = Depends(get_rules),
+):
+    """Set the interval of the periodic synchronisation of a mirror channel.
+
+    The synchronisations are run on behalf of the user setting the interval."""
+
+    user_id = auth.assert_user()
+
+    if not can_channel_synchronize(channel):
+        raise HTTPException(
+            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+            detail=f"Channel {channel.name} is not a mirror channel",
+        )
+
+    auth.assert_synchronize_mirror(channel.name)
+
+    schedule = dao.set_mirror_sync_interval(
+        channel.name, sync_interval.interval, user_id
+    )
+    sync_schedule = rest_models.MirrorSyncSchedule.from_orm(schedule)
+    sync_schedule.interval = sync_interval.interval
+    return sync_schedule
+
+
 @api_router.get(
     "/channels/{channel_name}/members",
     response_model=List[rest_models.Member],
@@ -730,6 +886,115 @@ def delete_package_version(
     pkgstore.delete_file(channel_name, path)
 
 
+@api_router.post(
+    "/channels/{channel_name}/package-versions/copy",
+    status_code=201,
+    response_model=List[rest_models.PackageVersion],
+    tags=["packages"],
+)
+def post_copy_package_versions(
+    copy: rest_models.PackageVersionsCopy,
+    background_tasks: BackgroundTasks,
+    channel: db_models.Channel = Depends(
+        ChannelChecker(allow_proxy=False, allow_mirror=False)
+    ),
+    dao: Dao = Depends(get_dao),
+    auth: authorization.Rules = Depends(get_rules),
+):
+    """Copy (or move) package versions from another channel.
+
+    The metadata stored with the package versions is reused and the package
+    files are copied by the package store without being read."""
+
+    source_channel = dao.get_channel(copy.source_channel)
+    if not source_channel:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Channel {copy.source_channel} not found",
+        )
+    auth.assert_channel_read(source_channel)
+    if source_channel.name == channel.name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="source and destination channels are the same",
+        )
+
+    filenames_by_platform = defaultdict(list)
+    for path in copy.files:
+        platform, filename = path.split("/")
+        filenames_by_platform[platform].append(filename)
+
+    versions = []
+    for platform, filenames in filenames_by_platform.items():
+        versions.extend(
+            dao.get_package_versions_by_filenames(
+                source_channel.name, platform, filenames
+            )
+        )
+    paths = [f"{version.platform}/{version.filename}" for version in versions]
+    missing = sorted(set(copy.files) - set(paths))
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"package versions not found: {', '.join(missing)}",
+        )
+
+    filenames = [version.filename for version in versions]
+    user_id = assert_upload_package_files(channel.name, filenames, auth, copy.force)
+    if copy.move:
+        for package in {version.package for version in versions}:
+            auth.assert_package_delete(package)
+
+    if not copy.force:
+        for platform, platform_filenames in filenames_by_platform.items():
+            if dao.get_package_versions_by_filenames(
+                channel.name, platform, platform_filenames
+            ):
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT, detail="Duplicate"
+                )
+
+    condainfos = [
+        CondaInfo.from_repodata(
+            version.filename,
+            json.loads(version.info),
+            json.loads(version.package.channeldata or "{}"),
+        )
+        for version in versions
+    ]
+
+    pkgstore.create_channel(channel.name)
+    with TicToc("copying files"):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            list(
+                executor.map(
+                    lambda path: pkgstore.copy_file(
+                        source_channel.name, path, channel.name, path
+                    ),
+                    paths,
+                )
+            )
+
+    package_versions = add_package_versions(
+        channel.name, filenames, condainfos, dao, user_id, copy.force
+    )
+
+    if copy.move:
+        for platform, platform_filenames in filenames_by_platform.items():
+            dao.delete_package_versions(
+                source_channel.name, platform, platform_filenames
+            )
+        pkgstore.delete_files(source_channel.name, paths)
+        background_tasks.add_task(
+            indexing.update_indexes, dao, pkgstore, source_channel.name
+        )
+
+    # Background task to update indexes
+    background_tasks.add_task(indexing.update_indexes, dao, pkgstore, channel.name)
+
+    return package_versions
+
+
 @api_router.get(
     "/search/{query}", response_model=List[rest_models.PackageSearch], tags=["search"]
 )
@@ -804,8 +1069,10 @@ def post_api_key(
 )
 def post_file_to_package(
     background_tasks: BackgroundTasks,
+    response: Response,
     files: List[UploadFile] = File(...),
     force: Optional[bool] = Form(None),
+    asynchronous: Optional[bool] = Form(None),
     package: db_models.Package = Depends(get_package_or_fail),
     dao: Dao = Depends(get_dao),
     auth: authorization.Rules = Depends(get_rules),
@@ -813,28 +1080,85 @@ def post_file_to_package(
         ChannelChecker(allow_proxy=False, allow_mirror=False),
     ),
 ):
+    if asynchronous:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return accept_package_files(
+            package.channel.name,
+            files,
+            dao,
+            auth,
+            force,
+            background_tasks,
+            package=package,
+        )
+
     handle_package_files(package.channel.name, files, dao, auth, force, package=package)
 
 
 @api_router.post("/channels/{channel_name}/files/", status_code=201, tags=["files"])
 def post_file_to_channel(
     background_tasks: BackgroundTasks,
+    response: Response,
     files: List[UploadFile] = File(...),
     force: Optional[bool] = Form(None),
+    asynchronous: Optional[bool] = Form(None),
     channel: db_models.Channel = Depends(
         ChannelChecker(allow_proxy=False, allow_mirror=False)
     ),
     dao: Dao = Depends(get_dao),
     auth: authorization.Rules = Depends(get_rules),
 ):
+    if asynchronous:
+        # the indexes are updated by the job
+        response.status_code = status.HTTP_202_ACCEPTED
+        return accept_package_files(
+            channel.name, files, dao, auth, force, background_tasks
+        )
+
     handle_package_files(channel.name, files, dao, auth, force)
 
     # Background task to update indexes
     background_tasks.add_task(indexing.update_indexes, dao, pkgstore, channel.name)
 
 
-def _upload_package(channel_name: str, file, pkgstore):
-    condainfo = CondaInfo(file.file, file.filename)
+def _spooled_file_path(file) -> Optional[str]:
+    """Path of the file an upload was spooled to, None if it is in memory."""
+    spooled = file.file
+    if not getattr(spooled, "_rolled", True):
+        return None
+    fileobj = getattr(spooled, "_file", spooled)
+    name = getattr(fileobj, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        fileobj.flush()
+        return name
+    if isinstance(name, int):
+        # unnamed temporary file, other processes can open it through procfs
+        fd_path = f"/proc/{os.getpid()}/fd/{name}"
+        if os.path.exists(fd_path):
+            fileobj.flush()
+            return fd_path
+    return None
+
+
+def _read_package_info(file, metadata_executor=None) -> CondaInfo:
+    # only the metadata files are read here, the checksums of the package
+    # are computed while it is copied to the package store
+    if metadata_executor is not None:
+        file.file.seek(0, os.SEEK_END)
+        if file.file.tell() >= config.upload_metadata_process_min_size:
+            # the worker processes read the file the upload was spooled to,
+            # packages kept in memory are read here
+            path = _spooled_file_path(file)
+            if path is not None:
+                return metadata_executor.submit(
+                    read_package_info, path, file.filename
+                ).result()
+
+    return CondaInfo(file.file, file.filename, hash_file=False)
+
+
+def _upload_package(channel_name: str, file, pkgstore, metadata_executor=None):
+    condainfo = _read_package_info(file, metadata_executor)
     parts = file.filename.rsplit("-", 2)
 
     # check that the filename matches the package name
@@ -847,25 +1171,21 @@ def _upload_package(channel_name: str, file, pkgstore):
 
     logger.debug(f"uploading file {dest} from channel {channel_name} to package store")
 
-    pkgstore.add_package(file.file, channel_name, dest)
+    reader = HashingReader(file.file)
+    pkgstore.add_package(reader, channel_name, dest)
+    condainfo.set_file_hashes(reader.hashes())
     return condainfo
 
 
-def handle_package_files(
-    channel_name,
-    files,
-    dao,
-    auth,
-    force,
-    package=None,
-):
+def assert_upload_package_files(channel_name, filenames, auth, force):
+    """Check that the user can upload the files and return the user id."""
     user_id = auth.assert_user()
 
     # quick fail if not allowed to upload
     # note: we're checking later that `parts[0] == condainfo.package_name`
-    for file in files:
-        logger.info(f"FILE NAME: {file.filename}")
-        parts = file.filename.rsplit("-", 2)
+    for filename in filenames:
+        logger.info(f"FILE NAME: {filename}")
+        parts = filename.rsplit("-", 2)
         if len(parts) != 3:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="package filename wrong"
@@ -876,17 +1196,96 @@ def handle_package_files(
         if force:
             auth.assert_overwrite_package_version(channel_name, package_name)
 
-        logger.debug(f"adding file '{file.filename}' to channel '{channel_name}'")
+        logger.debug(f"adding file '{filename}' to channel '{channel_name}'")
+
+    return user_id
+
+
+def add_package_versions(
+    channel_name,
+    filenames,
+    condainfos,
+    dao,
+    user_id,
+    force,
+    package=None,
+):
+    """Register package files already stored in the package store.
+
+    All the package versions are added in a single transaction."""
+
+    versions = []
+    for filename, condainfo in zip(filenames, condainfos):
+        logger.debug(f"Handling {condainfo.info['name']} -> {filename}")
+
+        package_name = condainfo.info["name"]
+        parts = filename.rsplit("-", 2)
+
+        # check that the filename matches the package name
+        # TODO also validate version and build string
+        if parts[0] != condainfo.info["name"]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+        if package and (parts[0] != package.name or package_name != package.name):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+
+        versions.append(
+            {
+                "package_name": package_name,
+                "package_format": condainfo.package_format,
+                "platform": condainfo.info["subdir"],
+                "version": condainfo.info["version"],
+                "build_number": condainfo.info["build_number"],
+                "build_string": condainfo.info["build"],
+                "filename": filename,
+                "info": json.dumps(condainfo.info),
+                "sha256": condainfo.info["sha256"],
+                "md5": condainfo.info["md5"],
+                "size": condainfo.info["size"],
+                "channeldata": condainfo.channeldata,
+                "summary": condainfo.about.get("summary", "n/a"),
+                "description": condainfo.about.get("description", "n/a"),
+            }
+        )
+
+    try:
+        package_versions = dao.create_versions(
+            channel_name, versions, user_id, role=authorization.OWNER, upsert=force
+        )
+    except IntegrityError:
+        logger.error(f"duplicate package in channel '{channel_name}'")
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Duplicate")
+
+    with TicToc("Executing post hooks"):
+        for version, condainfo in zip(package_versions, condainfos):
+            pm.hook.post_add_package_version(version=version, condainfo=condainfo)
+
+    return package_versions
+
+
+def handle_package_files(
+    channel_name,
+    files,
+    dao,
+    auth,
+    force,
+    package=None,
+):
+    filenames = [file.filename for file in files]
+    user_id = assert_upload_package_files(channel_name, filenames, auth, force)
 
     pkgstore.create_channel(channel_name)
 
+    metadata_executor = get_metadata_executor()
+
     with TicToc("condainfos"):
         with ThreadPoolExecutor(max_workers=10) as executor:
             try:
                 condainfos = [
                     ci
                     for ci in executor.map(
-                        lambda file: _upload_package(channel_name, file, pkgstore),
+                        lambda file: _upload_package(
+                            channel_name, file, pkgstore, metadata_executor
+                        ),
                         files,
                     )
                 ]
@@ -895,60 +1294,327 @@ def handle_package_files(
                     status_code=status.HTTP_400_BAD_REQUEST, detail=e.detail
                 )
 
-    for file, condainfo in zip(files, condainfos):
-        logger.debug(f"Handling {condainfo.info['name']} -> {file.filename}")
+    add_package_versions(
+        channel_name, filenames, condainfos, dao, user_id, force, package
+    )
 
-        package_name = condainfo.info["name"]
-        parts = file.filename.rsplit("-", 2)
 
-        # check that the filename matches the package name
-        # TODO also validate version and build string
-        if parts[0] != condainfo.info["name"]:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
-        if package and (parts[0] != package.name or package_name != package.name):
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+# chunks larger than this are spooled to disk before they are stored
+UPLOAD_CHUNK_MEMORY_SIZE = 1024 * 1024
 
-        if not package and not dao.get_package(channel_name, package_name):
-            dao.create_package(
-                channel_name,
-                rest_models.Package(
-                    name=package_name,
-                    summary=condainfo.about.get("summary", "n/a"),
-                    description=condainfo.about.get("description", "n/a"),
-                ),
-                user_id,
-                authorization.OWNER,
-            )
 
-        # Update channeldata info
-        dao.update_package_channeldata(
-            channel_name, package_name, condainfo.channeldata
+def accept_package_files(
+    channel_name,
+    files,
+    dao,
+    auth,
+    force,
+    background_tasks,
+    package=None,
+):
+    """Store the files and add them to the channel in a job of the worker."""
+
+    filenames = [file.filename for file in files]
+    user_id = assert_upload_package_files(channel_name, filenames, auth, force)
+    if len(set(filenames)) != len(filenames) or any("/" in f for f in filenames):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="package filename wrong"
         )
 
-        try:
-            version = dao.create_version(
-                channel_name=channel_name,
-                package_name=package_name,
-                package_format=condainfo.package_format,
-                platform=condainfo.info["subdir"],
-                version=condainfo.info["version"],
-                build_number=condainfo.info["build_number"],
-                build_string=condainfo.info["build"],
-                filename=file.filename,
-                info=json.dumps(condainfo.info),
-                uploader_id=user_id,
-                upsert=force,
-            )
-        except IntegrityError:
-            logger.error(
-                f"duplicate package '{package_name}' in channel '{channel_name}'"
+    job_id = uuid.uuid4().bytes
+    pkgstore.create_channel(channel_name)
+
+    with TicToc("storing files"):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            list(
+                executor.map(
+                    lambda file: pkgstore.add_package(
+                        file.file, channel_name, upload_job_path(job_id, file.filename)
+                    ),
+                    files,
+                )
             )
+
+    upload_job = dao.create_upload_job(
+        job_id,
+        channel_name,
+        user_id,
+        filenames,
+        force,
+        package_name=package.name if package else None,
+    )
+    # the worker is only set up for asynchronous uploads
+    task = get_tasks_worker(background_tasks, dao, auth, get_remote_session(), config)
+    task.worker.execute(ingest_upload_job, job_id=job_id)
+
+    return rest_models.UploadJob.from_orm(upload_job)
+
+
+@api_router.get(
+    "/channels/{channel_name}/upload-jobs/{job_id}",
+    response_model=rest_models.UploadJob,
+    tags=["files"],
+)
+def get_upload_job(
+    job_id: uuid.UUID,
+    channel: db_models.Channel = Depends(
+        ChannelChecker(allow_proxy=False, allow_mirror=False)
+    ),
+    dao: Dao = Depends(get_dao),
+    auth: authorization.Rules = Depends(get_rules),
+):
+    """Return the status of the files of an asynchronous upload."""
+
+    user_id = auth.assert_user()
+    upload_job = dao.get_upload_job(job_id.bytes)
+
+    if not upload_job or upload_job.channel_name != channel.name:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Upload job {job_id} not found",
+        )
+
+    if upload_job.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Upload job of another user"
+        )
+
+    # the worker running a job that is not finished in time probably died
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=config.upload_job_timeout
+    )
+    if upload_job.status in ("pending", "running") and dao.expire_upload_job(
+        upload_job, stale_before, UPLOAD_JOB_TIMEOUT_DETAIL
+    ):
+        pkgstore.delete_files(
+            channel.name,
+            [
+                upload_job_path(upload_job.id, item["filename"])
+                for item in json.loads(upload_job.files)
+                if item.get("detail") == UPLOAD_JOB_TIMEOUT_DETAIL
+            ],
+        )
+
+    return upload_job
+
+
+def _upload_session_expiry() -> datetime.datetime:
+    return datetime.datetime.utcnow() + datetime.timedelta(
+        seconds=config.upload_session_expiry
+    )
+
+
+def _upload_session_model(upload_session: db_models.UploadSession):
+    return rest_models.UploadSession.from_orm(upload_session).copy(
+        update={"min_chunk_size": pkgstore.min_upload_part_size}
+    )
+
+
+@api_router.post(
+    "/channels/{channel_name}/upload-sessions",
+    status_code=201,
+    response_model=rest_models.UploadSession,
+    tags=["files"],
+)
+def post_upload_session(
+    data: rest_models.UploadSessionCreate,
+    background_tasks: BackgroundTasks,
+    channel: db_models.Channel = Depends(
+        ChannelChecker(allow_proxy=False, allow_mirror=False)
+    ),
+    dao: Dao = Depends(get_dao),
+    auth: authorization.Rules = Depends(get_rules),
+):
+    """Start the upload of a package file in several chunks."""
+
+    user_id = assert_upload_package_files(channel.name, [data.filename], auth, False)
+
+    session_id = uuid.uuid4()
+    pkgstore.create_channel(channel.name)
+    try:
+        store_upload_id = pkgstore.start_upload(
+            channel.name, f"{UPLOADS_DIR}/{session_id.hex}"
+        )
+    except NotImplementedError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+
+    upload_session = dao.create_upload_session(
+        session_id.bytes,
+        channel.name,
+        user_id,
+        data,
+        store_upload_id,
+        _upload_session_expiry(),
+    )
+
+    # discard the sessions that were abandoned
+    background_tasks.add_task(cleanup_upload_sessions, dao, pkgstore)
+
+    return _upload_session_model(upload_session)
+
+
+@api_router.get(
+    "/channels/{channel_name}/upload-sessions/{session_id}",
+    response_model=rest_models.UploadSession,
+    tags=["files"],
+)
+def get_upload_session(
+    upload_session: db_models.UploadSession = Depends(get_upload_session_or_fail),
+):
+    """Return the number of bytes already uploaded to resume an upload."""
+    return _upload_session_model(upload_session)
+
+
+def _store_upload_chunk(
+    upload_session: db_models.UploadSession, offset: int, chunk, dao: Dao
+):
+    chunk.seek(0, os.SEEK_END)
+    size = chunk.tell()
+    chunk.seek(0)
+
+    if offset != upload_session.offset:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"expected offset {upload_session.offset}",
+        )
+    end = offset + size
+    if not size or end > upload_session.size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"chunk outside of the file (size {upload_session.size})",
+        )
+    if size < pkgstore.min_upload_part_size and end != upload_session.size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"chunks must be at least {pkgstore.min_upload_part_size} bytes",
+        )
+
+    # a part that failed is uploaded again with the same part number
+    part_number = len(json.loads(upload_session.parts)) + 1
+    part = pkgstore.upload_part(
+        upload_session.channel_name,
+        upload_session_path(upload_session.id),
+        upload_session.store_upload_id,
+        part_number,
+        offset,
+        chunk,
+    )
+
+    if not dao.add_upload_session_part(
+        upload_session, offset, size, part, _upload_session_expiry()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"expected offset {upload_session.offset}",
+        )
+
+    return _upload_session_model(upload_session)
+
+
+@api_router.put(
+    "/channels/{channel_name}/upload-sessions/{session_id}",
+    response_model=rest_models.UploadSession,
+    tags=["files"],
+)
+async def put_upload_session_chunk(
+    request: Request,
+    offset: int,
+    upload_session: db_models.UploadSession = Depends(get_upload_session_or_fail),
+    dao: Dao = Depends(get_dao),
+):
+    """Upload the chunk of the file starting at `offset` (raw request body).
+
+    The chunks must be uploaded in order; after a failure, the upload is
+    resumed from the offset returned by the GET endpoint."""
+
+    # the chunk is streamed to a temporary file, only small chunks are kept
+    # in memory
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_MEMORY_SIZE) as chunk:
+        async for data in request.stream():
+            chunk.write(data)
+        return await run_in_threadpool(
+            _store_upload_chunk, upload_session, offset, chunk, dao
+        )
+
+
+@api_router.post(
+    "/channels/{channel_name}/upload-sessions/{session_id}/finalize",
+    status_code=201,
+    tags=["files"],
+)
+def post_upload_session_finalize(
+    background_tasks: BackgroundTasks,
+    force: bool = False,
+    upload_session: db_models.UploadSession = Depends(get_upload_session_or_fail),
+    dao: Dao = Depends(get_dao),
+    auth: authorization.Rules = Depends(get_rules),
+):
+    """Add the package uploaded in the session to the channel."""
+
+    channel_name = upload_session.channel_name
+    filename = upload_session.filename
+    user_id = assert_upload_package_files(channel_name, [filename], auth, force)
+
+    if upload_session.offset != upload_session.size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                f"upload incomplete: {upload_session.offset} of "
+                f"{upload_session.size} bytes"
+            ),
+        )
+
+    staged_path = upload_session_path(upload_session.id)
+    pkgstore.complete_upload(
+        channel_name,
+        staged_path,
+        upload_session.store_upload_id,
+        json.loads(upload_session.parts),
+    )
+
+    # the session cannot be resumed once the parts are assembled
+    expected_sha256 = upload_session.sha256
+    dao.delete_upload_session(upload_session)
+
+    try:
+        with pkgstore.serve_path(channel_name, staged_path) as fid:
+            condainfo = CondaInfo(fid, filename)
+        if expected_sha256 and condainfo.info["sha256"] != expected_sha256:
             raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT, detail="Duplicate"
+                status_code=status.HTTP_400_BAD_REQUEST, detail="sha256 mismatch"
             )
+        if filename.rsplit("-", 2)[0] != condainfo.info["name"]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+        dest = os.path.join(condainfo.info["subdir"], filename)
+        pkgstore.move_file(channel_name, staged_path, dest)
+    except exceptions.PackageError as e:
+        pkgstore.delete_files(channel_name, [staged_path])
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.detail)
+    except Exception:
+        pkgstore.delete_files(channel_name, [staged_path])
+        raise
 
-        with TicToc("Executing post hooks"):
-            pm.hook.post_add_package_version(version=version, condainfo=condainfo)
+    add_package_versions(channel_name, [filename], [condainfo], dao, user_id, force)
+
+    # Background task to update indexes
+    background_tasks.add_task(indexing.update_indexes, dao, pkgstore, channel_name)
+
+
+@api_router.delete(
+    "/channels/{channel_name}/upload-sessions/{session_id}", tags=["files"]
+)
+def delete_upload_session(
+    upload_session: db_models.UploadSession = Depends(get_upload_session_or_fail),
+    dao: Dao = Depends(get_dao),
+):
+    """Abort an upload and discard the chunks already uploaded."""
+
+    pkgstore.abort_upload(
+        upload_session.channel_name,
+        upload_session_path(upload_session.id),
+        upload_session.store_upload_id,
+    )
+    dao.delete_upload_session(upload_session)
 
 
 app.include_router(
@@ -966,7 +1632,7 @@ def invalid_api():
 async def serve_path(
     path,
     channel: db_models.Channel = Depends(get_channel_allow_proxy),
-    cache: LocalCache = Depends(LocalCache),
+    cache=Depends(get_proxy_cache),
     session=Depends(get_remote_session),
 ):
     if channel.mirror_channel_url and channel.mirror_mode == "proxy":
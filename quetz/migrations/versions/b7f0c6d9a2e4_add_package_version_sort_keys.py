@@ -0,0 +1,288 @@
+"""add package version sort keys
+
+Revision ID: b7f0c6d9a2e4
+Revises: 5d3a8e61c0f4
+Create Date: 2021-02-24 10:12:41.532907
+
+"""
+import re
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b7f0c6d9a2e4'
+down_revision = '5d3a8e61c0f4'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# The sort keys are computed with a copy of quetz.versionorder.sort_key as it
+# was when this migration was written: the keys written here must not change
+# when quetz.versionorder is modified later.
+
+_version_check_re = re.compile(r'^[\*\.\+!_0-9a-z]+$')
+_version_split_re = re.compile(r'([0-9]+|[*]+|[^0-9*]+)')
+
+_STR = b'\x01'
+_ZEROS_STR = b'\x02'
+_END = b'\x03'
+_ZEROS_NUM = b'\x04'
+_NUM = b'\x05'
+_INF = b'\x06'
+_MAX_ZEROS = 0xFFFFFFFF
+
+
+def _parse_version(vstr):
+    """components of the version and of the local version (VersionOrder)"""
+    version = vstr.strip().rstrip().lower()
+    if version == '':
+        raise ValueError(vstr)
+    invalid = not _version_check_re.match(version)
+    if invalid and '-' in version and '_' not in version:
+        version = version.replace('-', '_')
+        invalid = not _version_check_re.match(version)
+    if invalid:
+        raise ValueError(vstr)
+
+    split_epoch = version.split('!')
+    if len(split_epoch) == 1:
+        epoch = ['0']
+    elif len(split_epoch) == 2:
+        if not split_epoch[0].isdigit():
+            raise ValueError(vstr)
+        epoch = [split_epoch[0]]
+        version = split_epoch[1]
+    else:
+        raise ValueError(vstr)
+
+    split_local = version.split('+')
+    if len(split_local) == 1:
+        local = []
+    elif len(split_local) == 2:
+        local = split_local[1].replace('_', '.').split('.')
+        version = split_local[0]
+    else:
+        raise ValueError(vstr)
+
+    if version[-1] == "_":
+        split_version = version[:-1].replace('_', '.').split('.')
+        split_version[-1] += "_"
+    else:
+        split_version = version.replace('_', '.').split('.')
+    version = epoch + split_version
+
+    for v in (version, local):
+        for k in range(len(v)):
+            c = _version_split_re.findall(v[k])
+            if not c:
+                raise ValueError(vstr)
+            for j in range(len(c)):
+                if c[j].isdigit():
+                    c[j] = int(c[j])
+                elif c[j] == 'post':
+                    c[j] = float('inf')
+                elif c[j] == 'dev':
+                    c[j] = 'DEV'
+            if v[k][0].isdigit():
+                v[k] = c
+            else:
+                v[k] = [0] + c
+    return version, local
+
+
+def _encode_int(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return bytes([len(data)]) + data
+
+
+def _encode_sequence(items, sign, encode):
+    encoded = []
+    zeros = 0
+    for item in items:
+        item_sign = sign(item)
+        if item_sign == 0:
+            zeros += 1
+            continue
+        if zeros:
+            if item_sign < 0:
+                encoded.append(_ZEROS_STR + zeros.to_bytes(4, 'big'))
+            else:
+                encoded.append(_ZEROS_NUM + (_MAX_ZEROS - zeros).to_bytes(4, 'big'))
+            zeros = 0
+        encoded.append(encode(item, item_sign))
+    encoded.append(_END)
+    return b''.join(encoded)
+
+
+def _subcomponent_sign(c):
+    if isinstance(c, str):
+        return -1
+    return 1 if c else 0
+
+
+def _encode_subcomponent(c, sign):
+    if isinstance(c, str):
+        return _STR + c.encode() + b'\x00'
+    if c == float('inf'):
+        return _INF
+    return _NUM + _encode_int(c)
+
+
+def _component_sign(component):
+    for c in component:
+        sign = _subcomponent_sign(c)
+        if sign:
+            return sign
+    return 0
+
+
+def _encode_component(component, sign):
+    return (_STR if sign < 0 else _NUM) + _encode_sequence(
+        component, _subcomponent_sign, _encode_subcomponent
+    )
+
+
+def _encode_components(components):
+    return _encode_sequence(components, _component_sign, _encode_component)
+
+
+def sort_key(version, build_number=0):
+    components, local = _parse_version(version)
+    return (
+        _encode_components(components)
+        + _encode_components(local)
+        + _encode_int(int(build_number or 0))
+    )
+
+
+package_versions = sa.sql.table(
+    'package_versions',
+    sa.sql.column('id', sa.LargeBinary(length=16)),
+    sa.sql.column('channel_name', sa.String()),
+    sa.sql.column('package_name', sa.String()),
+    sa.sql.column('version', sa.String()),
+    sa.sql.column('build_number', sa.Integer()),
+    sa.sql.column('version_order', sa.Integer()),
+    sa.sql.column('sort_key', sa.LargeBinary()),
+)
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('package_versions') as batch_op:
+        batch_op.add_column(sa.Column('sort_key', sa.LargeBinary(), nullable=True))
+    # ### end Alembic commands ###
+
+    # compute the sort keys of existing package versions
+    conn = op.get_bind()
+
+    update = (
+        package_versions.update()
+        .where(package_versions.c.id == sa.bindparam('_id'))
+        .values(sort_key=sa.bindparam('_sort_key'))
+    )
+
+    # read the package versions in batches to keep the memory bounded
+    last_id = None
+    while True:
+        query = sa.select(
+            [
+                package_versions.c.id,
+                package_versions.c.version,
+                package_versions.c.build_number,
+            ]
+        )
+        if last_id is not None:
+            query = query.where(package_versions.c.id > last_id)
+        rows = conn.execute(
+            query.order_by(package_versions.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        values = []
+        for version_id, version, build_number in rows:
+            try:
+                key = sort_key(version, build_number)
+            except (AttributeError, ValueError):
+                continue
+            values.append({'_id': version_id, '_sort_key': key})
+        if values:
+            conn.execute(update, values)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('package_versions') as batch_op:
+        batch_op.create_index(
+            'package_version_sort_index',
+            ['channel_name', 'package_name', 'sort_key'],
+            unique=False,
+        )
+        batch_op.drop_column('version_order')
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('package_versions') as batch_op:
+        batch_op.add_column(sa.Column('version_order', sa.Integer(), nullable=True))
+        batch_op.drop_index('package_version_sort_index')
+    # ### end Alembic commands ###
+
+    # number the versions of each package from the newest one, the keys are
+    # computed again rather than read from the sort_key column, which may
+    # have been written by a later version of the encoding
+    conn = op.get_bind()
+
+    update = (
+        package_versions.update()
+        .where(package_versions.c.id == sa.bindparam('_id'))
+        .values(version_order=sa.bindparam('_version_order'))
+    )
+
+    def number_versions(versions):
+        def key(row):
+            try:
+                # invalid versions come last
+                return (1, sort_key(row[1], row[2]))
+            except (AttributeError, ValueError):
+                return (0, b'')
+
+        versions.sort(key=key, reverse=True)
+        values = [
+            {'_id': version_id, '_version_order': version_order}
+            for version_order, (version_id, _, _) in enumerate(versions)
+        ]
+        if values:
+            conn.execute(update, values)
+
+    rows = conn.execute(
+        sa.select(
+            [
+                package_versions.c.id,
+                package_versions.c.channel_name,
+                package_versions.c.package_name,
+                package_versions.c.version,
+                package_versions.c.build_number,
+            ]
+        ).order_by(
+            package_versions.c.channel_name,
+            package_versions.c.package_name,
+        )
+    ).fetchall()
+    versions = []
+    package = None
+    for version_id, channel_name, package_name, version, build_number in rows:
+        if (channel_name, package_name) != package:
+            number_versions(versions)
+            package = (channel_name, package_name)
+            versions = []
+        versions.append((version_id, version, build_number))
+    number_versions(versions)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('package_versions') as batch_op:
+        batch_op.drop_column('sort_key')
+    # ### end Alembic commands ###
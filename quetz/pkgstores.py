@@ -3,13 +3,15 @@
 
 import abc
 import contextlib
+import hashlib
 import os
 import os.path as path
 import shutil
 import tempfile
+import uuid
 from contextlib import contextmanager
 from os import PathLike
-from typing import IO, BinaryIO, List, NoReturn, Union
+from typing import IO, BinaryIO, List, NoReturn, Optional, Union
 
 import fsspec
 
@@ -19,6 +21,37 @@ File = BinaryIO
 
 StrPath = Union[str, PathLike]
 
+# directory (LocalStore) or key prefix (S3Store) of the package files stored
+# once by content when the store deduplicates them
+BLOBS_DIR = ".blobs"
+
+CHUNK_SIZE = 10 * 1024 * 1024
+
+# content of the files pointing to a blob in S3Store
+POINTER_PREFIX = b"quetz-blob sha256:"
+POINTER_SIZE = len(POINTER_PREFIX) + 64
+
+
+def _copy_and_hash(src: File, dest: File) -> str:
+    """copy a file and return its sha256 checksum"""
+    sha256 = hashlib.sha256()
+    for data in iter(lambda: src.read(CHUNK_SIZE), b""):
+        sha256.update(data)
+        dest.write(data)
+    return sha256.hexdigest()
+
+
+def _stream_sha256(src: File) -> str:
+    sha256 = hashlib.sha256()
+    for data in iter(lambda: src.read(CHUNK_SIZE), b""):
+        sha256.update(data)
+    return sha256.hexdigest()
+
+
+def _file_sha256(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return _stream_sha256(f)
+
 
 class PackageStore(abc.ABC):
     @abc.abstractmethod
@@ -51,11 +84,110 @@ class PackageStore(abc.ABC):
     def delete_file(self, channel: str, destination: str):
         """remove file from package store"""
 
+    def delete_files(self, channel: str, destinations: List[str]):
+        """remove several files from package store, missing files are ignored"""
+        for destination in destinations:
+            try:
+                self.delete_file(channel, destination)
+            except FileNotFoundError:
+                pass
+
+    # minimum size of the parts of a multipart upload (except the last one)
+    min_upload_part_size = 0
+
+    def start_upload(self, channel: str, destination: str) -> Optional[str]:
+        """start the upload of a file in several parts
+
+        returns the id of the upload in the package store (if any), which is
+        passed to the other upload methods"""
+        raise NotImplementedError("multipart uploads are not supported")
+
+    def upload_part(
+        self,
+        channel: str,
+        destination: str,
+        upload_id: Optional[str],
+        part_number: int,
+        offset: int,
+        data: File,
+    ) -> Optional[dict]:
+        """store the part ``part_number`` (starting from 1) of an upload
+
+        ``offset`` is the position of the part in the file, the parts are
+        uploaded in order and a part can be uploaded again if it failed.
+        Returns information about the part that must be passed to
+        :meth:`complete_upload`."""
+        raise NotImplementedError("multipart uploads are not supported")
+
+    def complete_upload(
+        self,
+        channel: str,
+        destination: str,
+        upload_id: Optional[str],
+        parts: List[Optional[dict]],
+    ):
+        """assemble the parts of an upload in the file ``destination``"""
+        raise NotImplementedError("multipart uploads are not supported")
+
+    def abort_upload(self, channel: str, destination: str, upload_id: Optional[str]):
+        """discard the parts of an upload"""
+        raise NotImplementedError("multipart uploads are not supported")
+
+    def move_file(self, channel: str, source: str, destination: str):
+        """move a file of a channel, replacing ``destination`` if it exists"""
+        raise NotImplementedError("moving files is not supported")
+
+    def copy_file(
+        self, source_channel: str, source: str, channel: str, destination: str
+    ):
+        """copy a package file from a channel to another one
+
+        the stores override it to copy the file without reading it"""
+        with self.serve_path(source_channel, source) as f:
+            self.add_package(f, channel, destination)
+
 
 class LocalStore(PackageStore):
     def __init__(self, config):
         self.fs: fsspec.AbstractFileSystem = fsspec.filesystem("file")
         self.channels_dir = config['channels_dir']
+        # the package files of all the channels are hard links to a single
+        # copy of each content, the number of links counts the references
+        self.deduplicate = config.get('deduplicate', False)
+
+    def _blob_path(self, sha256: str) -> str:
+        return path.join(self.channels_dir, BLOBS_DIR, "sha256", sha256[:2], sha256)
+
+    def _link_blob(self, full_path: str, sha256: str):
+        """replace the file by a link to the blob of its content"""
+        blob_path = self._blob_path(sha256)
+        self.fs.makedirs(path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(full_path, blob_path)
+        except FileExistsError:
+            tmp_path = path.join(path.dirname(full_path), f".{uuid.uuid4().hex}")
+            os.link(blob_path, tmp_path)
+            os.replace(tmp_path, full_path)
+        except OSError:
+            # hard links not supported, the file is kept as it is
+            pass
+
+    def _unreferenced_blob(self, full_path: str) -> Optional[str]:
+        """blob that is referenced only by the file (if any)
+
+        only the last reference to a blob is hashed to find it"""
+        if not self.deduplicate or not path.isfile(full_path):
+            return None
+        if os.stat(full_path).st_nlink != 2:
+            return None
+        blob_path = self._blob_path(_file_sha256(full_path))
+        if path.exists(blob_path) and path.samefile(blob_path, full_path):
+            return blob_path
+        return None
+
+    def _release_blob(self, blob_path: Optional[str]):
+        if blob_path and os.stat(blob_path).st_nlink == 1:
+            os.remove(blob_path)
 
     @contextmanager
     def _atomic_open(self, channel: str, destination: StrPath, mode="wb") -> IO:
@@ -82,8 +214,17 @@ class LocalStore(PackageStore):
 
     def add_package(self, package: File, channel: str, destination: str) -> NoReturn:
 
+        if not self.deduplicate:
+            with self._atomic_open(channel, destination) as f:
+                shutil.copyfileobj(package, f)
+            return
+
+        full_path = path.join(self.channels_dir, channel, destination)
+        replaced_blob = self._unreferenced_blob(full_path)
         with self._atomic_open(channel, destination) as f:
-            shutil.copyfileobj(package, f)
+            sha256 = _copy_and_hash(package, f)
+        self._link_blob(full_path, sha256)
+        self._release_blob(replaced_blob)
 
     def add_file(
         self, data: Union[str, bytes], channel: str, destination: StrPath
@@ -94,12 +235,81 @@ class LocalStore(PackageStore):
             f.write(data)
 
     def delete_file(self, channel: str, destination: str):
-        self.fs.delete(path.join(self.channels_dir, channel, destination))
+        full_path = path.join(self.channels_dir, channel, destination)
+        blob_path = self._unreferenced_blob(full_path)
+        self.fs.delete(full_path)
+        self._release_blob(blob_path)
 
     def serve_path(self, channel, src):
 
         return self.fs.open(path.join(self.channels_dir, channel, src)).f
 
+    def start_upload(self, channel: str, destination: str) -> Optional[str]:
+        full_path = path.join(self.channels_dir, channel, destination)
+        self.fs.makedirs(path.dirname(full_path), exist_ok=True)
+        open(full_path, "wb").close()
+        return None
+
+    def upload_part(
+        self,
+        channel: str,
+        destination: str,
+        upload_id: Optional[str],
+        part_number: int,
+        offset: int,
+        data: File,
+    ) -> Optional[dict]:
+        # the parts are written in place, a part uploaded again replaces
+        # whatever was written after its offset
+        with open(path.join(self.channels_dir, channel, destination), "r+b") as f:
+            f.seek(offset)
+            shutil.copyfileobj(data, f)
+            f.truncate()
+        return None
+
+    def complete_upload(
+        self,
+        channel: str,
+        destination: str,
+        upload_id: Optional[str],
+        parts: List[Optional[dict]],
+    ):
+        if self.deduplicate:
+            full_path = path.join(self.channels_dir, channel, destination)
+            self._link_blob(full_path, _file_sha256(full_path))
+
+    def abort_upload(self, channel: str, destination: str, upload_id: Optional[str]):
+        try:
+            self.delete_file(channel, destination)
+        except FileNotFoundError:
+            pass
+
+    def move_file(self, channel: str, source: str, destination: str):
+        channel_dir = path.join(self.channels_dir, channel)
+        full_path = path.join(channel_dir, destination)
+        self.fs.makedirs(path.dirname(full_path), exist_ok=True)
+        replaced_blob = self._unreferenced_blob(full_path)
+        os.replace(path.join(channel_dir, source), full_path)
+        self._release_blob(replaced_blob)
+
+    def copy_file(
+        self, source_channel: str, source: str, channel: str, destination: str
+    ):
+        # the package files are never modified in place, so the copy can be
+        # a hard link (which is also a reference to the blob of the file)
+        source_path = path.join(self.channels_dir, source_channel, source)
+        full_path = path.join(self.channels_dir, channel, destination)
+        self.fs.makedirs(path.dirname(full_path), exist_ok=True)
+        replaced_blob = self._unreferenced_blob(full_path)
+        tmp_path = path.join(path.dirname(full_path), f".{uuid.uuid4().hex}")
+        try:
+            os.link(source_path, tmp_path)
+        except OSError:
+            # hard links not supported (a missing file raises again here)
+            shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, full_path)
+        self._release_blob(replaced_blob)
+
     def list_files(self, channel: str):
         channel_dir = os.path.join(self.channels_dir, channel)
         return [os.path.relpath(f, channel_dir) for f in self.fs.find(channel_dir)]
@@ -129,6 +339,14 @@ class S3Store(PackageStore):
         self.bucket_prefix = config['bucket_prefix']
         self.bucket_suffix = config['bucket_suffix']
 
+        # the package files of the channels are small pointers to a single
+        # copy of each content in the blobs bucket, which also holds an
+        # empty object per reference
+        self.deduplicate = config.get('deduplicate', False)
+        self.blobs_bucket = config.get('blobs_bucket')
+        if self.deduplicate and not self.blobs_bucket:
+            raise ConfigError("s3 blobs_bucket is required to deduplicate packages")
+
     @contextlib.contextmanager
     def _get_fs(self):
         try:
@@ -139,6 +357,53 @@ class S3Store(PackageStore):
     def _bucket_map(self, name):
         return f"{self.bucket_prefix}{name}{self.bucket_suffix}"
 
+    # imposed by S3
+    min_upload_part_size = 5 * 1024 * 1024
+
+    def _blob_path(self, sha256: str) -> str:
+        return path.join(self.blobs_bucket, BLOBS_DIR, "sha256", sha256[:2], sha256)
+
+    def _refs_path(self, sha256: str) -> str:
+        return path.join(self.blobs_bucket, BLOBS_DIR, "refs", sha256)
+
+    def _ref_path(self, sha256: str, channel: str, destination: str) -> str:
+        return path.join(
+            self._refs_path(sha256), self._bucket_map(channel), destination
+        )
+
+    def _read_pointer(self, fs, file_path: str) -> Optional[str]:
+        """sha256 of the blob the file points to (if it is a pointer)"""
+        if not self.deduplicate:
+            return None
+        try:
+            if fs.size(file_path) != POINTER_SIZE:
+                return None
+        except FileNotFoundError:
+            return None
+        data = fs.cat(file_path)
+        if data.startswith(POINTER_PREFIX):
+            return data[len(POINTER_PREFIX) :].decode()  # noqa: E203
+        return None
+
+    def _add_reference(self, fs, sha256: str, channel: str, destination: str):
+        """point the file to the blob, the blob must exist"""
+        file_path = path.join(self._bucket_map(channel), destination)
+        replaced = self._read_pointer(fs, file_path)
+        with fs.open(self._ref_path(sha256, channel, destination), "wb") as f:
+            f.write(b"")
+        with fs.open(file_path, "wb", acl="private") as f:
+            f.write(POINTER_PREFIX + sha256.encode())
+        if replaced and replaced != sha256:
+            self._remove_reference(fs, replaced, channel, destination)
+
+    def _remove_reference(self, fs, sha256: str, channel: str, destination: str):
+        """remove a reference to a blob and the blob if it was the last one"""
+        fs.rm(self._ref_path(sha256, channel, destination))
+        refs_path = self._refs_path(sha256)
+        fs.invalidate_cache(refs_path)
+        if not fs.find(refs_path):
+            fs.rm(self._blob_path(sha256))
+
     def create_channel(self, name):
         """Create the bucket if one doesn't already exist
 
@@ -154,6 +419,9 @@ class S3Store(PackageStore):
                 pass
 
     def add_package(self, package: File, channel: str, destination: str) -> NoReturn:
+        if self.deduplicate:
+            return self._add_package_blob(package, channel, destination)
+
         with self._get_fs() as fs:
             bucket = self._bucket_map(channel)
             with fs.transaction:
@@ -163,6 +431,24 @@ class S3Store(PackageStore):
                     # use a chunk size of 10 Megabytes
                     shutil.copyfileobj(package, pkg, 10 * 1024 * 1024)
 
+    def _add_package_blob(self, package: File, channel: str, destination: str):
+        with self._get_fs() as fs:
+            # the content is written once and moved to its blob, unless a
+            # blob with the same content already exists
+            tmp_path = path.join(self.blobs_bucket, BLOBS_DIR, "tmp", uuid.uuid4().hex)
+            with fs.open(tmp_path, "wb", acl="private") as f:
+                sha256 = _copy_and_hash(package, f)
+            self._move_to_blob(fs, tmp_path, sha256)
+            self._add_reference(fs, sha256, channel, destination)
+
+    def _move_to_blob(self, fs, file_path: str, sha256: str):
+        """move the file to the blob of its content (if there is none yet)"""
+        blob_path = self._blob_path(sha256)
+        if fs.exists(blob_path):
+            fs.rm(file_path)
+        else:
+            fs.mv(file_path, blob_path)
+
     def add_file(
         self, data: Union[str, bytes], channel: str, destination: StrPath
     ) -> NoReturn:
@@ -179,13 +465,133 @@ class S3Store(PackageStore):
 
     def serve_path(self, channel, src):
         with self._get_fs() as fs:
-            return fs.open(path.join(self._bucket_map(channel), src))
+            file_path = path.join(self._bucket_map(channel), src)
+            sha256 = self._read_pointer(fs, file_path)
+            if sha256:
+                return fs.open(self._blob_path(sha256))
+            return fs.open(file_path)
+
+    def start_upload(self, channel: str, destination: str) -> Optional[str]:
+        with self._get_fs() as fs:
+            response = fs.call_s3(
+                "create_multipart_upload",
+                Bucket=self._bucket_map(channel),
+                Key=destination,
+                ACL="private",
+            )
+        return response["UploadId"]
+
+    def upload_part(
+        self,
+        channel: str,
+        destination: str,
+        upload_id: Optional[str],
+        part_number: int,
+        offset: int,
+        data: File,
+    ) -> Optional[dict]:
+        # the parts are small enough to be sent in a single request
+        with self._get_fs() as fs:
+            response = fs.call_s3(
+                "upload_part",
+                Bucket=self._bucket_map(channel),
+                Key=destination,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data.read(),
+            )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def complete_upload(
+        self,
+        channel: str,
+        destination: str,
+        upload_id: Optional[str],
+        parts: List[Optional[dict]],
+    ):
+        with self._get_fs() as fs:
+            fs.call_s3(
+                "complete_multipart_upload",
+                Bucket=self._bucket_map(channel),
+                Key=destination,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            file_path = path.join(self._bucket_map(channel), destination)
+            fs.invalidate_cache(file_path)
+            if self.deduplicate:
+                with fs.open(file_path) as f:
+                    sha256 = _stream_sha256(f)
+                self._move_to_blob(fs, file_path, sha256)
+                self._add_reference(fs, sha256, channel, destination)
+
+    def abort_upload(self, channel: str, destination: str, upload_id: Optional[str]):
+        with self._get_fs() as fs:
+            fs.call_s3(
+                "abort_multipart_upload",
+                Bucket=self._bucket_map(channel),
+                Key=destination,
+                UploadId=upload_id,
+            )
+
+    def move_file(self, channel: str, source: str, destination: str):
+        channel_bucket = self._bucket_map(channel)
+
+        with self._get_fs() as fs:
+            source_path = path.join(channel_bucket, source)
+            sha256 = self._read_pointer(fs, source_path)
+            if sha256:
+                # the references are kept by file path, so the pointer is
+                # written again at the destination with its own reference
+                self._add_reference(fs, sha256, channel, destination)
+                fs.rm(source_path)
+                fs.rm(self._ref_path(sha256, channel, source))
+                return
+
+            file_path = path.join(channel_bucket, destination)
+            replaced = self._read_pointer(fs, file_path)
+            fs.mv(source_path, file_path)
+            if replaced:
+                self._remove_reference(fs, replaced, channel, destination)
+
+    def copy_file(
+        self, source_channel: str, source: str, channel: str, destination: str
+    ):
+        with self._get_fs() as fs:
+            source_path = path.join(self._bucket_map(source_channel), source)
+            sha256 = self._read_pointer(fs, source_path)
+            if sha256:
+                # a new pointer to the same blob
+                self._add_reference(fs, sha256, channel, destination)
+                return
+
+            file_path = path.join(self._bucket_map(channel), destination)
+            replaced = self._read_pointer(fs, file_path)
+            # the object is copied by the server, without downloading it
+            fs.copy(source_path, file_path)
+            if replaced:
+                self._remove_reference(fs, replaced, channel, destination)
 
     def delete_file(self, channel: str, dest: str):
         channel_bucket = self._bucket_map(channel)
 
         with self._get_fs() as fs:
-            fs.delete(path.join(channel_bucket, dest))
+            file_path = path.join(channel_bucket, dest)
+            sha256 = self._read_pointer(fs, file_path)
+            fs.delete(file_path)
+            if sha256:
+                self._remove_reference(fs, sha256, channel, dest)
+
+    def delete_files(self, channel: str, destinations: List[str]):
+        if self.deduplicate:
+            # the references of the blobs are removed file by file
+            return super().delete_files(channel, destinations)
+
+        channel_bucket = self._bucket_map(channel)
+
+        # s3fs sends the keys in batches of multi-object delete requests
+        with self._get_fs() as fs:
+            fs.rm([path.join(channel_bucket, dest) for dest in destinations])
 
     def list_files(self, channel: str):
         def remove_prefix(text, prefix):
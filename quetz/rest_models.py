@@ -73,6 +73,9 @@ class ChannelBase(BaseModel):
     private: bool
     mirror_channel_url: Optional[str] = Field(None, regex="^(http|https)://.+")
     mirror_mode: Optional[MirrorMode] = None
+    sync_interval: Optional[int] = Field(
+        None, title="interval of the periodic synchronisation in seconds", ge=1
+    )
 
     class Config:
         orm_mode = True
@@ -81,6 +84,7 @@ class ChannelBase(BaseModel):
 class ChannelActionEnum(str, Enum):
     synchronize = 'synchronize'
     reindex = "reindex"
+    prewarm_cache = "prewarm_cache"
 
 
 class ChannelMetadata(BaseModel):
@@ -109,6 +113,8 @@ class Channel(ChannelBase):
             raise ValueError(
                 "'mirror_mode' provided but 'mirror_channel_url' is undefined"
             )
+        if values.get("sync_interval") and mirror_mode != MirrorMode.mirror:
+            raise ValueError("'sync_interval' is only supported by mirror channels")
 
         return values
 
@@ -193,5 +199,133 @@ class PackageVersion(BaseModel):
             return v
 
 
+class MirrorSyncProgress(BaseModel):
+    subdir: str
+    status: str
+    n_packages: int = Field(0, title="number of packages in the upstream repodata")
+    position: int = Field(0, title="number of packages processed so far")
+    last_filename: Optional[str] = Field(None, title="last package processed")
+    batch: int = Field(0, title="number of batches processed")
+    repodata_etag: Optional[str]
+    duration: Optional[float] = Field(
+        None, title="duration of the last synchronisation in seconds"
+    )
+    download_concurrency: Optional[int] = Field(
+        None, title="current number of concurrent downloads (adaptive downloads)"
+    )
+    time_modified: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+class MirrorSyncInterval(BaseModel):
+    interval: Optional[int] = Field(
+        None,
+        title="interval of the periodic synchronisation in seconds",
+        description="null disables the periodic synchronisation",
+        ge=1,
+    )
+
+
+class MirrorSyncSchedule(BaseModel):
+    interval: Optional[int] = Field(
+        None, title="interval of the periodic synchronisation in seconds"
+    )
+    status: str = Field("idle", title="idle or running")
+    next_run: Optional[datetime]
+    last_started: Optional[datetime]
+    last_finished: Optional[datetime]
+    last_error: Optional[str] = Field(
+        None, title="error of the last synchronisation (if it failed)"
+    )
+    failures: int = Field(0, title="number of consecutive failed synchronisations")
+
+    class Config:
+        orm_mode = True
+
+
 class ChannelAction(BaseModel):
     action: ChannelActionEnum
+    subdirs: Optional[List[str]] = Field(
+        None, title="subdirs the action is restricted to"
+    )
+    packages: Optional[List[str]] = Field(
+        None, title="package name patterns the action is restricted to"
+    )
+    latest: Optional[int] = Field(
+        None, title="number of latest versions of each package", gt=0
+    )
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str = Field(..., title="name of the package file")
+    size: int = Field(..., title="size of the package file in bytes", ge=1)
+    sha256: Optional[str] = Field(
+        None, title="checksum of the package file, verified when it is complete"
+    )
+
+    @validator("filename")
+    def check_filename(cls, v):
+        if "/" in v or "\\" in v or not v.endswith((".tar.bz2", ".conda")):
+            raise ValueError("not a package filename")
+        return v
+
+
+class UploadSession(UploadSessionCreate):
+    id: uuid.UUID
+    offset: int = Field(0, title="number of bytes already uploaded")
+    min_chunk_size: int = Field(
+        0, title="minimum size of the chunks (except the last one)"
+    )
+    time_created: Optional[datetime]
+    time_expires: Optional[datetime] = Field(
+        None, title="time (UTC) after which the upload is discarded"
+    )
+
+    class Config:
+        orm_mode = True
+
+
+class UploadJobFile(BaseModel):
+    filename: str
+    status: str = Field("pending", title="pending, success or failed")
+    detail: Optional[str] = Field(None, title="error of a failed file")
+
+
+class UploadJob(BaseModel):
+    id: uuid.UUID
+    channel_name: str
+    status: str = Field("pending", title="pending, running, success or failed")
+    files: List[UploadJobFile]
+    time_created: Optional[datetime]
+    time_finished: Optional[datetime]
+
+    @validator("files", pre=True)
+    def load_json(cls, v):
+        if isinstance(v, str):
+            return json.loads(v)
+        else:
+            return v
+
+    class Config:
+        orm_mode = True
+
+
+class PackageVersionsCopy(BaseModel):
+    source_channel: str = Field(..., title="channel the package versions are from")
+    files: List[str] = Field(
+        ...,
+        title="package files to copy",
+        example=["linux-64/my-package-0.1-0.tar.bz2"],
+        min_items=1,
+    )
+    move: bool = Field(False, title="remove the package versions from the source")
+    force: bool = Field(False, title="overwrite existing package versions")
+
+    @validator("files", each_item=True)
+    def check_file(cls, v):
+        parts = v.split("/")
+        if len(parts) != 2 or not all(parts):
+            raise ValueError("files must be given as {platform}/{filename}")
+        return v
@@ -4,3 +4,7 @@ def can_channel_synchronize(channel):
 
 def can_channel_reindex(channel):
     return True
+
+
+def can_channel_prewarm_cache(channel):
+    return channel.mirror_channel_url and (channel.mirror_mode == "proxy")
@@ -1,9 +1,10 @@
 import logging
+from typing import Optional
 
 from fastapi import HTTPException, status
 
 from quetz import authorization, db_models
-from quetz.rest_models import ChannelActionEnum
+from quetz.rest_models import ChannelAction, ChannelActionEnum
 
 from . import assertions, mirror, reindexing
 from .workers import AbstractWorker
@@ -16,6 +17,8 @@ def assert_channel_action(action, channel):
         action_allowed = assertions.can_channel_synchronize(channel)
     elif action == ChannelActionEnum.reindex:
         action_allowed = assertions.can_channel_reindex(channel)
+    elif action == ChannelActionEnum.prewarm_cache:
+        action_allowed = assertions.can_channel_prewarm_cache(channel)
     else:
         action_allowed = False
 
@@ -35,7 +38,12 @@ class Task:
         self.auth = auth
         self.worker = worker
 
-    def execute_channel_action(self, action: str, channel: db_models.Channel):
+    def execute_channel_action(
+        self,
+        action: str,
+        channel: db_models.Channel,
+        options: Optional[ChannelAction] = None,
+    ):
         auth = self.auth
 
         channel_name = channel.name
@@ -55,6 +63,15 @@ class Task:
                 channel_name=channel_name,
                 user_id=user_id,
             )
+        elif action == ChannelActionEnum.prewarm_cache:
+            auth.assert_synchronize_mirror(channel_name)
+            self.worker.execute(
+                mirror.prewarm_proxy_cache,
+                channel_name=channel_name,
+                subdirs=options.subdirs if options else None,
+                package_patterns=options.packages if options else None,
+                latest=options.latest if options else None,
+            )
         else:
             raise HTTPException(
                 status_code=status.HTTP_501_NOT_IMPLEMENTED,
@@ -117,6 +117,14 @@ def update_indexes(dao, pkgstore, channel_name, subdirs=None):
     for dir in subdirs:
         logger.debug(f"creating indexes for subdir {dir} of channel {channel_name}")
         raw_repodata = repo_data.export(dao, channel_name, dir)
+        if raw_repodata is None:
+            # the last package versions of the subdir were removed
+            raw_repodata = {
+                "info": {"subdir": dir},
+                "packages": {},
+                "packages.conda": {},
+                "repodata_version": 1,
+            }
 
         repodata = json.dumps(raw_repodata, indent=2, sort_keys=True).encode("utf-8")
         compressed_repodata = bz2.compress(repodata)
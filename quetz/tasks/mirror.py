@@ -1,21 +1,36 @@
 import contextlib
+import fnmatch
+import hashlib
 import json
 import logging
 import os
+import posixpath
+import queue
 import shutil
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tempfile import SpooledTemporaryFile
+from typing import Callable, Dict, Iterable, List, Optional
 
 import requests
 from fastapi import HTTPException, status
 from fastapi.responses import FileResponse, StreamingResponse
 
-from quetz import authorization
+from quetz import authorization, versionorder
+from quetz.condainfo import CondaInfo
 from quetz.config import Config
 from quetz.dao import Dao
+from quetz.database import get_engine, get_session_maker
 from quetz.db_models import Channel, PackageVersion
+from quetz.errors import ConfigError
+from quetz.exceptions import PackageError
 from quetz.pkgstores import PackageStore
 from quetz.tasks import indexing
+from quetz.tasks.uploads import UPLOADS_DIR
+from quetz.utils import HashingReader
 
 # copy common subdirs from conda:
 # https://github.com/conda/conda/blob/a78a2387f26a188991d771967fc33aa1fb5bb810/conda/base/constants.py#L63
@@ -37,9 +52,27 @@ KNOWN_SUBDIRS = (
     "zos-z",
 )
 
+# number of files removed from the package store in one request when pruning
+PRUNE_BATCH_SIZE = 1000
+
+# prefix in the package store of the proxy channel under which the
+# downloaded files are kept
+PROXY_CACHE_PREFIX = "proxy-cache"
 
 logger = logging.getLogger("quetz")
 
+# indexes of a channel are regenerated by one subdir synchronisation at a time,
+# they all write the channeldata.json and index.html of the channel
+_index_locks: Dict[str, threading.Lock] = {}
+_index_locks_lock = threading.Lock()
+
+
+def _update_subdir_indexes(dao: Dao, pkgstore: PackageStore, channel_name, subdir):
+    with _index_locks_lock:
+        lock = _index_locks.setdefault(channel_name, threading.Lock())
+    with lock:
+        indexing.update_indexes(dao, pkgstore, channel_name, subdirs=[subdir])
+
 
 def get_from_cache_or_download(
     repository, cache, target, exclude=["repodata.json", "current_respodata.json"]
@@ -64,13 +97,19 @@ def get_from_cache_or_download(
 
         return StreamingResponse(data_iter(data_stream))
 
-    if target not in cache:
+    try:
+        cached = cache[target]
+    except KeyError:
         # copy from repository to cache
         remote_file = repository.open(target)
         data_stream = remote_file.file
         cache.dump(target, data_stream)
+        cached = cache[target]
 
-    return FileResponse(cache[target])
+    # local caches return a path on disk, shared caches an open file
+    if isinstance(cached, str):
+        return FileResponse(cached)
+    return StreamingResponse(data_iter(cached))
 
 
 class RemoteRepository:
@@ -80,8 +119,8 @@ class RemoteRepository:
         self.host = host
         self.session = session
 
-    def open(self, path):
-        return RemoteFile(self.host, path, self.session)
+    def open(self, path, spool=True):
+        return RemoteFile(self.host, path, self.session, spool=spool)
 
 
 class RemoteServerError(Exception):
@@ -92,37 +131,59 @@ class RemoteFileNotFound(RemoteServerError):
     pass
 
 
+class RemoteServerBusy(RemoteServerError):
+    """The remote server throttles the requests (429 or 503 responses)."""
+
+
 class RemoteFile:
-    def __init__(self, host: str, path: str, session=None):
+    """File downloaded from a remote repository.
+
+    Unless `spool` is False, the content is first copied to a temporary file;
+    otherwise `file` is the response stream, which can only be read once."""
+
+    def __init__(self, host: str, path: str, session=None, spool: bool = True):
         if session is None:
             session = requests.Session()
         remote_url = os.path.join(host, path)
         try:
             response = session.get(remote_url, stream=True)
+        except requests.exceptions.RetryError:
+            # the retries of the session on 429 and 5xx responses are exhausted
+            raise RemoteServerBusy
         except requests.ConnectionError:
             raise RemoteServerError
         if response.status_code == 404:
             raise RemoteFileNotFound
+        elif response.status_code in (429, 503):
+            raise RemoteServerBusy
         elif response.status_code != 200:
             raise RemoteServerError
-        self.file = SpooledTemporaryFile()
         response.raw.decode_content = True  # for gzipped response content
-        shutil.copyfileobj(response.raw, self.file)
-        # rewind
-        self.file.seek(0)
+        if spool:
+            self.file = SpooledTemporaryFile()
+            shutil.copyfileobj(response.raw, self.file)
+            # rewind
+            self.file.seek(0)
+        else:
+            self.file = response.raw
         _, self.filename = os.path.split(remote_url)
         self.content_type = response.headers.get("content-type")
+        self.etag = response.headers.get("etag")
 
     def json(self):
         return json.load(self.file)
 
 
 class LocalCache:
-    """Local storage for downloaded files."""
+    """Local storage for downloaded files.
 
-    def __init__(self, channel_name: str):
-        self.cache_dir = "cache"
+    If `max_size` (in bytes) is set, the least recently used files of the channel
+    are evicted when the cache grows beyond that size."""
+
+    def __init__(self, channel_name: str, cache_dir: str = "cache", max_size: int = 0):
+        self.cache_dir = cache_dir
         self.channel = channel_name
+        self.max_size = max_size
 
     def dump(self, path, stream):
         cache_path = self._make_path(path)
@@ -131,6 +192,32 @@ class LocalCache:
         with open(cache_path, "wb") as fid:
             shutil.copyfileobj(stream, fid)
 
+        if self.max_size:
+            self._evict(keep=cache_path)
+
+    def _evict(self, keep=None):
+        channel_dir = os.path.join(self.cache_dir, self.channel)
+        cached_files = []
+        for root, _, files in os.walk(channel_dir):
+            for name in files:
+                file_path = os.path.join(root, name)
+                stat = os.stat(file_path)
+                cached_files.append((stat.st_atime, stat.st_size, file_path))
+
+        total_size = sum(size for _, size, _ in cached_files)
+
+        for _, size, file_path in sorted(cached_files):
+            if total_size <= self.max_size:
+                break
+            if file_path == keep:
+                continue
+            logger.debug(f"evicting {file_path} from the proxy cache")
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
     def __contains__(self, path):
         cache_path = self._make_path(path)
         return os.path.isfile(cache_path)
@@ -149,6 +236,75 @@ class LocalCache:
         return cache_path
 
 
+class PackageStoreCache:
+    """Storage for downloaded files shared between Quetz instances.
+
+    Files are stored in the package store of the proxy channel under a reserved
+    prefix, optionally with a (small) local disk tier in front of it."""
+
+    def __init__(
+        self,
+        channel_name: str,
+        pkgstore: PackageStore,
+        local_cache: Optional[LocalCache] = None,
+    ):
+        self.channel = channel_name
+        self.pkgstore = pkgstore
+        self.local_cache = local_cache
+
+    def _make_path(self, path):
+        return posixpath.join(PROXY_CACHE_PREFIX, path)
+
+    def _open(self, path):
+        try:
+            return self.pkgstore.serve_path(self.channel, self._make_path(path))
+        except FileNotFoundError:
+            raise KeyError(path)
+
+    def dump(self, path, stream):
+        self.pkgstore.create_channel(self.channel)
+        self.pkgstore.add_package(stream, self.channel, self._make_path(path))
+
+    def __contains__(self, path):
+        if self.local_cache is not None and path in self.local_cache:
+            return True
+        try:
+            fid = self._open(path)
+        except KeyError:
+            return False
+        fid.close()
+        return True
+
+    def __getitem__(self, path):
+        if self.local_cache is None:
+            return self._open(path)
+
+        if path not in self.local_cache:
+            with self._open(path) as fid:
+                self.local_cache.dump(path, fid)
+
+        return self.local_cache[path]
+
+
+def make_proxy_cache(channel_name: str, config: Config):
+    """Create the proxy cache of a channel as set in the config."""
+
+    backend = config.mirroring_proxy_cache
+    local_size = config.mirroring_proxy_cache_local_size
+
+    if backend == "local":
+        return LocalCache(channel_name)
+    elif backend == "pkgstore":
+        local_cache = (
+            LocalCache(channel_name, max_size=local_size) if local_size else None
+        )
+        return PackageStoreCache(channel_name, config.get_package_store(), local_cache)
+    else:
+        raise ConfigError(
+            f"mirroring.proxy_cache should be 'local' or 'pkgstore', got '{backend}'"
+        )
+
+
 @contextlib.contextmanager
 def _check_timestamp(channel: Channel, dao: Dao):
     """context manager for comparing the package timestamp
@@ -196,21 +352,20 @@ def _check_checksum(dao: Dao, channel_name: str, platform: str, keyname="sha256"
         nonlocal package_fingerprints
 
         if package_fingerprints is None:
-            package_versions = (
-                dao.db.query(PackageVersion)
+            checksum_column = getattr(PackageVersion, keyname)
+            package_fingerprints = {
+                (filename, checksum)
+                for filename, checksum in dao.db.query(
+                    PackageVersion.filename, checksum_column
+                )
                 .filter(PackageVersion.channel_name == channel_name)
                 .filter(PackageVersion.platform == platform)
-                .all()
-            )
+            }
 
             logger.debug(
-                f"Got {len(package_versions)} existing packages for "
+                f"Got {len(package_fingerprints)} existing packages for "
                 f"{channel_name} / {platform}"
             )
-            package_fingerprints = set()
-            for v in package_versions:
-                info = json.loads(v.info)
-                package_fingerprints.add((v.filename, info[keyname]))
 
         # use nonlocal to be able to modified last_timestamp in the
         # outer scope
@@ -225,15 +380,452 @@ def _check_checksum(dao: Dao, channel_name: str, platform: str, keyname="sha256"
     yield _func
 
 
-def download_file(remote_repository, path):
+def stream_package_to_store(
+    remote_repository: RemoteRepository,
+    path: str,
+    channel_name: str,
+    pkgstore: PackageStore,
+    repodata_entry: Optional[dict] = None,
+    package_channeldata: Optional[dict] = None,
+) -> CondaInfo:
+    """Download a package directly to the package store and extract its metadata.
+
+    The response is written to a staging file of the store while the checksums
+    are computed, the metadata are then read from the info files of the staged
+    package, which is moved to its place in the channel once verified.
+
+    If the upstream `repodata_entry` is given, the checksum of the received file
+    is verified against it and the metadata are built from the entry (and from
+    the upstream `package_channeldata`) without reading the file again. Entries
+    without checksum cannot be verified, the metadata are then read from the
+    file."""
+
+    remote_file = remote_repository.open(path, spool=False)
+    reader = HashingReader(remote_file.file)
+    # the file is staged until it is verified, so that a bad download does not
+    # replace the package already in the channel
+    staged_path = f"{UPLOADS_DIR}/{uuid.uuid4().hex}"
+    pkgstore.add_package(reader, channel_name, staged_path)
+    file_hashes = reader.hashes()
+
+    keyname = None
+    if repodata_entry is not None:
+        if repodata_entry.get("sha256"):
+            keyname = "sha256"
+        elif repodata_entry.get("md5"):
+            keyname = "md5"
+
     try:
-        f = remote_repository.open(path)
-    except RemoteServerError:
-        logger.error(f"remote server error when getting a file {path}")
-        return None
+        if keyname is not None:
+            if file_hashes[keyname] != repodata_entry[keyname]:
+                raise PackageError(f"{keyname} of {path} does not match repodata")
+            info = dict(repodata_entry, **file_hashes)
+            info.setdefault("subdir", posixpath.dirname(path))
+            condainfo = CondaInfo.from_repodata(
+                remote_file.filename, info, package_channeldata
+            )
+        else:
+            with pkgstore.serve_path(channel_name, staged_path) as fid:
+                condainfo = CondaInfo(
+                    fid, remote_file.filename, file_hashes=file_hashes
+                )
+    except Exception:
+        pkgstore.delete_file(channel_name, staged_path)
+        raise
+
+    # packages are stored under the subdir from their metadata
+    dest = posixpath.join(condainfo.info["subdir"], remote_file.filename)
+    pkgstore.move_file(channel_name, staged_path, dest)
+
+    logger.debug(f"Stored file {path}")
+    return condainfo
+
+
+class SyncStats:
+    """Counters of the mirror synchronisation pipeline.
+
+    Keeps track of the throughput of the download and ingestion stages and of the
+    depth of the queue between them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.downloaded_bytes = 0
+        self.download_errors = 0
+        self.download_time = 0.0
+        self.ingested = 0
+        self.ingested_bytes = 0
+        self.ingest_time = 0.0
+        self.queue_depth_samples = 0
+        self.queue_depth_total = 0
+        self.queue_depth_max = 0
+        # changes of the upstream repodata since the last synchronisation
+        # (None if there was no snapshot to compare with)
+        self.added: Optional[int] = None
+        self.changed: Optional[int] = None
+        self.removed: Optional[int] = None
+        # package versions removed because they were deleted upstream
+        self.pruned = 0
+        # limit of concurrent downloads set by the adaptive controller
+        self.concurrency: Optional[int] = None
+        self.concurrency_max: Optional[int] = None
+        self.start = time.monotonic()
+
+    def add_download(self, size: Optional[int], elapsed: float):
+        with self.lock:
+            if size is None:
+                self.download_errors += 1
+            else:
+                self.downloaded += 1
+                self.downloaded_bytes += size
+            self.download_time += elapsed
+
+    def add_ingest(self, n_files: int, size: int, elapsed: float):
+        self.ingested += n_files
+        self.ingested_bytes += size
+        self.ingest_time += elapsed
+
+    def sample_concurrency(self, limit: int):
+        with self.lock:
+            self.concurrency = limit
+            self.concurrency_max = max(self.concurrency_max or 0, limit)
+
+    def sample_queue(self, depth: int):
+        self.queue_depth_samples += 1
+        self.queue_depth_total += depth
+        self.queue_depth_max = max(self.queue_depth_max, depth)
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.start
+        samples = self.queue_depth_samples or 1
+        return {
+            "downloaded": self.downloaded,
+            "downloaded_bytes": self.downloaded_bytes,
+            "download_errors": self.download_errors,
+            "download_bytes_per_s": self.downloaded_bytes / elapsed if elapsed else 0,
+            "ingested": self.ingested,
+            "ingested_bytes": self.ingested_bytes,
+            "ingest_files_per_s": (
+                self.ingested / self.ingest_time if self.ingest_time else 0
+            ),
+            "queue_depth_avg": self.queue_depth_total / samples,
+            "queue_depth_max": self.queue_depth_max,
+            "added": self.added,
+            "changed": self.changed,
+            "removed": self.removed,
+            "pruned": self.pruned,
+            "concurrency": self.concurrency,
+            "concurrency_max": self.concurrency_max,
+            "elapsed": elapsed,
+        }
+
+
+def repodata_fingerprints(packages: Dict[str, dict]) -> Dict[str, str]:
+    """Map the filenames of repodata entries to the checksum of the files."""
+
+    fingerprints = {}
+    for filename, metadata in packages.items():
+        fingerprint = metadata.get("sha256") or metadata.get("md5")
+        if not fingerprint:
+            # no checksum, any change of the entry is a change of the package
+            fingerprint = hashlib.sha256(
+                json.dumps(metadata, sort_keys=True).encode()
+            ).hexdigest()
+        fingerprints[filename] = fingerprint
+    return fingerprints
+
+
+def dump_repodata_snapshot(fingerprints: Dict[str, str]) -> bytes:
+    return zlib.compress(json.dumps(fingerprints, separators=(",", ":")).encode())
+
+
+def load_repodata_snapshot(data: bytes) -> Dict[str, str]:
+    return json.loads(zlib.decompress(data))
+
+
+def diff_repodata_snapshots(old: Dict[str, str], new: Dict[str, str]):
+    """Return the filenames added, changed and removed between two snapshots."""
+
+    added = [filename for filename in new if filename not in old]
+    changed = [
+        filename
+        for filename, fingerprint in new.items()
+        if filename in old and old[filename] != fingerprint
+    ]
+    removed = [filename for filename in old if filename not in new]
+    return added, changed, removed
+
+
+class SyncCheckpoint:
+    """Persistent progress of the synchronisation of a subdir.
+
+    Entries of the repodata are processed in order; the checkpoint stored in the
+    db is the position up to which all the entries are processed (up-to-date,
+    ingested or skipped because of an error). A synchronisation interrupted
+    before the end is resumed from that position if the upstream repodata did
+    not change (same ETag)."""
+
+    def __init__(
+        self,
+        dao: Dao,
+        channel_name: str,
+        subdir: str,
+        filenames: List[str],
+        etag: Optional[str],
+    ):
+        self.dao = dao
+        self.channel_name = channel_name
+        self.subdir = subdir
+        self.filenames = filenames
+        self.start = 0
+        self.batch = 0
+
+        checkpoint = dao.get_mirror_sync_checkpoint(channel_name, subdir)
+        if (
+            checkpoint is not None
+            and checkpoint.status == "running"
+            and etag
+            and checkpoint.repodata_etag == etag
+            and checkpoint.n_packages == len(filenames)
+        ):
+            self.start = checkpoint.position or 0
+            self.batch = checkpoint.batch or 0
+            logger.info(
+                f"resuming synchronisation of {channel_name}/{subdir} "
+                f"after {checkpoint.last_filename}"
+            )
+
+        # indices of entries to download (in order) and the ones already done
+        self.pending: List[int] = []
+        self.done = set()
+        self._next = 0
+        self.position = self.start
 
-    logger.debug(f"Fetched file {path}")
-    return f
+        self._save(
+            status="running",
+            repodata_etag=etag,
+            n_packages=len(filenames),
+        )
+
+    def _save(self, **data):
+        last_filename = self.filenames[self.position - 1] if self.position else None
+        self.dao.update_mirror_sync_checkpoint(
+            self.channel_name,
+            self.subdir,
+            position=self.position,
+            last_filename=last_filename,
+            batch=self.batch,
+            **data,
+        )
+
+    def add_pending(self, index: int):
+        self.pending.append(index)
+
+    def mark_done(self, index: int):
+        self.done.add(index)
+
+    def save_batch(self, **data):
+        """Store the checkpoint after a batch was processed."""
+        self.batch += 1
+        while self._next < len(self.pending) and self.pending[self._next] in self.done:
+            self._next += 1
+        if self._next < len(self.pending):
+            self.position = self.pending[self._next]
+        else:
+            self.position = len(self.filenames)
+        self._save(**data)
+
+    def finish(
+        self,
+        repodata_sha256: Optional[str],
+        snapshot: Dict[str, str],
+        duration: float,
+        **data,
+    ):
+        """Store the snapshot of the upstream repodata applied to the channel.
+
+        `repodata_sha256` is None if the snapshot is only part of the
+        repodata."""
+        self.position = len(self.filenames)
+        self._save(
+            status="done",
+            repodata_sha256=repodata_sha256,
+            repodata_snapshot=dump_repodata_snapshot(snapshot),
+            duration=duration,
+            **data,
+        )
+
+
+def _is_index_update_due(
+    n_packages: int, elapsed: float, max_packages: int, max_interval: float
+) -> bool:
+    """Tell whether the indexes of a subdir should be updated after a batch.
+
+    Indexes are updated when `max_packages` packages were ingested or
+    `max_interval` seconds passed since the last update, or after every batch
+    if both limits are 0."""
+
+    if not max_packages and not max_interval:
+        return True
+    if max_packages and n_packages >= max_packages:
+        return True
+    return bool(max_interval) and elapsed >= max_interval
+
+
+def _file_size(f):
+    pos = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(pos)
+    return size
+
+
+class AdaptiveConcurrency:
+    """Number of concurrent downloads adapted to the observed throughput.
+
+    The limit is adjusted every time as many downloads as the current limit
+    (but at least `min_window`) have completed. It is halved when the upstream
+    server throttles the downloads (429 or 503 responses) and decreased when
+    more than `max_error_rate` of the downloads failed. Otherwise it moves by
+    one in the same direction as long as the throughput (in bytes/s) improves
+    and in the other direction when it does not."""
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 0,
+        min_window: int = 4,
+        max_error_rate: float = 0.2,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit or initial)
+        self.limit = self._clamp(initial)
+        self.min_window = min_window
+        self.max_error_rate = max_error_rate
+        self.active = 0
+        self._cond = threading.Condition()
+        self._direction = 1
+        self._last_throughput: Optional[float] = None
+        self._start_window()
+
+    def _clamp(self, limit: int) -> int:
+        return min(max(limit, self.min_limit), self.max_limit)
+
+    def _start_window(self):
+        self._window_start = time.monotonic()
+        self._completed = 0
+        self._bytes = 0
+        self._errors = 0
+        self._throttled = 0
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """Wait for a download slot, returns False if `stop` was set meanwhile."""
+        with self._cond:
+            while self.active >= self.limit:
+                if stop is not None and stop.is_set():
+                    return False
+                self._cond.wait(0.1)
+            self.active += 1
+            return True
+
+    def release(
+        self, size: Optional[int], error: bool = False, throttled: bool = False
+    ):
+        """Free a download slot and record the outcome of the download."""
+        with self._cond:
+            self.active -= 1
+            self._completed += 1
+            self._bytes += size or 0
+            self._errors += error
+            self._throttled += throttled
+            if self._completed >= max(self.limit, self.min_window):
+                self._adjust()
+            self._cond.notify_all()
+
+    def cancel(self):
+        """Free a download slot acquired for a download that did not happen."""
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def _adjust(self):
+        elapsed = time.monotonic() - self._window_start
+        throughput = self._bytes / elapsed if elapsed > 0 else 0.0
+        old_limit = self.limit
+
+        if self._throttled:
+            self.limit = self._clamp(self.limit // 2)
+            # probe upwards again from the reduced limit
+            self._direction = 1
+            throughput = None
+        elif self._errors > self.max_error_rate * self._completed:
+            self.limit = self._clamp(self.limit - 1)
+            self._direction = 1
+            throughput = None
+        else:
+            if (
+                self._last_throughput is not None
+                and throughput <= self._last_throughput
+            ):
+                self._direction = -self._direction
+            self.limit = self._clamp(self.limit + self._direction)
+
+        if self.limit != old_limit:
+            logger.debug(f"download concurrency changed {old_limit} -> {self.limit}")
+        self._last_throughput = throughput
+        self._start_window()
+
+
+def _download_worker(
+    fetch: Callable,
+    paths: queue.Queue,
+    downloaded: queue.Queue,
+    stop: threading.Event,
+    stats: SyncStats,
+    concurrency: Optional[AdaptiveConcurrency] = None,
+):
+    """Download files from the `paths` queue and put them in the `downloaded` queue.
+
+    `fetch` returns the downloaded item and its size for a path. Files that could
+    not be downloaded are put in the queue as None, so that the consumer can count
+    all the files. If `concurrency` is given, a download slot is acquired from
+    it before each download."""
+
+    while not stop.is_set():
+        if concurrency is not None and not concurrency.acquire(stop):
+            return
+
+        try:
+            path = paths.get_nowait()
+        except queue.Empty:
+            if concurrency is not None:
+                concurrency.cancel()
+            return
+
+        start = time.monotonic()
+        throttled = False
+        try:
+            item, size = fetch(path)
+        except RemoteServerBusy:
+            logger.error(f"could not download {path}: remote server is busy")
+            item, size = None, None
+            throttled = True
+        except Exception as exc:
+            logger.error(f"could not download {path}: {exc}")
+            item, size = None, None
+        stats.add_download(size, time.monotonic() - start)
+        if concurrency is not None:
+            concurrency.release(size, error=item is None, throttled=throttled)
+            stats.sample_concurrency(concurrency.limit)
+
+        # block while the queue is full, but not after the consumer has stopped
+        while not stop.is_set():
+            try:
+                downloaded.put((path, item, size), timeout=0.1)
+                break
+            except queue.Full:
+                continue
 
 
 def initial_sync_mirror(
@@ -244,13 +836,25 @@ def initial_sync_mirror(
     pkgstore: PackageStore,
     auth: authorization.Rules,
     skip_errors: bool = True,
+    channeldata: Optional[dict] = None,
+    download_slots: Optional[threading.Semaphore] = None,
 ):
+    """Mirror the packages of one subdir of a remote channel.
+
+    `channeldata` is the content of the channeldata.json of the remote channel,
+    it is downloaded if needed and not given. `download_slots` limits the number
+    of downloads running at the same time when several subdirs are synchronised
+    concurrently."""
 
     force = True  # needed for updating packages
 
+    stats = SyncStats()
+
     try:
         repo_file = remote_repository.open(os.path.join(arch, "repodata.json"))
-        repodata = json.load(repo_file.file)
+        repodata_bytes = repo_file.file.read()
+        repodata = json.loads(repodata_bytes)
+        etag = repo_file.etag
     except RemoteServerError:
         logger.error(f"can not get repodata.json for channel {channel_name}")
         return
@@ -262,9 +866,41 @@ def initial_sync_mirror(
 
     channel = dao.get_channel(channel_name)
 
-    from quetz.main import handle_package_files
+    from quetz.main import (
+        add_package_versions,
+        assert_upload_package_files,
+        handle_package_files,
+    )
 
     packages = repodata.get("packages", {})
+    repodata_sha256 = hashlib.sha256(repodata_bytes).hexdigest()
+    fingerprints = repodata_fingerprints(packages)
+
+    # compare with the upstream repodata of the last synchronisation, so that
+    # only the packages added or changed since then are processed
+    delta = None
+    previous = dao.get_mirror_sync_checkpoint(channel_name, arch)
+    if previous is not None and previous.repodata_snapshot:
+        if previous.status == "done" and previous.repodata_sha256 == repodata_sha256:
+            stats.added = stats.changed = stats.removed = 0
+            logger.info(
+                f"upstream repodata of {channel_name}/{arch} did not change: "
+                f"{stats.as_dict()}"
+            )
+            return stats
+        added, changed, removed = diff_repodata_snapshots(
+            load_repodata_snapshot(previous.repodata_snapshot), fingerprints
+        )
+        stats.added, stats.changed, stats.removed = (
+            len(added),
+            len(changed),
+            len(removed),
+        )
+        delta = set(added) | set(changed)
+        logger.info(
+            f"upstream repodata of {channel_name}/{arch}: {len(added)} added, "
+            f"{len(changed)} changed, {len(removed)} removed"
+        )
 
     version_methods = [
         _check_timestamp(channel, dao),
@@ -275,6 +911,15 @@ def initial_sync_mirror(
     config = Config()
     max_batch_length = config.mirroring_batch_length
     max_batch_size = config.mirroring_batch_size
+    index_update_packages = config.mirroring_index_update_packages
+    index_update_interval = config.mirroring_index_update_interval
+    trust_repodata = config.mirroring_trust_repodata
+    # metadata from repodata are only used for packages streamed to the store
+    stream_packages = config.mirroring_stream_packages or trust_repodata
+
+    if trust_repodata and channeldata is None:
+        channeldata = get_remote_channeldata(remote_repository) or {}
+    channeldata_packages = (channeldata or {}).get("packages", {})
 
     # version_methods are context managers (for example, to update the db
     # after all packages have been checked), so we need to enter the context
@@ -286,35 +931,105 @@ def initial_sync_mirror(
             version_stack.enter_context(method) for method in version_methods
         ]
 
-        update_batch = []
-        update_size = 0
+        update_sizes = {}
+        update_entries = {}
+        update_indices = {}
+        # packages that could not be mirrored, they are left out of the
+        # snapshot so that they are retried during the next synchronisation
+        failed = set()
+
+        checkpoint = SyncCheckpoint(dao, channel_name, arch, list(packages), etag)
+        if checkpoint.start:
+            # packages ingested before the interruption may not be indexed yet
+            any_updated = True
+
+        for index, (package_name, metadata) in enumerate(packages.items()):
+            if index < checkpoint.start:
+                # processed before the synchronisation was interrupted
+                continue
 
-        def handle_batch(update_batch):
-            logger.debug(f"Handling batch: {update_batch}")
-            if not update_batch:
-                return False
+            path = os.path.join(arch, package_name)
 
-            remote_packages = []
+            if delta is not None:
+                # the snapshot tells exactly which packages need an update
+                is_uptodate = package_name not in delta
+            else:
+                # try to find out whether it's a new package version
+                is_uptodate = None
+                for _check in version_checks:
+                    is_uptodate = _check(package_name, metadata)
+                    if is_uptodate is not None:
+                        break
 
-            with ThreadPoolExecutor(
-                max_workers=config.mirroring_num_parallel_downloads
-            ) as executor:
-                for f in executor.map(
-                    download_file,
-                    (remote_repository,) * len(update_batch),
-                    update_batch,
-                ):
-                    if f is not None:
-                        remote_packages.append(f)
+            # if package is up-to-date skip uploading file
+            if is_uptodate:
+                logger.debug(
+                    f"package {package_name} from {arch} up-to-date. Not updating"
+                )
+                continue
+            else:
+                logger.debug(f"updating package {package_name} from {arch}")
 
-            try:
-                handle_package_files(
+            update_sizes[path] = metadata.get('size', 100_000)
+            update_entries[path] = metadata
+            update_indices[path] = index
+            checkpoint.add_pending(index)
+
+        def fetch(path):
+            if download_slots is None:
+                return _fetch(path)
+            with download_slots:
+                return _fetch(path)
+
+        def _fetch(path):
+            if stream_packages:
+                repodata_entry = package_channeldata = None
+                if trust_repodata:
+                    repodata_entry = update_entries[path]
+                    package_channeldata = channeldata_packages.get(
+                        repodata_entry.get("name")
+                    )
+                condainfo = stream_package_to_store(
+                    remote_repository,
+                    path,
                     channel_name,
-                    remote_packages,
-                    dao,
-                    auth,
-                    force,
+                    pkgstore,
+                    repodata_entry,
+                    package_channeldata,
                 )
+                return condainfo, condainfo.info["size"]
+            remote_file = remote_repository.open(path)
+            return remote_file, _file_size(remote_file.file)
+
+        def ingest_batch(update_batch):
+            filenames = [posixpath.basename(path) for path, _, _ in update_batch]
+            logger.debug(f"Handling batch: {filenames}")
+            if not update_batch:
+                return False
+
+            start = time.monotonic()
+            try:
+                if stream_packages:
+                    # files are already in the package store
+                    user_id = assert_upload_package_files(
+                        channel_name, filenames, auth, force
+                    )
+                    add_package_versions(
+                        channel_name,
+                        filenames,
+                        [condainfo for _, condainfo, _ in update_batch],
+                        dao,
+                        user_id,
+                        force,
+                    )
+                else:
+                    handle_package_files(
+                        channel_name,
+                        [remote_file for _, remote_file, _ in update_batch],
+                        dao,
+                        auth,
+                        force,
+                    )
                 return True
 
             except Exception as exc:
@@ -323,46 +1038,241 @@ def initial_sync_mirror(
                     f"{channel_name} due to error {exc} of "
                     f"type {exc.__class__.__name__}"
                 )
+                failed.update(path for path, _, _ in update_batch)
                 if not skip_errors:
                     raise exc
+            finally:
+                for path, _, _ in update_batch:
+                    checkpoint.mark_done(update_indices[path])
+                stats.add_ingest(
+                    len(update_batch),
+                    sum(size for _, _, size in update_batch),
+                    time.monotonic() - start,
+                )
 
             return False
 
-        for package_name, metadata in packages.items():
-            path = os.path.join(arch, package_name)
+        # downloads run in a pool of threads while the packages are ingested
+        # in the current thread (which owns the db session), the bounded queue
+        # between them keeps both the network and the CPU busy
+        paths: queue.Queue = queue.Queue()
+        for path in update_sizes:
+            paths.put(path)
+        downloaded: queue.Queue = queue.Queue(maxsize=config.mirroring_queue_size)
+        stop = threading.Event()
+
+        concurrency = None
+        n_workers = config.mirroring_num_parallel_downloads
+        if config.mirroring_adaptive_downloads:
+            concurrency = AdaptiveConcurrency(
+                config.mirroring_num_parallel_downloads,
+                min_limit=config.mirroring_min_adaptive_downloads,
+                max_limit=config.mirroring_max_adaptive_downloads,
+            )
+            # the pool is sized for the upper bound, the controller decides
+            # how many of the threads download at the same time
+            n_workers = concurrency.max_limit
+            stats.sample_concurrency(concurrency.limit)
+        n_workers = min(n_workers, len(update_sizes))
+
+        if stream_packages and update_sizes:
+            pkgstore.create_channel(channel_name)
+
+        with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+            for _ in range(n_workers):
+                executor.submit(
+                    _download_worker,
+                    fetch,
+                    paths,
+                    downloaded,
+                    stop,
+                    stats,
+                    concurrency,
+                )
 
-            # try to find out whether it's a new package version
+            try:
+                update_batch = []
+                update_size = 0
+                # packages ingested since the last update of the indexes
+                n_unindexed = 0
+                last_indexed = time.monotonic()
+                for _ in range(len(update_sizes)):
+                    stats.sample_queue(downloaded.qsize())
+                    path, item, size = downloaded.get()
+                    if item is None:
+                        checkpoint.mark_done(update_indices[path])
+                        failed.add(path)
+                        continue
+
+                    update_batch.append((path, item, size))
+                    update_size += update_sizes[path]
+
+                    if (
+                        len(update_batch) >= max_batch_length
+                        or update_size >= max_batch_size
+                    ):
+                        logger.debug(f"Executing batch with {update_size}")
+                        any_updated |= ingest_batch(update_batch)
+                        n_unindexed += len(update_batch)
+                        update_batch = []
+                        update_size = 0
+                        if _is_index_update_due(
+                            n_unindexed,
+                            time.monotonic() - last_indexed,
+                            index_update_packages,
+                            index_update_interval,
+                        ):
+                            _update_subdir_indexes(dao, pkgstore, channel_name, arch)
+                            n_unindexed = 0
+                            last_indexed = time.monotonic()
+                        checkpoint.save_batch(download_concurrency=stats.concurrency)
+
+                # handle final batch
+                any_updated |= ingest_batch(update_batch)
+            finally:
+                stop.set()
+
+    if config.mirroring_prune:
+        removed = prune_mirror_subdir(channel_name, arch, packages, dao, pkgstore)
+        stats.pruned = len(removed)
+        any_updated |= bool(removed)
 
-            is_uptodate = None
-            for _check in version_checks:
-                is_uptodate = _check(package_name, metadata)
-                if is_uptodate is not None:
-                    break
+    if any_updated:
+        _update_subdir_indexes(dao, pkgstore, channel_name, arch)
 
-            # if package is up-to-date skip uploading file
-            if is_uptodate:
-                logger.debug(
-                    f"package {package_name} from {arch} up-to-date. Not updating"
+    snapshot = {
+        filename: fingerprint
+        for filename, fingerprint in fingerprints.items()
+        if os.path.join(arch, filename) not in failed
+    }
+    checkpoint.finish(
+        # the snapshot does not cover the whole repodata if packages failed,
+        # the next synchronisation must not skip it as unchanged
+        None if failed else repodata_sha256,
+        snapshot,
+        stats.as_dict()["elapsed"],
+        download_concurrency=stats.concurrency,
+    )
+
+    logger.info(f"synchronisation of {channel_name}/{arch}: {stats.as_dict()}")
+
+    return stats
+
+
+def prune_mirror_subdir(
+    channel_name: str,
+    arch: str,
+    upstream_filenames: Iterable[str],
+    dao: Dao,
+    pkgstore: PackageStore,
+    dry_run: bool = False,
+) -> List[str]:
+    """Remove the package versions of a subdir that are gone from upstream.
+
+    Returns the filenames of the removed package versions (or of the package
+    versions that would be removed if `dry_run` is set)."""
+
+    local_filenames = {
+        filename
+        for filename, in dao.db.query(PackageVersion.filename)
+        .filter(PackageVersion.channel_name == channel_name)
+        .filter(PackageVersion.platform == arch)
+    }
+    removed = sorted(local_filenames.difference(upstream_filenames))
+
+    if dry_run or not removed:
+        return removed
+
+    n_deleted = dao.delete_package_versions(channel_name, arch, removed)
+
+    paths = [posixpath.join(arch, filename) for filename in removed]
+    for start in range(0, len(paths), PRUNE_BATCH_SIZE):
+        batch = paths[start : start + PRUNE_BATCH_SIZE]  # noqa: E203
+        pkgstore.delete_files(channel_name, batch)
+
+    logger.info(
+        f"removed {n_deleted} package versions deleted upstream "
+        f"from {channel_name}/{arch}"
+    )
+    return removed
+
+
+def prune_mirror_channel(
+    channel_name: str,
+    dao: Dao,
+    pkgstore: PackageStore,
+    session: requests.Session,
+    subdirs: Optional[List[str]] = None,
+    dry_run: bool = False,
+) -> Dict[str, List[str]]:
+    """Remove the package versions of a mirror channel that are gone from upstream.
+
+    Returns the removed filenames (or the ones to remove if `dry_run` is set)
+    for each subdir. A subdir whose repodata.json is not found upstream is only
+    pruned if the upstream channeldata.json lists the subdirs of the channel
+    without it, otherwise it is skipped."""
+
+    channel = dao.get_channel(channel_name)
+    remote_repo = RemoteRepository(channel.mirror_channel_url, session)
+
+    if not subdirs:
+        subdirs = [
+            platform
+            for platform, in dao.db.query(PackageVersion.platform)
+            .filter(PackageVersion.channel_name == channel_name)
+            .distinct()
+        ]
+
+    report = {}
+    channeldata = None
+    for arch in sorted(subdirs):
+        try:
+            repodata = remote_repo.open(posixpath.join(arch, "repodata.json")).json()
+        except RemoteFileNotFound:
+            if channeldata is None:
+                channeldata = get_remote_channeldata(remote_repo) or {}
+            if arch in channeldata.get("subdirs", [arch]):
+                # the upstream server may be misconfigured or temporarily
+                # broken, do not remove the packages of the whole subdir
+                logger.warning(
+                    f"repodata.json of {arch} not found upstream of {channel_name}, "
+                    "skipping the subdir"
                 )
                 continue
-            else:
-                logger.debug(f"updating package {package_name} from {arch}")
+            # the whole subdir was removed upstream
+            repodata = {}
+        packages = repodata.get("packages", {})
+        report[arch] = prune_mirror_subdir(
+            channel_name, arch, packages, dao, pkgstore, dry_run=dry_run
+        )
+        if report[arch] and not dry_run:
+            _update_subdir_indexes(dao, pkgstore, channel_name, arch)
 
-            update_batch.append(path)
-            update_size += metadata.get('size', 100_000)
+    return report
 
-            if len(update_batch) >= max_batch_length or update_size >= max_batch_size:
-                logger.debug(f"Executing batch with {update_size}")
-                any_updated |= handle_batch(update_batch)
-                update_batch = []
-                update_size = 0
-                indexing.update_indexes(dao, pkgstore, channel_name, subdirs=[arch])
 
-        # handle final batch
-        any_updated |= handle_batch(update_batch)
+def get_remote_channeldata(remote_repository: RemoteRepository) -> Optional[dict]:
+    """Get the channeldata.json of a remote channel (None if it is missing)."""
 
-    if any_updated:
-        indexing.update_indexes(dao, pkgstore, channel_name, subdirs=[arch])
+    try:
+        return remote_repository.open("channeldata.json").json()
+    except (RemoteFileNotFound, json.JSONDecodeError):
+        return None
+
+
+def _get_subdirs(channeldata: Optional[dict]):
+    # if no channel data use known architectures
+    if channeldata is None:
+        return KNOWN_SUBDIRS
+    return channeldata.get("subdirs", [])
+
+
+def get_remote_subdirs(remote_repository: RemoteRepository):
+    """Get the subdirs of a remote channel from its channeldata.json.
+
+    Falls back to the known architectures if channeldata is missing."""
+
+    return _get_subdirs(get_remote_channeldata(remote_repository))
 
 
 def synchronize_packages(
@@ -381,25 +1291,202 @@ def synchronize_packages(
 
     remote_repo = RemoteRepository(new_channel.mirror_channel_url, session)
     try:
-        channel_data = remote_repo.open("channeldata.json").json()
-        subdirs = channel_data.get("subdirs", [])
-    except (RemoteFileNotFound, json.JSONDecodeError):
-        subdirs = None
+        channeldata = get_remote_channeldata(remote_repo)
     except RemoteServerError:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Remote channel {host} unavailable",
         )
-    # if no channel data use known architectures
-    if subdirs is None:
-        subdirs = KNOWN_SUBDIRS
 
+    subdirs = _get_subdirs(channeldata)
+
+    config = Config()
+    n_parallel_subdirs = min(config.mirroring_num_parallel_subdirs, len(subdirs))
+
+    if n_parallel_subdirs <= 1:
+        for arch in subdirs:
+            initial_sync_mirror(
+                new_channel.name,
+                remote_repo,
+                arch,
+                dao,
+                pkgstore,
+                auth,
+                channeldata=channeldata or {},
+            )
+        return
+
+    max_downloads = config.mirroring_max_parallel_downloads or (
+        config.mirroring_num_parallel_downloads * n_parallel_subdirs
+    )
+    download_slots = threading.BoundedSemaphore(max_downloads)
+
+    # sessions can not be shared between threads, each subdir gets its own
+    engine = get_engine(config.sqlalchemy_database_url)
+    session_maker = get_session_maker(engine)
+
+    def sync_subdir(arch):
+        db = session_maker()
+        try:
+            initial_sync_mirror(
+                channel_name,
+                remote_repo,
+                arch,
+                Dao(db),
+                pkgstore,
+                authorization.Rules(auth.API_key, auth.session, db),
+                channeldata=channeldata or {},
+                download_slots=download_slots,
+            )
+        finally:
+            db.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_parallel_subdirs) as executor:
+            futures = [executor.submit(sync_subdir, arch) for arch in subdirs]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        engine.dispose()
+
+
+class RateLimiter:
+    """Limit the number of calls per second shared between threads."""
+
+    def __init__(self, max_rate: float = 0):
+        self.interval = 1 / max_rate if max_rate else 0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _select_packages(
+    packages: dict,
+    package_patterns: Optional[List[str]] = None,
+    latest: Optional[int] = None,
+):
+    """Select package filenames by name patterns and keep only the `latest`
+    versions of each package."""
+
+    by_name: Dict[str, list] = {}
+    for filename, metadata in packages.items():
+        name = metadata.get("name", filename.rsplit("-", 2)[0])
+        if package_patterns and not any(
+            fnmatch.fnmatch(name, pattern) for pattern in package_patterns
+        ):
+            continue
+        by_name.setdefault(name, []).append((filename, metadata))
+
+    selected = []
+    for name, files in by_name.items():
+        if latest:
+            versions = sorted(
+                {metadata.get("version", "0") for _, metadata in files},
+                key=versionorder.version_order,
+            )[-latest:]
+            files = [f for f in files if f[1].get("version", "0") in versions]
+        selected.extend(filename for filename, _ in files)
+    return selected
+
+
+def prewarm_proxy_cache(
+    channel_name: str,
+    dao: Dao,
+    session: requests.Session,
+    config: Config,
+    subdirs: Optional[List[str]] = None,
+    package_patterns: Optional[List[str]] = None,
+    latest: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    max_rate: float = 0,
+):
+    """Fill the cache of a proxy channel with packages listed in upstream repodata.
+
+    :param subdirs: subdirs to prefetch, by default all subdirs of upstream channel
+    :param package_patterns: only prefetch packages matching one of the patterns
+    :param latest: only prefetch the latest N versions of each package
+    :param max_workers: number of parallel downloads
+    :param max_rate: maximum number of downloads started per second (0 - no limit)
+    """
+
+    channel = dao.get_channel(channel_name)
+    remote_repo = RemoteRepository(channel.mirror_channel_url, session)
+    cache = make_proxy_cache(channel_name, config)
+
+    if not subdirs:
+        subdirs = get_remote_subdirs(remote_repo)
+
+    paths = []
     for arch in subdirs:
-        initial_sync_mirror(
-            new_channel.name,
-            remote_repo,
-            arch,
-            dao,
-            pkgstore,
-            auth,
+        try:
+            repodata = remote_repo.open(posixpath.join(arch, "repodata.json")).json()
+        except (RemoteServerError, json.JSONDecodeError):
+            logger.error(f"can not get repodata.json for {arch} of {channel_name}")
+            continue
+        packages = {
+            **repodata.get("packages", {}),
+            **repodata.get("packages.conda", {}),
+        }
+        paths.extend(
+            posixpath.join(arch, filename)
+            for filename in _select_packages(packages, package_patterns, latest)
         )
+
+    logger.info(f"prefetching {len(paths)} files to proxy channel {channel_name}")
+
+    rate_limiter = RateLimiter(max_rate)
+
+    def _fetch(path):
+        if path in cache:
+            return 0
+        rate_limiter.wait()
+        remote_file = remote_repo.open(path)
+        data = remote_file.file
+        data.seek(0, os.SEEK_END)
+        size = data.tell()
+        data.seek(0)
+        cache.dump(path, data)
+        return size
+
+    stats = {"files": 0, "bytes": 0, "cached": 0, "failed": 0}
+    last_report = time.monotonic()
+
+    if max_workers is None:
+        max_workers = config.mirroring_num_parallel_downloads
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fetch, path): path for path in paths}
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                size = future.result()
+            except RemoteServerError:
+                logger.error(f"could not prefetch {futures[future]}")
+                stats["failed"] += 1
+            except Exception:
+                # for example, the cache could not be written
+                logger.exception(f"could not prefetch {futures[future]}")
+                stats["failed"] += 1
+            else:
+                if size:
+                    stats["files"] += 1
+                    stats["bytes"] += size
+                else:
+                    stats["cached"] += 1
+
+            if time.monotonic() - last_report > 10 or i == len(paths):
+                last_report = time.monotonic()
+                logger.info(
+                    f"prefetched {i}/{len(paths)} files to {channel_name} "
+                    f"({stats['bytes']} bytes)"
+                )
+
+    return stats
@@ -10,6 +10,7 @@ from quetz.config import Config
 from quetz.dao import Dao
 
 from .indexing import update_indexes
+from .mirror import PROXY_CACHE_PREFIX
 
 logger = logging.getLogger("quetz.tasks")
 
@@ -59,6 +60,9 @@ def handle_file(
             info=json.dumps(condainfo.info),
             uploader_id=user_id,
             upsert=False,
+            sha256=condainfo.info["sha256"],
+            md5=condainfo.info["md5"],
+            size=condainfo.info["size"],
         )
     except IntegrityError:
         logger.error(f"duplicate package '{package_name}' in channel '{channel_name}'")
@@ -80,7 +84,11 @@ def reindex_packages_from_store(
     pkgstore = config.get_package_store()
 
     all_files = pkgstore.list_files(channel_name)
-    pkg_files = [f for f in all_files if f.endswith(".tar.bz2")]
+    pkg_files = [
+        f
+        for f in all_files
+        if f.endswith(".tar.bz2") and not f.startswith(PROXY_CACHE_PREFIX)
+    ]
 
     channel = dao.get_channel(channel_name)
 
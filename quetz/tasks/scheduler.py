@@ -0,0 +1,165 @@
+"""Periodic synchronisation of mirror channels."""
+
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import requests
+from fastapi import BackgroundTasks
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from quetz import authorization
+from quetz.config import Config
+from quetz.dao import Dao
+from quetz.database import get_session
+from quetz.pkgstores import PackageStore
+
+from . import mirror
+from .workers import AbstractWorker, RQManager, get_worker
+
+logger = logging.getLogger("quetz.tasks")
+
+
+def next_sync_time(
+    now: datetime,
+    interval: int,
+    failures: int = 0,
+    jitter: float = 0,
+    max_backoff: int = 0,
+) -> datetime:
+    """Time of the next periodic synchronisation of a channel.
+
+    After `failures` consecutive failures, the interval is doubled for each
+    failure up to `max_backoff` seconds (but never shortened). A random delay of
+    up to `jitter` times the interval is added, so that channels with the same
+    interval are not synchronised all at once."""
+
+    delay = interval
+    if failures:
+        delay = min(interval * 2**failures, max(interval, max_backoff))
+    delay += random.uniform(0, jitter * delay)
+    return now + timedelta(seconds=delay)
+
+
+def run_scheduled_sync(
+    channel_name: str,
+    dao: Dao,
+    pkgstore: PackageStore,
+    auth: authorization.Rules,
+    session: requests.Session,
+    config: Config,
+):
+    """Synchronise a mirror channel and schedule its next synchronisation."""
+
+    error = None
+    try:
+        mirror.synchronize_packages(channel_name, dao, pkgstore, auth, session)
+    except Exception as exc:
+        dao.db.rollback()
+        error = str(getattr(exc, "detail", None) or exc) or exc.__class__.__name__
+        logger.error(f"periodic synchronisation of {channel_name} failed: {error}")
+
+    channel = dao.get_channel(channel_name)
+    if channel is None:
+        # the channel was deleted in the meantime
+        return
+
+    schedule = dao.get_mirror_sync_schedule(channel_name)
+    next_run = None
+    if channel.sync_interval:
+        next_run = next_sync_time(
+            datetime.utcnow(),
+            channel.sync_interval,
+            failures=(schedule.failures or 0) + 1 if error else 0,
+            jitter=config.mirroring_sync_jitter,
+            max_backoff=config.mirroring_sync_max_backoff,
+        )
+    dao.finish_mirror_sync(channel_name, next_run, error)
+
+
+class MirrorSyncScheduler:
+    """Dispatch the periodic synchronisations of mirror channels to the worker.
+
+    The due synchronisations are looked up in the database every
+    ``mirroring.sync_poll_interval`` seconds. Each server process can run its
+    own scheduler: a synchronisation is claimed in the database before it is
+    dispatched, so that at most one synchronisation of a channel runs at a
+    time."""
+
+    def __init__(self, config: Config):
+        self.config = config
+
+    def dispatch_due(self) -> List[Tuple[AbstractWorker, Session]]:
+        """Dispatch the synchronisations that are due.
+
+        Returns the workers running the synchronisations and the database
+        sessions they use."""
+
+        config = self.config
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=config.mirroring_sync_timeout)
+
+        jobs = []
+        db = get_session(config.sqlalchemy_database_url)
+        try:
+            dao = Dao(db)
+            for channel_name in dao.get_due_mirror_syncs(now, stale_before):
+                if not dao.claim_mirror_sync(channel_name, now, stale_before):
+                    continue
+                schedule = dao.get_mirror_sync_schedule(channel_name)
+                jobs.append(self._dispatch(channel_name, schedule.user_id))
+        finally:
+            db.close()
+
+        return jobs
+
+    def _dispatch(
+        self, channel_name: str, user_id: Optional[bytes]
+    ) -> Tuple[AbstractWorker, Session]:
+        from quetz.deps import get_remote_session
+
+        logger.info(f"starting periodic synchronisation of {channel_name}")
+
+        browser_session = {}
+        if user_id:
+            browser_session["user_id"] = str(uuid.UUID(bytes=user_id))
+
+        db = get_session(self.config.sqlalchemy_database_url)
+        worker = get_worker(
+            self.config,
+            BackgroundTasks(),
+            Dao(db),
+            authorization.Rules(None, browser_session, db),
+            get_remote_session(),
+        )
+        worker.execute(run_scheduled_sync, channel_name=channel_name)
+        return worker, db
+
+    async def _wait(self, worker: AbstractWorker, db: Session):
+        try:
+            # jobs of the redis queue are run by the rq workers
+            if not isinstance(worker, RQManager):
+                await worker.wait()
+        except Exception:
+            logger.exception("periodic synchronisation failed")
+        finally:
+            db.close()
+
+    async def run(self):
+        """Dispatch the due synchronisations until the task is cancelled."""
+
+        poll_interval = self.config.mirroring_sync_poll_interval
+        logger.info(f"mirror synchronisation scheduler polling every {poll_interval}s")
+        while True:
+            try:
+                jobs = await run_in_threadpool(self.dispatch_due)
+            except Exception:
+                logger.exception("could not dispatch periodic synchronisations")
+            else:
+                for worker, db in jobs:
+                    asyncio.ensure_future(self._wait(worker, db))
+            await asyncio.sleep(poll_interval)
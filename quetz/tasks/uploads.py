@@ -0,0 +1,134 @@
+import json
+import logging
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from quetz.condainfo import CondaInfo
+from quetz.dao import Dao
+from quetz.exceptions import PackageError
+from quetz.pkgstores import PackageStore
+
+from .indexing import update_indexes
+
+logger = logging.getLogger("quetz.tasks")
+
+# directory of the package store where uploaded files are kept until they are
+# added to the channel
+UPLOADS_DIR = ".uploads"
+
+# error of the files of a job that did not finish in time
+UPLOAD_JOB_TIMEOUT_DETAIL = "upload job timed out"
+
+
+def upload_job_path(job_id: bytes, filename: str) -> str:
+    return f"{UPLOADS_DIR}/{uuid.UUID(bytes=job_id).hex}/{filename}"
+
+
+def upload_session_path(session_id: bytes) -> str:
+    return f"{UPLOADS_DIR}/{uuid.UUID(bytes=session_id).hex}"
+
+
+def _error_detail(exc: Exception) -> str:
+    if isinstance(exc, (HTTPException, PackageError)):
+        return str(exc.detail)
+    return str(exc)
+
+
+def ingest_upload_job(job_id: bytes, dao: Dao, pkgstore: PackageStore):
+    """add the files of an upload job to its channel
+
+    the files were stored in the package store by the upload endpoint, the
+    result of each file is stored in the job"""
+
+    from quetz.main import add_package_versions
+
+    upload_job = dao.get_upload_job(job_id)
+    channel_name = upload_job.channel_name
+    files = json.loads(upload_job.files)
+    dao.update_upload_job(upload_job, "running")
+
+    package = None
+    if upload_job.package_name:
+        package = dao.get_package(channel_name, upload_job.package_name)
+
+    # the metadata of every file is read before the files are added to the
+    # channel, so that a bad file does not fail the whole upload
+    stored = []
+    for item in files:
+        filename = item["filename"]
+        staged_path = upload_job_path(job_id, filename)
+        try:
+            with pkgstore.serve_path(channel_name, staged_path) as fid:
+                condainfo = CondaInfo(fid, filename)
+            if filename.rsplit("-", 2)[0] != condainfo.info["name"]:
+                raise PackageError("package name does not match the filename")
+            pkgstore.move_file(
+                channel_name, staged_path, f"{condainfo.info['subdir']}/{filename}"
+            )
+        except Exception as exc:
+            logger.error(f"upload of {filename} to {channel_name} failed: {exc}")
+            item.update(status="failed", detail=_error_detail(exc))
+            pkgstore.delete_files(channel_name, [staged_path])
+        else:
+            stored.append((item, condainfo))
+
+    def add_versions(items):
+        add_package_versions(
+            channel_name,
+            [item["filename"] for item, _ in items],
+            [condainfo for _, condainfo in items],
+            dao,
+            upload_job.user_id,
+            upload_job.force,
+            package,
+        )
+        for item, _ in items:
+            item["status"] = "success"
+
+    try:
+        add_versions(stored)
+    except HTTPException:
+        # nothing was added, find the files that cannot be added
+        for item in stored:
+            try:
+                add_versions([item])
+            except Exception as exc:
+                item[0].update(status="failed", detail=_error_detail(exc))
+    except Exception as exc:
+        logger.exception(f"upload to {channel_name} failed")
+        for item, _ in stored:
+            item.update(status="failed", detail=_error_detail(exc))
+
+    failed = any(item["status"] == "failed" for item in files)
+    dao.update_upload_job(upload_job, "failed" if failed else "success", files)
+
+    if any(item["status"] == "success" for item in files):
+        update_indexes(dao, pkgstore, channel_name)
+
+
+def cleanup_upload_sessions(dao: Dao, pkgstore: PackageStore):
+    """discard the upload sessions that expired and the chunks they stored
+
+    the multipart uploads of the sessions are aborted in the package store"""
+
+    for upload_session in dao.get_expired_upload_sessions(datetime.utcnow()):
+        session_name = uuid.UUID(bytes=upload_session.id).hex
+        try:
+            pkgstore.abort_upload(
+                upload_session.channel_name,
+                upload_session_path(upload_session.id),
+                upload_session.store_upload_id,
+            )
+        except Exception:
+            # the upload may have been aborted by a concurrent cleanup or a
+            # lifecycle rule of the bucket
+            logger.exception(f"could not abort the upload of session {session_name}")
+        try:
+            dao.delete_upload_session(upload_session)
+        except Exception:
+            dao.db.rollback()
+            logger.exception(f"could not delete upload session {session_name}")
+        else:
+            logger.info(f"upload session {session_name} expired")
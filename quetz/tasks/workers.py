@@ -195,3 +195,37 @@ class RQManager(AbstractWorker):
             time.sleep(1)
         if self.job.result:
             return self.job.result
+
+
+def get_worker(
+    config: Config,
+    background_tasks: BackgroundTasks,
+    dao: Dao,
+    auth: authorization.Rules,
+    session: requests.Session,
+) -> AbstractWorker:
+    """create the worker configured in the ``worker`` section of the config"""
+
+    if config.configured_section("worker"):
+        worker = config.worker_type
+    else:
+        worker = "thread"
+
+    if worker == "thread":
+        return ThreadingWorker(background_tasks, dao, auth, session, config)
+    elif worker == "subprocess":
+        return SubprocessWorker(auth.API_key, auth.session, config)
+    elif worker == "redis":
+        if rq_available:
+            return RQManager(
+                config.worker_redis_ip,
+                config.worker_redis_port,
+                config.worker_redis_db,
+                auth.API_key,
+                auth.session,
+                config,
+            )
+        else:
+            raise ValueError("redis and rq not installed on machine")
+    else:
+        raise ValueError("wrong configuration in worker.type")
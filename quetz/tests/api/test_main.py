@@ -1,4 +1,10 @@
 import datetime
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import uuid
 from unittest.mock import ANY
 
 import pytest
@@ -370,3 +376,396 @@ def test_upload_wrong_file_type(auth_client, public_channel):
     )
     assert response.status_code == 400
     assert "not a bzip2 file" in response.json()['detail']
+
+
+def test_upload_package_computes_checksums_while_storing(
+    auth_client, public_channel, db, config, mocker
+):
+    from quetz.condainfo import CondaInfo
+
+    calculate_file_hashes = mocker.spy(CondaInfo, "_calculate_file_hashes")
+
+    filename = "test-package-0.1-0.tar.bz2"
+    with open(filename, "rb") as fid:
+        content = fid.read()
+
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/files/",
+        files={"files": (filename, content)},
+    )
+    assert response.status_code == 201
+
+    # the package file is not read again to compute its checksums
+    calculate_file_hashes.assert_not_called()
+
+    version = (
+        db.query(db_models.PackageVersion)
+        .filter(db_models.PackageVersion.filename == filename)
+        .one()
+    )
+    assert version.size == len(content)
+    assert version.md5 == hashlib.md5(content).hexdigest()
+    assert version.sha256 == hashlib.sha256(content).hexdigest()
+    info = json.loads(version.info)
+    assert info["sha256"] == version.sha256
+
+    pkgstore = config.get_package_store()
+    with pkgstore.serve_path(public_channel.name, f"linux-64/{filename}") as fid:
+        assert fid.read() == content
+
+
+@pytest.fixture
+def metadata_processes(mocker):
+    from quetz import main
+
+    mocker.patch("quetz.main.config.upload_metadata_workers", "process")
+    mocker.patch("quetz.main.config.upload_metadata_process_min_size", 0)
+    yield
+    main.stop_metadata_executor()
+
+
+def test_upload_package_metadata_processes(
+    auth_client, public_channel, db, metadata_processes
+):
+    from quetz import main
+
+    filename = "test-package-0.1-0.tar.bz2"
+    with open(filename, "rb") as fid:
+        content = fid.read()
+
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/files/",
+        files={"files": (filename, content)},
+    )
+    assert response.status_code == 201
+    assert main._metadata_executor is not None
+
+    version = (
+        db.query(db_models.PackageVersion)
+        .filter(db_models.PackageVersion.filename == filename)
+        .one()
+    )
+    assert version.sha256 == hashlib.sha256(content).hexdigest()
+    assert json.loads(version.info)["name"] == "test-package"
+
+    # errors reading the packages are returned to the client
+    files = {"files": ("my_package-0.1-0.tar.bz", "dfdf")}
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/files/", files=files
+    )
+    assert response.status_code == 400
+    assert "not a bzip2 file" in response.json()['detail']
+
+
+@pytest.mark.parametrize("on_disk", [True, False])
+def test_read_package_info_metadata_processes(
+    config, mocker, metadata_processes, on_disk
+):
+    from tempfile import SpooledTemporaryFile
+
+    from starlette.datastructures import UploadFile
+
+    from quetz import main
+    from quetz.condainfo import CondaInfo
+
+    filename = "test-package-0.1-0.tar.bz2"
+    with open(filename, "rb") as fid:
+        content = fid.read()
+
+    spooled = SpooledTemporaryFile(max_size=1 if on_disk else len(content) + 1)
+    spooled.write(content)
+    executor = main.get_metadata_executor()
+    submit = mocker.spy(executor, "submit")
+
+    condainfo = main._read_package_info(UploadFile(filename, spooled), executor)
+
+    # the worker processes read the spooled file, packages kept in memory
+    # are read in the current process
+    assert submit.call_count == int(on_disk)
+    expected = CondaInfo(spooled, filename, hash_file=False)
+    assert condainfo.info == expected.info
+    assert condainfo.files == expected.files
+    assert condainfo.channeldata == expected.channeldata
+
+
+def _create_upload_session(client, channel_name, filename, content, **data):
+    response = client.post(
+        f"/api/channels/{channel_name}/upload-sessions",
+        json={"filename": filename, "size": len(content), **data},
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+def test_upload_session(auth_client, public_channel, db, config):
+    filename = "test-package-0.1-0.tar.bz2"
+    with open(filename, "rb") as fid:
+        content = fid.read()
+
+    upload_session = _create_upload_session(
+        auth_client,
+        public_channel.name,
+        filename,
+        content,
+        sha256=hashlib.sha256(content).hexdigest(),
+    )
+    assert upload_session["offset"] == 0
+    session_url = f"/api/channels/{public_channel.name}/upload-sessions/"
+    session_url += upload_session["id"]
+
+    chunk_size = len(content) // 3 + 1
+    for offset in range(0, len(content), chunk_size):
+        response = auth_client.put(
+            session_url,
+            params={"offset": offset},
+            data=content[offset:][:chunk_size],
+        )
+        assert response.status_code == 200
+        assert response.json()["offset"] == min(offset + chunk_size, len(content))
+
+        # a chunk uploaded again is rejected, the upload resumes from the
+        # offset of the session
+        response = auth_client.put(
+            session_url, params={"offset": offset}, data=content[offset:][:chunk_size]
+        )
+        assert response.status_code == 409
+        response = auth_client.get(session_url)
+        assert response.json()["offset"] == min(offset + chunk_size, len(content))
+
+    response = auth_client.post(f"{session_url}/finalize")
+    assert response.status_code == 201
+
+    version = (
+        db.query(db_models.PackageVersion)
+        .filter(db_models.PackageVersion.filename == filename)
+        .one()
+    )
+    assert version.size == len(content)
+    assert version.sha256 == hashlib.sha256(content).hexdigest()
+
+    pkgstore = config.get_package_store()
+    files = pkgstore.list_files(public_channel.name)
+    assert f"linux-64/{filename}" in files
+    assert not [f for f in files if f.startswith(".uploads/")]
+    with pkgstore.serve_path(public_channel.name, f"linux-64/{filename}") as fid:
+        assert fid.read() == content
+
+    response = auth_client.get(session_url)
+    assert response.status_code == 404
+
+
+def test_upload_session_errors(auth_client, public_channel, config):
+    filename = "test-package-0.1-0.tar.bz2"
+    with open(filename, "rb") as fid:
+        content = fid.read()
+
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/upload-sessions",
+        json={"filename": "../test-package-0.1-0.tar.bz2", "size": 10},
+    )
+    assert response.status_code == 422
+
+    upload_session = _create_upload_session(
+        auth_client, public_channel.name, filename, content, sha256="0" * 64
+    )
+    session_url = f"/api/channels/{public_channel.name}/upload-sessions/"
+    session_url += upload_session["id"]
+
+    response = auth_client.put(session_url, params={"offset": 0}, data=content + b"x")
+    assert response.status_code == 400
+
+    response = auth_client.post(f"{session_url}/finalize")
+    assert response.status_code == 400
+    assert "incomplete" in response.json()["detail"]
+
+    response = auth_client.put(session_url, params={"offset": 0}, data=content)
+    assert response.status_code == 200
+
+    response = auth_client.post(f"{session_url}/finalize")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "sha256 mismatch"
+
+    # the uploaded file is discarded
+    pkgstore = config.get_package_store()
+    assert pkgstore.list_files(public_channel.name) == []
+    assert auth_client.get(session_url).status_code == 404
+
+
+def test_upload_session_abort(auth_client, public_channel, config):
+    content = b"package content"
+    upload_session = _create_upload_session(
+        auth_client, public_channel.name, "test-package-0.1-0.tar.bz2", content
+    )
+    session_url = f"/api/channels/{public_channel.name}/upload-sessions/"
+    session_url += upload_session["id"]
+
+    response = auth_client.put(session_url, params={"offset": 0}, data=content[:5])
+    assert response.status_code == 200
+
+    response = auth_client.delete(session_url)
+    assert response.status_code == 200
+
+    pkgstore = config.get_package_store()
+    assert pkgstore.list_files(public_channel.name) == []
+    assert auth_client.get(session_url).status_code == 404
+
+
+def test_upload_session_expiry(auth_client, public_channel, db, config):
+    content = b"package content"
+    upload_session = _create_upload_session(
+        auth_client, public_channel.name, "test-package-0.1-0.tar.bz2", content
+    )
+    assert upload_session["time_expires"]
+    session_url = f"/api/channels/{public_channel.name}/upload-sessions/"
+    session_url += upload_session["id"]
+
+    response = auth_client.put(session_url, params={"offset": 0}, data=content[:5])
+    assert response.status_code == 200
+    pkgstore = config.get_package_store()
+    assert pkgstore.list_files(public_channel.name)
+
+    session_id = uuid.UUID(upload_session["id"]).bytes
+    db.query(db_models.UploadSession).filter(
+        db_models.UploadSession.id == session_id
+    ).update({"time_expires": datetime.datetime.utcnow()})
+    db.commit()
+
+    response = auth_client.get(session_url)
+    assert response.status_code == 404
+    assert "expired" in response.json()["detail"]
+
+    # the expired sessions are discarded when a new session is started
+    new_session = _create_upload_session(
+        auth_client, public_channel.name, "test-package-0.2-0.tar.bz2", content
+    )
+    assert db.query(db_models.UploadSession).get(session_id) is None
+    assert pkgstore.list_files(public_channel.name) == [
+        f".uploads/{uuid.UUID(new_session['id']).hex}"
+    ]
+
+
+def test_upload_asynchronous(auth_client, public_channel, db, config):
+    filename = "test-package-0.1-0.tar.bz2"
+    with open(filename, "rb") as fid:
+        content = fid.read()
+
+    files = [
+        ("files", (filename, content)),
+        ("files", ("my_package-0.1-0.tar.bz2", b"dfdf")),
+    ]
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/files/",
+        files=files,
+        data={"asynchronous": "true"},
+    )
+    assert response.status_code == 202
+    upload_job = response.json()
+    assert [f["status"] for f in upload_job["files"]] == ["pending", "pending"]
+
+    # the job was run by the background tasks of the test client
+    response = auth_client.get(
+        f"/api/channels/{public_channel.name}/upload-jobs/{upload_job['id']}"
+    )
+    assert response.status_code == 200
+    upload_job = response.json()
+    assert upload_job["status"] == "failed"
+    assert upload_job["time_finished"]
+    package_file, bad_file = upload_job["files"]
+    assert package_file == {"filename": filename, "status": "success", "detail": None}
+    assert bad_file["status"] == "failed"
+    assert "not a bzip2 file" in bad_file["detail"]
+
+    version = (
+        db.query(db_models.PackageVersion)
+        .filter(db_models.PackageVersion.filename == filename)
+        .one()
+    )
+    assert version.sha256 == hashlib.sha256(content).hexdigest()
+
+    pkgstore = config.get_package_store()
+    files = pkgstore.list_files(public_channel.name)
+    assert f"linux-64/{filename}" in files
+    assert "linux-64/repodata.json" in files
+    assert not [f for f in files if f.startswith(".uploads/")]
+
+    # the package version already exists
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/files/",
+        files={"files": (filename, content)},
+        data={"asynchronous": "true"},
+    )
+    assert response.status_code == 202
+    response = auth_client.get(
+        f"/api/channels/{public_channel.name}/upload-jobs/{response.json()['id']}"
+    )
+    assert response.json()["status"] == "failed"
+    assert response.json()["files"][0]["detail"] == "Duplicate"
+
+
+def test_upload_synchronous_without_worker(auth_client, public_channel, mocker):
+    get_tasks_worker = mocker.patch("quetz.main.get_tasks_worker")
+
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/files/",
+        files={"files": ("test-package-0.1-0.tar.bz2", b"dfdf")},
+    )
+    assert response.status_code == 400
+
+    get_tasks_worker.assert_not_called()
+
+
+def test_upload_job_timeout(auth_client, public_channel, user, dao, db, config):
+    filename = "test-package-0.1-0.tar.bz2"
+    job_id = uuid.uuid4()
+    # a job whose worker died after storing the file
+    upload_job = dao.create_upload_job(
+        job_id.bytes, public_channel.name, user.id, [filename]
+    )
+    pkgstore = config.get_package_store()
+    pkgstore.add_file(
+        b"package", public_channel.name, f".uploads/{job_id.hex}/{filename}"
+    )
+
+    job_url = f"/api/channels/{public_channel.name}/upload-jobs/{job_id}"
+    response = auth_client.get(job_url)
+    assert response.json()["status"] == "pending"
+
+    upload_job.time_created = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=config.upload_job_timeout + 1
+    )
+    db.commit()
+
+    response = auth_client.get(job_url)
+    assert response.status_code == 200
+    assert response.json()["status"] == "failed"
+    assert response.json()["files"] == [
+        {"filename": filename, "status": "failed", "detail": "upload job timed out"}
+    ]
+    assert pkgstore.list_files(public_channel.name) == []
+
+
+# generous budget, the import takes ~1.5s on a developer machine
+IMPORT_TIME_BUDGET = 10
+
+
+def test_import_time(config):
+    # the workers import quetz.main, it must not pull conda
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import quetz.main\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(m for m in sys.modules if m.split('.')[0] == 'conda'))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    import_time, conda_modules = result.stdout.splitlines()[-2:]
+
+    assert not conda_modules
+    assert float(import_time) < IMPORT_TIME_BUDGET
@@ -237,3 +237,79 @@ def test_delete_package_version(
 
     with pytest.raises(Exception):
         pkgstore.serve_path(public_channel.name, str(Path(platform) / filename))
+
+
+@pytest.mark.parametrize("move", [False, True])
+def test_copy_package_versions(
+    auth_client, public_channel, user, dao, db, pkgstore: PackageStore, move
+):
+    from quetz.rest_models import Channel
+
+    filename = "test-package-0.1-0.tar.bz2"
+    with open(filename, "rb") as fid:
+        content = fid.read()
+    response = auth_client.post(
+        f"/api/channels/{public_channel.name}/files/",
+        files={"files": (filename, content)},
+    )
+    assert response.status_code == 201
+    source_version = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == public_channel.name)
+        .one()
+    )
+    source_info = source_version.info
+
+    stable = dao.create_channel(
+        Channel(name="stable-channel", private=False), user.id, OWNER
+    )
+
+    url = f"/api/channels/{stable.name}/package-versions/copy"
+    response = auth_client.post(
+        url,
+        json={
+            "source_channel": public_channel.name,
+            "files": [f"linux-64/{filename}", "linux-64/other-0.1-0.tar.bz2"],
+        },
+    )
+    assert response.status_code == 404
+    assert "linux-64/other-0.1-0.tar.bz2" in response.json()["detail"]
+
+    data = {
+        "source_channel": public_channel.name,
+        "files": [f"linux-64/{filename}"],
+        "move": move,
+    }
+    response = auth_client.post(url, json=data)
+    assert response.status_code == 201
+    assert [v["channel_name"] for v in response.json()] == [stable.name]
+
+    version = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == stable.name)
+        .one()
+    )
+    assert version.filename == filename
+    assert version.info == source_info
+    with pkgstore.serve_path(stable.name, f"linux-64/{filename}") as fid:
+        assert fid.read() == content
+    assert dao.get_package(stable.name, "test-package").channeldata
+
+    source_versions = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == public_channel.name)
+        .all()
+    )
+    source_files = pkgstore.list_files(public_channel.name)
+    if move:
+        assert not source_versions
+        assert f"linux-64/{filename}" not in source_files
+    else:
+        assert len(source_versions) == 1
+        assert f"linux-64/{filename}" in source_files
+
+        # the version exists in the destination channel
+        response = auth_client.post(url, json=data)
+        assert response.status_code == 409
+        response = auth_client.post(url, json={**data, "force": True})
+        assert response.status_code == 201
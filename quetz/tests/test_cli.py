@@ -8,11 +8,14 @@ from unittest.mock import MagicMock
 import pkg_resources
 import pytest
 import sqlalchemy as sa
+from alembic.command import downgrade as alembic_downgrade
+from alembic.command import upgrade as alembic_upgrade
 from alembic.script import ScriptDirectory
 from pytest_mock.plugin import MockerFixture
 
 from quetz import cli
 from quetz.db_models import Base, User
+from quetz.versionorder import sort_key
 
 
 @pytest.fixture
@@ -120,6 +123,85 @@ def test_run_migrations(
     db.execute("SELECT * FROM users")
 
 
+def test_migration_backfills_package_version_checksums(
+    sql_connection, engine, alembic_config, refresh_db
+):
+    db = sql_connection
+    alembic_upgrade(alembic_config, "3ba25f23fb7d", sql=False)
+
+    db.execute("INSERT INTO channels (name) VALUES ('test-channel')")
+    db.execute(
+        "INSERT INTO packages (name, channel_name) "
+        "VALUES ('test-package', 'test-channel')"
+    )
+    info = '{"sha256": "SHA", "md5": "MD5", "size": 12345}'
+    db.execute(
+        sa.text(
+            "INSERT INTO package_versions "
+            "(id, channel_name, package_name, platform, filename, info) "
+            "VALUES (:id, 'test-channel', 'test-package', 'noarch', "
+            "'test-package-0.1-0.tar.bz2', :info)"
+        ),
+        id=b"0123456789abcdef",
+        info=info,
+    )
+
+    alembic_upgrade(alembic_config, "heads", sql=False)
+
+    row = db.execute("SELECT sha256, md5, size FROM package_versions").fetchone()
+    assert tuple(row) == ("SHA", "MD5", 12345)
+
+
+def test_migration_package_version_sort_keys(
+    sql_connection, engine, alembic_config, refresh_db
+):
+    db = sql_connection
+    alembic_upgrade(alembic_config, "5d3a8e61c0f4", sql=False)
+
+    db.execute("INSERT INTO channels (name) VALUES ('test-channel')")
+    db.execute(
+        "INSERT INTO packages (name, channel_name) "
+        "VALUES ('test-package', 'test-channel')"
+    )
+    versions = [("0.1", 0), ("1.0.dev1", 0), ("1.0", 1), ("1.0", 2), ("0.10", 0)]
+    for i, (version, build_number) in enumerate(versions):
+        db.execute(
+            sa.text(
+                "INSERT INTO package_versions "
+                "(id, channel_name, package_name, platform, filename, version, "
+                "build_number, version_order) "
+                "VALUES (:id, 'test-channel', 'test-package', 'noarch', "
+                ":filename, :version, :build_number, 0)"
+            ),
+            id=bytes([i]) * 16,
+            filename=f"test-package-{version}-{build_number}.tar.bz2",
+            version=version,
+            build_number=build_number,
+        )
+
+    alembic_upgrade(alembic_config, "b7f0c6d9a2e4", sql=False)
+
+    # the keys of the migration are the ones of the current encoding
+    rows = db.execute(
+        "SELECT version, build_number, sort_key FROM package_versions"
+    ).fetchall()
+    for version, build_number, key in rows:
+        assert bytes(key) == sort_key(version, build_number)
+
+    alembic_downgrade(alembic_config, "5d3a8e61c0f4", sql=False)
+
+    rows = db.execute(
+        "SELECT version, build_number FROM package_versions " "ORDER BY version_order"
+    ).fetchall()
+    assert [tuple(row) for row in rows] == [
+        ("1.0", 2),
+        ("1.0", 1),
+        ("1.0.dev1", 0),
+        ("0.10", 0),
+        ("0.1", 0),
+    ]
+
+
 def test_make_migrations_quetz(mocker, config, config_dir):
     revision = mocker.patch("alembic.command.revision")
 
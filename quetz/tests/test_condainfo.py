@@ -0,0 +1,123 @@
+import io
+import json
+import tarfile
+from zipfile import ZipFile
+
+import pytest
+import zstandard
+
+from quetz.condainfo import CondaInfo, open_conda_tar, read_tar_members
+from quetz.db_models import PackageFormatEnum
+from quetz.exceptions import PackageError
+
+INDEX = {
+    "name": "my-package",
+    "version": "0.1",
+    "build": "0",
+    "build_number": 0,
+    "subdir": "linux-64",
+}
+
+
+def _tar(members, mode="w"):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar:
+        for name, content in members.items():
+            member = tarfile.TarInfo(name)
+            member.size = len(content)
+            tar.addfile(member, io.BytesIO(content))
+    return data.getvalue()
+
+
+def _conda_package(info_members, pkg_members):
+    zstd = zstandard.ZstdCompressor()
+    data = io.BytesIO()
+    with ZipFile(data, "w") as zf:
+        zf.writestr("metadata.json", json.dumps({"conda_pkg_format_version": 2}))
+        zf.writestr("info-my-package-0.1-0.tar.zst", zstd.compress(_tar(info_members)))
+        zf.writestr("pkg-my-package-0.1-0.tar.zst", zstd.compress(_tar(pkg_members)))
+    data.seek(0)
+    return data
+
+
+def test_read_tar_members():
+    members = {
+        "info/index.json": b"{}",
+        "info/files": b"a\n",
+        "lib/a": b"a",
+        "info/about.json": b"{}",
+    }
+    data = _tar(members, "w:bz2")
+
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r|bz2") as tar:
+        assert read_tar_members(tar, ["info/files", "lib/a", "missing"]) == {
+            "info/files": b"a\n",
+            "lib/a": b"a",
+        }
+
+    # the members after the prefix are not read
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r|bz2") as tar:
+        assert read_tar_members(
+            tar, ["info/index.json", "info/about.json"], stop_prefix="info/"
+        ) == {"info/index.json": b"{}"}
+
+
+def test_conda_info():
+    package = _conda_package(
+        {
+            "info/index.json": json.dumps(INDEX).encode(),
+            "info/about.json": json.dumps({"summary": "my package"}).encode(),
+            "info/files": b"lib/a\nlib/b\n",
+            "info/run_exports.json": json.dumps({"weak": ["my-package"]}).encode(),
+        },
+        {"lib/a": b"a" * 100000, "lib/b": b"b"},
+    )
+
+    condainfo = CondaInfo(package, "my-package-0.1-0.conda")
+
+    assert condainfo.package_format == PackageFormatEnum.conda
+    assert condainfo.info["name"] == "my-package"
+    assert condainfo.info["size"] == len(package.getvalue())
+    assert condainfo.about["summary"] == "my package"
+    assert condainfo.files == [b"lib/a\n", b"lib/b\n"]
+    assert condainfo.run_exports == {"weak": ["my-package"]}
+    assert condainfo.channeldata["summary"] == "my package"
+
+
+def test_conda_info_scattered_info_members():
+    # the info/ members are not all at the beginning of the archive
+    members = {
+        "info/index.json": json.dumps(INDEX).encode(),
+        "lib/a": b"a",
+        "info/files": b"lib/a\n",
+        "lib/b": b"b",
+        "info/about.json": json.dumps({"summary": "my package"}).encode(),
+    }
+    package = io.BytesIO(_tar(members, "w:bz2"))
+
+    condainfo = CondaInfo(package, "my-package-0.1-0.tar.bz2")
+
+    assert condainfo.info["name"] == "my-package"
+    assert condainfo.files == [b"lib/a\n"]
+    # the optional members after the required ones are not read
+    assert condainfo.about == {}
+
+    del members["info/files"]
+    package = io.BytesIO(_tar(members, "w:bz2"))
+    with pytest.raises(PackageError, match="info/files"):
+        CondaInfo(package, "my-package-0.1-0.tar.bz2")
+
+
+def test_open_conda_tar():
+    package = _conda_package(
+        {"info/index.json": json.dumps(INDEX).encode(), "info/files": b""},
+        {"lib/a": b"a" * 100000, "noarch/patch_instructions.json": b"{}"},
+    )
+
+    with open_conda_tar(package, "pkg-") as tar:
+        members = read_tar_members(tar, ["noarch/patch_instructions.json"])
+    assert members == {"noarch/patch_instructions.json": b"{}"}
+
+    with pytest.raises(PackageError):
+        with open_conda_tar(package, "other-"):
+            pass
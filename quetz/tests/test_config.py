@@ -37,6 +37,12 @@ def test_config_empty_users_section(dao: Dao, user, config):
     assert not config.users_create_default_channel
 
 
+@pytest.mark.parametrize("config_extra", ["", "[pkgstore]\ndeduplicate=true"])
+def test_config_pkgstore_deduplicate(config, config_extra):
+    pkgstore = config.get_package_store()
+    assert pkgstore.deduplicate == bool(config_extra)
+
+
 def test_config_is_singleton(config):
 
     c = Config()
@@ -1,6 +1,8 @@
+import json
 import uuid
 
 import pytest
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import ObjectDeletedError
 
@@ -126,6 +128,166 @@ def test_create_version(dao, package, channel_name, package_name, db, user):
     assert created_version.time_created != created_version.time_modified
 
 
+def test_create_version_checksums(dao, package, channel_name, package_name, db, user):
+
+    dao.create_version(
+        channel_name=channel_name,
+        package_name=package_name,
+        package_format="tarbz2",
+        platform="noarch",
+        version="0.0.1",
+        build_number="0",
+        build_string="",
+        filename="filename.tar.bz2",
+        info='{"sha256": "SHA", "md5": "MD5", "size": 100}',
+        uploader_id=user.id,
+        upsert=False,
+    )
+
+    created_version = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.package_name == package_name)
+        .one()
+    )
+
+    assert created_version.sha256 == "SHA"
+    assert created_version.md5 == "MD5"
+    assert created_version.size == 100
+
+    # explicit checksums take precedence over the info
+    dao.create_version(
+        channel_name=channel_name,
+        package_name=package_name,
+        package_format="tarbz2",
+        platform="noarch",
+        version="0.0.1",
+        build_number="0",
+        build_string="",
+        filename="filename.tar.bz2",
+        info="{}",
+        uploader_id=user.id,
+        upsert=True,
+        sha256="NEW-SHA",
+        md5="NEW-MD5",
+        size=200,
+    )
+
+    db.refresh(created_version)
+    assert created_version.sha256 == "NEW-SHA"
+    assert created_version.md5 == "NEW-MD5"
+    assert created_version.size == 200
+
+
+def _version_data(package_name, version, platform="linux-64", build_number=0):
+    return {
+        "package_name": package_name,
+        "package_format": "tarbz2",
+        "platform": platform,
+        "version": version,
+        "build_number": build_number,
+        "build_string": f"h{build_number}",
+        "filename": f"{package_name}-{version}-h{build_number}.tar.bz2",
+        "info": "{}",
+        "sha256": f"SHA-{package_name}-{version}",
+        "md5": f"MD5-{package_name}-{version}",
+        "size": 100,
+        "channeldata": {
+            "packagename": package_name,
+            "version": version,
+            "subdirs": [platform],
+        },
+    }
+
+
+def test_create_versions(dao, package, channel_name, package_name, db, user):
+    dao.create_version(
+        channel_name=channel_name,
+        package_name=package_name,
+        package_format="tarbz2",
+        platform="linux-64",
+        version="0.2",
+        build_number=0,
+        build_string="h0",
+        filename=f"{package_name}-0.2-h0.tar.bz2",
+        info="{}",
+        uploader_id=user.id,
+    )
+
+    commits = []
+
+    def count_commit(session):
+        commits.append(session)
+
+    event.listen(db, "after_commit", count_commit)
+    try:
+        created = dao.create_versions(
+            channel_name,
+            [
+                _version_data(package_name, "0.1"),
+                _version_data(package_name, "0.3", platform="noarch"),
+                _version_data(package_name, "0.10"),
+                _version_data("other-package", "1.0"),
+                _version_data("other-package", "1.0", build_number=1),
+            ],
+            user.id,
+            role="owner",
+        )
+    finally:
+        event.remove(db, "after_commit", count_commit)
+
+    assert len(commits) == 1
+    assert [v.filename for v in created] == [
+        f"{package_name}-0.1-h0.tar.bz2",
+        f"{package_name}-0.3-h0.tar.bz2",
+        f"{package_name}-0.10-h0.tar.bz2",
+        "other-package-1.0-h0.tar.bz2",
+        "other-package-1.0-h1.tar.bz2",
+    ]
+    assert created[0].sha256 == f"SHA-{package_name}-0.1"
+
+    def versions(name):
+        return [
+            (v.version, v.build_number)
+            for v in db.query(PackageVersion)
+            .filter(PackageVersion.package_name == name)
+            .order_by(PackageVersion.sort_key.desc())
+        ]
+
+    assert versions(package_name) == [("0.10", 0), ("0.3", 0), ("0.2", 0), ("0.1", 0)]
+    assert versions("other-package") == [("1.0", 1), ("1.0", 0)]
+
+    # missing packages are created with the uploader as owner
+    other_package = dao.get_package(channel_name, "other-package")
+    assert other_package.members[0].user_id == user.id
+    assert other_package.members[0].role == "owner"
+
+    # channeldata of the package is merged for all its versions
+    channeldata = json.loads(dao.get_package(channel_name, package_name).channeldata)
+    assert channeldata["version"] == "0.10"
+    assert sorted(channeldata["subdirs"]) == ["linux-64", "noarch"]
+
+
+def test_create_versions_duplicate(dao, package, channel_name, package_name, db, user):
+    dao.create_versions(channel_name, [_version_data(package_name, "0.1")], user.id)
+
+    new_versions = [
+        _version_data(package_name, "0.2"),
+        dict(_version_data(package_name, "0.1"), sha256="NEW-SHA"),
+    ]
+    with pytest.raises(IntegrityError):
+        dao.create_versions(channel_name, new_versions, user.id)
+
+    # nothing was added
+    assert db.query(PackageVersion).count() == 1
+
+    dao.create_versions(channel_name, new_versions, user.id, upsert=True)
+    assert db.query(PackageVersion).count() == 2
+    updated_version = (
+        db.query(PackageVersion).filter(PackageVersion.version == "0.1").one()
+    )
+    assert updated_version.sha256 == "NEW-SHA"
+
+
 def test_update_channel(dao, channel, db):
 
     assert not channel.private
@@ -1,4 +1,9 @@
+import hashlib
+import json
 import os
+import shutil
+import threading
+import time
 import uuid
 from io import BytesIO
 from pathlib import Path
@@ -8,12 +13,21 @@ import pytest
 from quetz import rest_models
 from quetz.authorization import Rules
 from quetz.db_models import Channel, Package, PackageVersion, User
+from quetz.exceptions import PackageError
 from quetz.tasks.indexing import update_indexes
 from quetz.tasks.mirror import (
     KNOWN_SUBDIRS,
+    PROXY_CACHE_PREFIX,
+    AdaptiveConcurrency,
+    LocalCache,
     RemoteRepository,
     RemoteServerError,
+    _select_packages,
     initial_sync_mirror,
+    prewarm_proxy_cache,
+    prune_mirror_channel,
+    stream_package_to_store,
+    synchronize_packages,
 )
 
 
@@ -118,6 +132,58 @@ def dummy_repo(app, dummy_response):
     app.dependency_overrides.pop(get_remote_session)
 
 
+@pytest.fixture
+def dummy_session(dummy_response):
+    """remote session returning the `repo_content` responses in order"""
+
+    class DummySession:
+        def __init__(self):
+            self.requested = []
+
+        def get(self, path, stream=False):
+            self.requested.append(path)
+            return dummy_response()
+
+    return DummySession
+
+
+@pytest.fixture
+def dummy_files_session():
+    """remote session serving the content of a dict of files
+
+    The keys are the paths of the files relative to `url`; the dict can be
+    modified between requests and other paths are not found (404).
+    `status_codes` and `headers` set the status code (default: 200) of some
+    paths and the headers of all the responses."""
+
+    class DummyResponse:
+        def __init__(self, content, status_code, headers):
+            self.raw = BytesIO(content)
+            self.headers = headers
+            self.status_code = status_code
+
+    class DummySession:
+        def __init__(self, files, url="", status_codes=None, headers=None):
+            self.files = files
+            self.prefix = f"{url}/" if url else ""
+            self.status_codes = status_codes or {}
+            self.headers = headers or {}
+            self.requested = []
+
+        def get(self, path, stream=False):
+            self.requested.append(path)
+            path = path[len(self.prefix) :]  # noqa: E203
+            if path not in self.files:
+                return DummyResponse(b"Not Found", 404, self.headers)
+            return DummyResponse(
+                self.files[path],
+                self.status_codes.get(path, 200),
+                self.headers,
+            )
+
+    return DummySession
+
+
 @pytest.fixture
 def mirror_package(mirror_channel, db):
     pkg = Package(
@@ -380,7 +446,7 @@ def test_synchronisation_sha(
     mirror_channel,
     dao,
     config,
-    dummy_response,
+    dummy_session,
     db,
     user,
     n_new_packages,
@@ -391,14 +457,10 @@ def test_synchronisation_sha(
     pkgstore = config.get_package_store()
     rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
 
-    class DummySession:
-        def get(self, path, stream=False):
-            return dummy_response()
-
     # generate local repodata.json
     update_indexes(dao, pkgstore, mirror_channel.name)
 
-    dummy_repo = RemoteRepository("", DummySession())
+    dummy_repo = RemoteRepository("", dummy_session())
 
     initial_sync_mirror(
         mirror_channel.name,
@@ -419,6 +481,822 @@ def test_synchronisation_sha(
     assert len(versions) == n_new_packages + 1
 
 
+@pytest.mark.parametrize("config_extra", ["[mirroring]\nqueue_size = 1"])
+@pytest.mark.parametrize(
+    "repo_content",
+    [
+        [
+            b'{"packages": {"test-package-0.1-0.tar.bz2": {"sha256": "NEW-SHA"}, "other-package-0.2-0.tar.bz2": {"sha256": "OLD-SHA"}}}',  # noqa
+            DUMMY_PACKAGE,
+            OTHER_DUMMY_PACKAGE_V2,
+        ],
+    ],
+)
+def test_synchronisation_pipeline_stats(
+    mirror_channel, dao, config, dummy_session, db, user, package_version
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    dummy_repo = RemoteRepository("", dummy_session())
+
+    stats = initial_sync_mirror(
+        mirror_channel.name,
+        dummy_repo,
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    stats = stats.as_dict()
+    assert stats["downloaded"] == 2
+    assert stats["ingested"] == 2
+    assert stats["download_errors"] == 0
+    assert stats["downloaded_bytes"] == stats["ingested_bytes"] > 0
+    assert stats["queue_depth_max"] <= 1
+
+
+@pytest.mark.parametrize(
+    "config_extra",
+    ["[mirroring]\nstream_packages = true", "[mirroring]\nstream_packages = false"],
+)
+@pytest.mark.parametrize(
+    "repo_content",
+    [
+        [
+            b'{"packages": {"test-package-0.1-0.tar.bz2": {}}}',
+            DUMMY_PACKAGE,
+        ],
+    ],
+)
+def test_synchronisation_stream_packages(
+    mirror_channel, dao, config, dummy_session, db, user
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    dummy_repo = RemoteRepository("", dummy_session())
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        dummy_repo,
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    versions = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == mirror_channel.name)
+        .all()
+    )
+    assert len(versions) == 1
+
+    with open(DUMMY_PACKAGE, "rb") as fid:
+        content = fid.read()
+    info = json.loads(versions[0].info)
+    assert info["size"] == len(content)
+    assert info["md5"] == hashlib.md5(content).hexdigest()
+    assert info["sha256"] == hashlib.sha256(content).hexdigest()
+
+    with pkgstore.serve_path(
+        mirror_channel.name, "linux-64/test-package-0.1-0.tar.bz2"
+    ) as fid:
+        assert fid.read() == content
+
+
+@pytest.mark.parametrize("config_extra", ["[mirroring]\ntrust_repodata = true"])
+@pytest.mark.parametrize("sha256,n_versions", [(None, 1), ("WRONG-SHA", 0)])
+def test_synchronisation_trust_repodata(
+    mirror_channel, dao, config, dummy_files_session, db, user, sha256, n_versions
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    with open(DUMMY_PACKAGE, "rb") as fid:
+        content = fid.read()
+
+    repodata = {
+        "packages": {
+            "test-package-0.1-0.tar.bz2": {
+                "name": "test-package",
+                "version": "0.1",
+                "build": "0",
+                "build_number": 0,
+                "depends": [],
+                "subdir": "linux-64",
+                "sha256": sha256 or hashlib.sha256(content).hexdigest(),
+            }
+        }
+    }
+    channeldata = {
+        "packages": {
+            "test-package": {
+                "summary": "upstream summary",
+                "run_exports": {"0.1": {"weak": ["test-package"]}},
+            }
+        }
+    }
+    responses = {
+        "linux-64/repodata.json": json.dumps(repodata).encode(),
+        "channeldata.json": json.dumps(channeldata).encode(),
+        "linux-64/test-package-0.1-0.tar.bz2": content,
+    }
+
+    dummy_repo = RemoteRepository("", dummy_files_session(responses))
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        dummy_repo,
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    versions = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == mirror_channel.name)
+        .all()
+    )
+    assert len(versions) == n_versions
+
+    files = pkgstore.list_files(mirror_channel.name)
+    assert ("linux-64/test-package-0.1-0.tar.bz2" in files) == bool(n_versions)
+    # no staged file is left behind
+    assert not [f for f in files if f.startswith(".uploads/")]
+
+    if n_versions:
+        info = json.loads(versions[0].info)
+        assert info["size"] == len(content)
+        assert info["md5"] == hashlib.md5(content).hexdigest()
+        assert info["version"] == "0.1"
+
+        package = versions[0].package
+        assert package.summary == "upstream summary"
+        channeldata = json.loads(package.channeldata)
+        assert channeldata["summary"] == "upstream summary"
+        assert channeldata["subdirs"] == ["linux-64"]
+        assert channeldata["run_exports"] == {"0.1": {"weak": ["test-package"]}}
+
+
+def test_stream_package_keeps_stored_package(config, dummy_files_session):
+    pkgstore = config.get_package_store()
+    path = "linux-64/test-package-0.1-0.tar.bz2"
+
+    with open(DUMMY_PACKAGE, "rb") as fid:
+        content = fid.read()
+    pkgstore.add_package(BytesIO(content), "my-channel", path)
+
+    # a truncated download does not replace the package in the channel
+    dummy_repo = RemoteRepository("", dummy_files_session({path: content[:100]}))
+    with pytest.raises(PackageError):
+        stream_package_to_store(
+            dummy_repo,
+            path,
+            "my-channel",
+            pkgstore,
+            {"sha256": hashlib.sha256(content).hexdigest()},
+        )
+
+    assert pkgstore.list_files("my-channel") == [path]
+    with pkgstore.serve_path("my-channel", path) as fid:
+        assert fid.read() == content
+
+
+@pytest.mark.parametrize("config_extra", ["[mirroring]\ntrust_repodata = true"])
+def test_synchronisation_trust_repodata_without_checksum(
+    mirror_channel, dao, config, dummy_files_session, db, user
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    with open(DUMMY_PACKAGE, "rb") as fid:
+        content = fid.read()
+
+    # older channels do not list the checksums of the packages
+    repodata = {
+        "packages": {
+            "test-package-0.1-0.tar.bz2": {
+                "name": "test-package",
+                "version": "0.1",
+                "build": "0",
+                "build_number": 0,
+                "depends": [],
+                "subdir": "linux-64",
+                "summary": "upstream summary",
+            }
+        }
+    }
+    responses = {
+        "linux-64/repodata.json": json.dumps(repodata).encode(),
+        "channeldata.json": b"{}",
+        "linux-64/test-package-0.1-0.tar.bz2": content,
+    }
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", dummy_files_session(responses)),
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    versions = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == mirror_channel.name)
+        .all()
+    )
+    assert len(versions) == 1
+
+    # the metadata are read from the package file
+    info = json.loads(versions[0].info)
+    assert info["sha256"] == hashlib.sha256(content).hexdigest()
+    assert versions[0].package.summary != "upstream summary"
+
+
+@pytest.mark.parametrize(
+    "config_extra", ["[mirroring]\nbatch_length = 1\nnum_parallel_downloads = 1"]
+)
+def test_synchronisation_resume(
+    mirror_channel, dao, config, db, user, mocker, client, dummy_files_session
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    repodata = {
+        "packages": {
+            "test-package-0.1-0.tar.bz2": {},
+            "other-package-0.1-0.tar.bz2": {},
+        }
+    }
+    responses = {"linux-64/repodata.json": json.dumps(repodata).encode()}
+    for package in [DUMMY_PACKAGE, OTHER_DUMMY_PACKAGE]:
+        with open(package, "rb") as fid:
+            responses[f"linux-64/{package.name}"] = fid.read()
+
+    session = dummy_files_session(responses, headers={"etag": '"repodata-v1"'})
+    dummy_repo = RemoteRepository("", session)
+
+    from quetz import main
+
+    add_package_versions = main.add_package_versions
+
+    def interrupted_after_first_batch(*args, **kwargs):
+        if dao.get_mirror_sync_checkpoint(mirror_channel.name, "linux-64").batch:
+            raise RuntimeError("worker killed")
+        return add_package_versions(*args, **kwargs)
+
+    mocker.patch("quetz.main.add_package_versions", interrupted_after_first_batch)
+
+    with pytest.raises(RuntimeError):
+        initial_sync_mirror(
+            mirror_channel.name,
+            dummy_repo,
+            "linux-64",
+            dao,
+            pkgstore,
+            rules,
+            skip_errors=False,
+        )
+
+    checkpoint = dao.get_mirror_sync_checkpoint(mirror_channel.name, "linux-64")
+    assert checkpoint.status == "running"
+    assert checkpoint.position == 1
+    assert checkpoint.last_filename == "test-package-0.1-0.tar.bz2"
+    assert checkpoint.repodata_etag == '"repodata-v1"'
+
+    mocker.stopall()
+    session.requested.clear()
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        dummy_repo,
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    assert session.requested == [
+        "linux-64/repodata.json",
+        "linux-64/other-package-0.1-0.tar.bz2",
+    ]
+    versions = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == mirror_channel.name)
+        .all()
+    )
+    assert len(versions) == 2
+
+    response = client.get(f"/api/channels/{mirror_channel.name}/sync")
+    assert response.status_code == 200
+    progress = response.json()
+    assert len(progress) == 1
+    assert progress[0]["subdir"] == "linux-64"
+    assert progress[0]["status"] == "done"
+    assert progress[0]["position"] == progress[0]["n_packages"] == 2
+    assert progress[0]["last_filename"] == "other-package-0.1-0.tar.bz2"
+
+
+def test_synchronisation_repodata_delta(
+    mirror_channel, dao, config, db, user, dummy_files_session
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    responses = {}
+    for package in [DUMMY_PACKAGE, DUMMY_PACKAGE_V2, OTHER_DUMMY_PACKAGE]:
+        with open(package, "rb") as fid:
+            responses[f"linux-64/{package.name}"] = fid.read()
+
+    session = dummy_files_session(responses)
+    requested = session.requested
+    dummy_repo = RemoteRepository("", session)
+
+    def sync(packages):
+        responses["linux-64/repodata.json"] = json.dumps(
+            {"packages": packages}
+        ).encode()
+        requested.clear()
+        return initial_sync_mirror(
+            mirror_channel.name,
+            dummy_repo,
+            "linux-64",
+            dao,
+            pkgstore,
+            rules,
+            skip_errors=False,
+        ).as_dict()
+
+    stats = sync(
+        {
+            "test-package-0.1-0.tar.bz2": {"sha256": "SHA-1"},
+            "other-package-0.1-0.tar.bz2": {"sha256": "SHA-2"},
+        }
+    )
+    assert len(requested) == 3
+    assert stats["added"] is None
+
+    # same upstream repodata, nothing to do
+    stats = sync(
+        {
+            "test-package-0.1-0.tar.bz2": {"sha256": "SHA-1"},
+            "other-package-0.1-0.tar.bz2": {"sha256": "SHA-2"},
+        }
+    )
+    assert requested == ["linux-64/repodata.json"]
+    assert (stats["added"], stats["changed"], stats["removed"]) == (0, 0, 0)
+
+    # only the added and changed packages are downloaded
+    stats = sync(
+        {
+            "other-package-0.1-0.tar.bz2": {"sha256": "SHA-2-REBUILT"},
+            "test-package-0.2-0.tar.bz2": {"sha256": "SHA-3"},
+        }
+    )
+    assert requested[0] == "linux-64/repodata.json"
+    assert sorted(requested[1:]) == [
+        "linux-64/other-package-0.1-0.tar.bz2",
+        "linux-64/test-package-0.2-0.tar.bz2",
+    ]
+    assert (stats["added"], stats["changed"], stats["removed"]) == (1, 1, 1)
+
+    checkpoint = dao.get_mirror_sync_checkpoint(mirror_channel.name, "linux-64")
+    assert checkpoint.status == "done"
+    assert checkpoint.duration is not None
+
+
+def test_synchronisation_retries_failed_packages(
+    mirror_channel, dao, config, db, user, dummy_files_session
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    repodata = {
+        "packages": {
+            "test-package-0.1-0.tar.bz2": {"sha256": "SHA-1"},
+            "other-package-0.1-0.tar.bz2": {"sha256": "SHA-2"},
+        }
+    }
+    responses = {"linux-64/repodata.json": json.dumps(repodata).encode()}
+    with open(DUMMY_PACKAGE, "rb") as fid:
+        responses[f"linux-64/{DUMMY_PACKAGE.name}"] = fid.read()
+
+    # the other package can not be downloaded
+    session = dummy_files_session(responses)
+    dummy_repo = RemoteRepository("", session)
+
+    def sync():
+        session.requested.clear()
+        initial_sync_mirror(
+            mirror_channel.name, dummy_repo, "linux-64", dao, pkgstore, rules
+        )
+        return [
+            version.filename
+            for version in db.query(PackageVersion)
+            .filter(PackageVersion.channel_name == mirror_channel.name)
+            .order_by(PackageVersion.filename)
+        ]
+
+    assert sync() == ["test-package-0.1-0.tar.bz2"]
+
+    checkpoint = dao.get_mirror_sync_checkpoint(mirror_channel.name, "linux-64")
+    assert checkpoint.status == "done"
+    assert checkpoint.repodata_sha256 is None
+
+    # the upstream repodata did not change, the failed package is retried
+    with open(OTHER_DUMMY_PACKAGE, "rb") as fid:
+        responses[f"linux-64/{OTHER_DUMMY_PACKAGE.name}"] = fid.read()
+
+    assert sync() == ["other-package-0.1-0.tar.bz2", "test-package-0.1-0.tar.bz2"]
+    assert session.requested == [
+        "linux-64/repodata.json",
+        "linux-64/other-package-0.1-0.tar.bz2",
+    ]
+
+    # and the next synchronisation has nothing to do
+    sync()
+    assert session.requested == ["linux-64/repodata.json"]
+
+
+@pytest.mark.parametrize(
+    "config_extra,expected_updates",
+    [
+        ("[mirroring]\nbatch_length = 1\nnum_parallel_downloads = 1", 4),
+        (
+            "[mirroring]\nbatch_length = 1\nnum_parallel_downloads = 1\n"
+            "index_update_packages = 2",
+            2,
+        ),
+        (
+            "[mirroring]\nbatch_length = 1\nnum_parallel_downloads = 1\n"
+            "index_update_interval = 3600",
+            1,
+        ),
+    ],
+)
+def test_synchronisation_index_updates(
+    mirror_channel, dao, config, db, user, mocker, expected_updates, dummy_files_session
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    responses = {}
+    for package in [DUMMY_PACKAGE, DUMMY_PACKAGE_V2, OTHER_DUMMY_PACKAGE]:
+        with open(package, "rb") as fid:
+            responses[f"linux-64/{package.name}"] = fid.read()
+    responses["linux-64/repodata.json"] = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": {},
+                "test-package-0.2-0.tar.bz2": {},
+                "other-package-0.1-0.tar.bz2": {},
+            }
+        }
+    ).encode()
+
+    from quetz.tasks import mirror
+
+    update_indexes = mocker.patch(
+        "quetz.tasks.mirror._update_subdir_indexes",
+        wraps=mirror._update_subdir_indexes,
+    )
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", dummy_files_session(responses)),
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    assert update_indexes.call_count == expected_updates
+
+    # the indexes are complete at the end of the synchronisation
+    with pkgstore.serve_path(mirror_channel.name, "linux-64/repodata.json") as fid:
+        repodata = json.load(fid)
+    assert len(repodata["packages"]) == 3
+
+
+def test_prune_mirror_channel(
+    mirror_channel, dao, config, db, user, dummy_files_session
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    responses = {}
+    for package in [DUMMY_PACKAGE, OTHER_DUMMY_PACKAGE]:
+        with open(package, "rb") as fid:
+            responses[f"linux-64/{package.name}"] = fid.read()
+    responses["linux-64/repodata.json"] = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": {},
+                "other-package-0.1-0.tar.bz2": {},
+            }
+        }
+    ).encode()
+
+    session = dummy_files_session(responses, "http://host")
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("http://host", session),
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    def local_files():
+        return sorted(
+            filename
+            for filename, in db.query(PackageVersion.filename).filter(
+                PackageVersion.channel_name == mirror_channel.name
+            )
+        )
+
+    assert local_files() == [
+        "other-package-0.1-0.tar.bz2",
+        "test-package-0.1-0.tar.bz2",
+    ]
+
+    # other-package was deleted upstream
+    responses["linux-64/repodata.json"] = json.dumps(
+        {"packages": {"test-package-0.1-0.tar.bz2": {}}}
+    ).encode()
+
+    report = prune_mirror_channel(
+        mirror_channel.name, dao, pkgstore, session, dry_run=True
+    )
+    assert report == {"linux-64": ["other-package-0.1-0.tar.bz2"]}
+    assert len(local_files()) == 2
+
+    report = prune_mirror_channel(mirror_channel.name, dao, pkgstore, session)
+    assert report == {"linux-64": ["other-package-0.1-0.tar.bz2"]}
+    assert local_files() == ["test-package-0.1-0.tar.bz2"]
+
+    files = pkgstore.list_files(mirror_channel.name)
+    assert "linux-64/other-package-0.1-0.tar.bz2" not in files
+    assert "linux-64/test-package-0.1-0.tar.bz2" in files
+
+    with pkgstore.serve_path(mirror_channel.name, "linux-64/repodata.json") as fid:
+        repodata = json.load(fid)
+    assert list(repodata["packages"]) == ["test-package-0.1-0.tar.bz2"]
+
+    # repodata.json missing upstream, the subdir is skipped unless channeldata
+    # lists the other subdirs of the channel
+    del responses["linux-64/repodata.json"]
+    report = prune_mirror_channel(mirror_channel.name, dao, pkgstore, session)
+    assert report == {}
+    assert local_files() == ["test-package-0.1-0.tar.bz2"]
+
+    responses["channeldata.json"] = b'{"subdirs": ["linux-64", "noarch"]}'
+    report = prune_mirror_channel(mirror_channel.name, dao, pkgstore, session)
+    assert report == {}
+    assert local_files() == ["test-package-0.1-0.tar.bz2"]
+
+    responses["channeldata.json"] = b'{"subdirs": ["noarch"]}'
+    report = prune_mirror_channel(mirror_channel.name, dao, pkgstore, session)
+    assert report == {"linux-64": ["test-package-0.1-0.tar.bz2"]}
+    assert local_files() == []
+
+
+@pytest.mark.parametrize(
+    "config_extra",
+    ["[mirroring]\nnum_parallel_subdirs = 2\nmax_parallel_downloads = 3"],
+)
+def test_synchronize_packages_parallel_subdirs(
+    mirror_channel, dao, config, db, user, mocker, dummy_files_session
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    session = dummy_files_session(
+        {"channeldata.json": b'{"subdirs": ["linux-64", "osx-64", "noarch"]}'},
+        "http://host",
+    )
+
+    lock = threading.Lock()
+    running = []
+    calls = []
+
+    def dummy_sync(channel_name, remote_repo, arch, subdir_dao, *args, **kwargs):
+        with lock:
+            running.append(arch)
+            calls.append((arch, subdir_dao, kwargs["download_slots"]))
+            assert len(running) <= 2
+        time.sleep(0.05)
+        with lock:
+            running.remove(arch)
+
+    mocker.patch("quetz.tasks.mirror.initial_sync_mirror", dummy_sync)
+
+    synchronize_packages(mirror_channel.name, dao, pkgstore, rules, session)
+
+    assert sorted(arch for arch, _, _ in calls) == ["linux-64", "noarch", "osx-64"]
+
+    # each subdir has its own db session
+    sessions = {id(subdir_dao.db) for _, subdir_dao, _ in calls}
+    assert len(sessions) == 3
+    assert id(dao.db) not in sessions
+
+    # downloads of all subdirs share the same limit
+    download_slots = {slots for _, _, slots in calls}
+    assert len(download_slots) == 1
+    slots = download_slots.pop()
+    assert all(slots.acquire(blocking=False) for _ in range(3))
+    assert not slots.acquire(blocking=False)
+
+
+@pytest.mark.parametrize(
+    "repo_content",
+    [
+        [
+            b'{"packages": {"test-package-0.1-0.tar.bz2": {}, "other-package-0.1-0.tar.bz2": {}}}',  # noqa
+            DUMMY_PACKAGE,
+            OTHER_DUMMY_PACKAGE,
+        ],
+    ],
+)
+def test_synchronisation_download_slots(
+    mirror_channel, dao, config, dummy_response, db, user
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    class DummySession:
+        def get(self, path, stream=False):
+            nonlocal active, max_active
+            with lock:
+                response = dummy_response()
+                active += 1
+                max_active = max(max_active, active)
+            time.sleep(0.05)
+            with lock:
+                active -= 1
+            return response
+
+    dummy_repo = RemoteRepository("", DummySession())
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        dummy_repo,
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+        download_slots=threading.BoundedSemaphore(1),
+    )
+
+    assert max_active == 1
+    versions = (
+        db.query(PackageVersion)
+        .filter(PackageVersion.channel_name == mirror_channel.name)
+        .all()
+    )
+    assert len(versions) == 2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _run_window(controller, clock, size, **outcome):
+    """complete one adjustment window of downloads lasting one second"""
+    n_downloads = max(controller.limit, controller.min_window)
+    for _ in range(n_downloads):
+        assert controller.acquire()
+        clock.now += 1 / n_downloads
+        controller.release(size, **outcome)
+
+
+def test_adaptive_concurrency(mocker):
+    clock = FakeClock()
+    mocker.patch("quetz.tasks.mirror.time", clock)
+
+    controller = AdaptiveConcurrency(4, min_limit=2, max_limit=6)
+    assert controller.limit == 4
+
+    # the limit is raised as long as the throughput improves
+    _run_window(controller, clock, 1000)
+    assert controller.limit == 5
+    _run_window(controller, clock, 2000)
+    assert controller.limit == 6
+    # upper bound
+    _run_window(controller, clock, 3000)
+    assert controller.limit == 6
+
+    # and lowered when it does not
+    _run_window(controller, clock, 1000)
+    assert controller.limit == 5
+
+    # throttling by the upstream server halves the limit
+    _run_window(controller, clock, 1000, error=True, throttled=True)
+    assert controller.limit == 2
+    # lower bound
+    _run_window(controller, clock, 0, error=True, throttled=True)
+    assert controller.limit == 2
+
+    # probing upwards again after throttling
+    _run_window(controller, clock, 1000)
+    assert controller.limit == 3
+
+    # too many errors
+    _run_window(controller, clock, 0, error=True)
+    assert controller.limit == 2
+
+
+def test_adaptive_concurrency_limits_active_downloads():
+    controller = AdaptiveConcurrency(2, max_limit=4)
+    stop = threading.Event()
+
+    assert controller.acquire(stop)
+    assert controller.acquire(stop)
+
+    # no slot available, the waiting worker gives up when stopped
+    stop.set()
+    assert not controller.acquire(stop)
+
+    controller.release(100)
+    assert controller.acquire()
+    assert controller.active == 2
+
+    # a slot freed without download is not counted in the throughput
+    controller.cancel()
+    assert controller.active == 1
+    assert controller._completed == 1
+
+
+@pytest.mark.parametrize(
+    "config_extra",
+    [
+        "[mirroring]\nadaptive_downloads = true\nnum_parallel_downloads = 2\n"
+        "max_adaptive_downloads = 4"
+    ],
+)
+def test_synchronisation_adaptive_downloads(
+    mirror_channel, dao, config, db, user, dummy_files_session
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+
+    responses = {}
+    for package in [DUMMY_PACKAGE, DUMMY_PACKAGE_V2, OTHER_DUMMY_PACKAGE]:
+        with open(package, "rb") as fid:
+            responses[f"linux-64/{package.name}"] = fid.read()
+    responses["linux-64/repodata.json"] = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": {},
+                "test-package-0.2-0.tar.bz2": {},
+                "other-package-0.1-0.tar.bz2": {},
+            }
+        }
+    ).encode()
+
+    session = dummy_files_session(
+        responses, status_codes={"linux-64/test-package-0.2-0.tar.bz2": 429}
+    )
+
+    stats = initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", session),
+        "linux-64",
+        dao,
+        pkgstore,
+        rules,
+    ).as_dict()
+
+    assert stats["downloaded"] == 2
+    assert stats["download_errors"] == 1
+    assert 1 <= stats["concurrency"] <= 4
+
+    checkpoint = dao.get_mirror_sync_checkpoint(mirror_channel.name, "linux-64")
+    assert checkpoint.download_concurrency == stats["concurrency"]
+
+
 @pytest.mark.parametrize(
     "repo_content,timestamp_mirror_sync,expected_timestamp,new_package",
     [
@@ -458,7 +1336,7 @@ def test_synchronisation_timestamp(
     mirror_channel,
     dao,
     config,
-    dummy_response,
+    dummy_session,
     db,
     user,
     expected_timestamp,
@@ -470,11 +1348,7 @@ def test_synchronisation_timestamp(
     pkgstore = config.get_package_store()
     rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
 
-    class DummySession:
-        def get(self, path, stream=False):
-            return dummy_response()
-
-    dummy_repo = RemoteRepository("", DummySession())
+    dummy_repo = RemoteRepository("", dummy_session())
 
     initial_sync_mirror(
         mirror_channel.name,
@@ -570,6 +1444,167 @@ def test_always_download_repodata(client, owner, dummy_repo):
     ]
 
 
+@pytest.mark.parametrize(
+    "config_extra",
+    [
+        '[mirroring]\nproxy_cache = "pkgstore"',
+        '[mirroring]\nproxy_cache = "pkgstore"\nproxy_cache_local_size = 1000',
+    ],
+)
+def test_download_remote_file_pkgstore_cache(
+    client, owner, dummy_repo, config, config_dir
+):
+    """Test downloading from a cache shared through the package store."""
+    response = client.get("/api/dummylogin/bartosz")
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/channels",
+        json={
+            "name": "proxy_channel",
+            "private": False,
+            "mirror_channel_url": "http://host",
+            "mirror_mode": "proxy",
+        },
+    )
+    assert response.status_code == 201
+
+    response = client.get("/channels/proxy_channel/test_file.txt")
+
+    assert response.status_code == 200
+    assert response.content == b"Hello world!"
+    assert dummy_repo == [("http://host/test_file.txt")]
+
+    pkgstore = config.get_package_store()
+    cached = pkgstore.serve_path(
+        "proxy_channel", f"{PROXY_CACHE_PREFIX}/test_file.txt"
+    ).read()
+    assert cached == b"Hello world!"
+
+    # another instance with its own local tier would use the shared cache
+    shutil.rmtree(os.path.join(config_dir, "cache"), ignore_errors=True)
+
+    response = client.get("/channels/proxy_channel/test_file.txt")
+
+    assert response.status_code == 200
+    assert response.content == b"Hello world!"
+    assert dummy_repo == [("http://host/test_file.txt")]
+
+
+def test_local_cache_eviction(config_dir, tmp_path):
+
+    cache = LocalCache("my-channel", cache_dir=str(tmp_path), max_size=10)
+
+    cache.dump("old_file.txt", BytesIO(b"old data"))
+    assert "old_file.txt" in cache
+
+    cache.dump("new_file.txt", BytesIO(b"new data"))
+    assert "new_file.txt" in cache
+    assert "old_file.txt" not in cache
+
+
+@pytest.mark.parametrize(
+    "package_patterns,latest,expected",
+    [
+        (None, None, ["a-1.0-0.tar.bz2", "a-2.0-0.tar.bz2", "b-1.0-0.tar.bz2"]),
+        (["a"], None, ["a-1.0-0.tar.bz2", "a-2.0-0.tar.bz2"]),
+        (["b*"], None, ["b-1.0-0.tar.bz2"]),
+        (None, 1, ["a-2.0-0.tar.bz2", "b-1.0-0.tar.bz2"]),
+    ],
+)
+def test_select_packages_for_prewarm(package_patterns, latest, expected):
+    packages = {
+        "a-1.0-0.tar.bz2": {"name": "a", "version": "1.0"},
+        "a-2.0-0.tar.bz2": {"name": "a", "version": "2.0"},
+        "b-1.0-0.tar.bz2": {"name": "b", "version": "1.0"},
+    }
+    assert sorted(_select_packages(packages, package_patterns, latest)) == expected
+
+
+@pytest.mark.parametrize(
+    "repo_content",
+    [
+        [
+            b'{"packages": {"test-package-0.1-0.tar.bz2": {"name": "test-package"},'
+            b' "other-package-0.1-0.tar.bz2": {"name": "other-package"}}}',
+            b"package content",
+        ]
+    ],
+)
+def test_prewarm_proxy_cache(proxy_channel, dao, config, dummy_session):
+
+    session = dummy_session()
+
+    stats = prewarm_proxy_cache(
+        proxy_channel.name,
+        dao,
+        session,
+        config,
+        subdirs=["linux-64"],
+        package_patterns=["test-*"],
+    )
+
+    assert session.requested == [
+        "http://host/linux-64/repodata.json",
+        "http://host/linux-64/test-package-0.1-0.tar.bz2",
+    ]
+    assert stats == {"files": 1, "bytes": 15, "cached": 0, "failed": 0}
+
+    cache = LocalCache(proxy_channel.name)
+    assert "linux-64/test-package-0.1-0.tar.bz2" in cache
+
+
+@pytest.mark.parametrize(
+    "repo_content",
+    [
+        [
+            b'{"packages": {"test-package-0.1-0.tar.bz2": {"name": "test-package"}}}',
+            b"package content",
+        ]
+    ],
+)
+def test_prewarm_proxy_cache_store_error(
+    proxy_channel, dao, config, dummy_session, mocker
+):
+    # the cache can not be written (for example, the disk is full)
+    mocker.patch.object(LocalCache, "dump", side_effect=OSError("No space left"))
+
+    stats = prewarm_proxy_cache(
+        proxy_channel.name,
+        dao,
+        dummy_session(),
+        config,
+        subdirs=["linux-64"],
+        package_patterns=["test-*"],
+    )
+
+    assert stats == {"files": 0, "bytes": 0, "cached": 0, "failed": 1}
+
+
+def test_prewarm_cache_action(proxy_channel, mirror_channel, client, owner, mocker):
+    prewarm = mocker.patch("quetz.tasks.mirror.prewarm_proxy_cache")
+
+    response = client.get("/api/dummylogin/bartosz")
+    assert response.status_code == 200
+
+    response = client.put(
+        f"/api/channels/{mirror_channel.name}/actions",
+        json={"action": "prewarm_cache"},
+    )
+    assert response.status_code == 405
+
+    response = client.put(
+        f"/api/channels/{proxy_channel.name}/actions",
+        json={"action": "prewarm_cache", "packages": ["numpy"], "latest": 2},
+    )
+    assert response.status_code == 200
+    prewarm.assert_called_once()
+    _, kwargs = prewarm.call_args
+    assert kwargs["channel_name"] == proxy_channel.name
+    assert kwargs["package_patterns"] == ["numpy"]
+    assert kwargs["latest"] == 2
+
+
 def test_method_not_implemented_for_proxies(client, proxy_channel):
 
     response = client.post("/api/channels/{}/packages".format(proxy_channel.name))
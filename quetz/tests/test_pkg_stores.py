@@ -1,3 +1,5 @@
+import hashlib
+import io
 import os
 import tempfile
 import uuid
@@ -34,6 +36,145 @@ def test_local_store():
     assert files == ["test_2.txt"]
 
 
+def _multipart_upload(pkg_store, channel_name):
+    part_size = max(pkg_store.min_upload_part_size, 10)
+    content = b"a" * part_size + b"b" * part_size + b"c"
+
+    upload_id = pkg_store.start_upload(channel_name, ".uploads/test")
+    parts = []
+    for offset in range(0, len(content), part_size):
+        part_number = len(parts) + 1
+        data = content[offset:][:part_size]
+        if part_number == 2:
+            # a failed part is uploaded again
+            pkg_store.upload_part(
+                channel_name,
+                ".uploads/test",
+                upload_id,
+                part_number,
+                offset,
+                io.BytesIO(b"x" * (part_size + 5)),
+            )
+        parts.append(
+            pkg_store.upload_part(
+                channel_name,
+                ".uploads/test",
+                upload_id,
+                part_number,
+                offset,
+                io.BytesIO(data),
+            )
+        )
+    pkg_store.complete_upload(channel_name, ".uploads/test", upload_id, parts)
+    pkg_store.move_file(channel_name, ".uploads/test", "linux-64/test.tar.bz2")
+
+    assert pkg_store.list_files(channel_name) == ["linux-64/test.tar.bz2"]
+    with pkg_store.serve_path(channel_name, "linux-64/test.tar.bz2") as f:
+        assert f.read() == content
+
+    # aborted uploads leave no file
+    upload_id = pkg_store.start_upload(channel_name, ".uploads/other")
+    pkg_store.upload_part(
+        channel_name, ".uploads/other", upload_id, 1, 0, io.BytesIO(b"data")
+    )
+    pkg_store.abort_upload(channel_name, ".uploads/other", upload_id)
+    assert pkg_store.list_files(channel_name) == ["linux-64/test.tar.bz2"]
+
+
+@pytest.mark.parametrize("deduplicate", [False, True])
+def test_local_store_multipart_upload(deduplicate):
+    pkg_store = LocalStore(
+        {'channels_dir': tempfile.mkdtemp(), 'deduplicate': deduplicate}
+    )
+    pkg_store.create_channel("my-channel")
+
+    _multipart_upload(pkg_store, "my-channel")
+
+
+def _deduplicate(pkg_store, channels):
+    dev, stable = channels
+    content = b"package content"
+
+    for channel in channels:
+        pkg_store.create_channel(channel)
+        pkg_store.add_package(io.BytesIO(content), channel, "linux-64/a.tar.bz2")
+        assert pkg_store.list_files(channel) == ["linux-64/a.tar.bz2"]
+
+    # the package is replaced in one channel only
+    pkg_store.add_package(io.BytesIO(b"new content"), stable, "linux-64/a.tar.bz2")
+    with pkg_store.serve_path(dev, "linux-64/a.tar.bz2") as f:
+        assert f.read() == content
+    with pkg_store.serve_path(stable, "linux-64/a.tar.bz2") as f:
+        assert f.read() == b"new content"
+
+    pkg_store.move_file(stable, "linux-64/a.tar.bz2", "linux-64/b.tar.bz2")
+    assert pkg_store.list_files(stable) == ["linux-64/b.tar.bz2"]
+    with pkg_store.serve_path(stable, "linux-64/b.tar.bz2") as f:
+        assert f.read() == b"new content"
+
+    # copies refer to the same content
+    pkg_store.copy_file(dev, "linux-64/a.tar.bz2", stable, "noarch/a.tar.bz2")
+    pkg_store.delete_file(dev, "linux-64/a.tar.bz2")
+    with pkg_store.serve_path(stable, "noarch/a.tar.bz2") as f:
+        assert f.read() == content
+
+    pkg_store.delete_files(stable, ["linux-64/b.tar.bz2", "noarch/a.tar.bz2"])
+    assert pkg_store.list_files(dev) == []
+    assert pkg_store.list_files(stable) == []
+
+
+def test_local_store_deduplicate():
+    channels_dir = tempfile.mkdtemp()
+    pkg_store = LocalStore({'channels_dir': channels_dir, 'deduplicate': True})
+
+    content = b"package content"
+    for channel in ["dev", "stable"]:
+        pkg_store.add_package(io.BytesIO(content), channel, "linux-64/a.tar.bz2")
+
+    # the files are links to a single copy
+    blob_path = pkg_store._blob_path(hashlib.sha256(content).hexdigest())
+    assert os.stat(blob_path).st_nlink == 3
+    assert os.path.samefile(
+        os.path.join(channels_dir, "dev", "linux-64", "a.tar.bz2"),
+        os.path.join(channels_dir, "stable", "linux-64", "a.tar.bz2"),
+    )
+
+    pkg_store.delete_file("dev", "linux-64/a.tar.bz2")
+    assert os.stat(blob_path).st_nlink == 2
+    pkg_store.delete_file("stable", "linux-64/a.tar.bz2")
+    assert not os.path.exists(blob_path)
+
+    _deduplicate(pkg_store, ["dev", "stable"])
+
+    # no blob is left
+    assert not [
+        f
+        for _, _, files in os.walk(os.path.join(channels_dir, ".blobs"))
+        for f in files
+    ]
+
+
+@pytest.mark.parametrize("deduplicate", [False, True])
+def test_local_store_copy_file(deduplicate):
+    channels_dir = tempfile.mkdtemp()
+    pkg_store = LocalStore({'channels_dir': channels_dir, 'deduplicate': deduplicate})
+    pkg_store.add_package(io.BytesIO(b"content"), "dev", "linux-64/a.tar.bz2")
+
+    pkg_store.copy_file("dev", "linux-64/a.tar.bz2", "stable", "linux-64/a.tar.bz2")
+
+    # the copy is a hard link
+    assert os.path.samefile(
+        os.path.join(channels_dir, "dev", "linux-64", "a.tar.bz2"),
+        os.path.join(channels_dir, "stable", "linux-64", "a.tar.bz2"),
+    )
+    pkg_store.delete_file("dev", "linux-64/a.tar.bz2")
+    with pkg_store.serve_path("stable", "linux-64/a.tar.bz2") as f:
+        assert f.read() == b"content"
+
+    with pytest.raises(FileNotFoundError):
+        pkg_store.copy_file("dev", "linux-64/a.tar.bz2", "stable", "linux-64/b.tar.bz2")
+
+
 @pytest.fixture
 def channel_name():
     return "mychannel" + str(uuid.uuid4())
@@ -69,3 +210,97 @@ def test_s3_store(s3_store, channel_name):
 
     files = pkg_store.list_files(channel_name)
     assert files == ["test_2.txt"]
+
+
+@pytest.mark.skipif(not s3_config['key'], reason="requires s3 credentials")
+def test_s3_store_multipart_upload(s3_store, channel_name):
+    _multipart_upload(s3_store, channel_name)
+
+
+@pytest.mark.skipif(not s3_config['key'], reason="requires s3 credentials")
+def test_s3_store_deduplicate(channel_name):
+    pkg_store = S3Store(
+        {**s3_config, 'deduplicate': True, 'blobs_bucket': f"{channel_name}-blobs"}
+    )
+    channels = [f"{channel_name}-dev", f"{channel_name}-stable"]
+    pkg_store.fs.mkdir(pkg_store.blobs_bucket, acl="private")
+
+    try:
+        _deduplicate(pkg_store, channels)
+        assert not pkg_store.fs.find(pkg_store.blobs_bucket)
+    finally:
+        for bucket in channels:
+            pkg_store.fs.rm(pkg_store._bucket_map(bucket), recursive=True)
+        pkg_store.fs.rm(pkg_store.blobs_bucket, recursive=True)
+
+
+@pytest.fixture
+def s3_dedup_store(channel_name):
+    pkg_store = S3Store(
+        {**s3_config, 'deduplicate': True, 'blobs_bucket': f"{channel_name}-blobs"}
+    )
+    pkg_store.fs.mkdir(pkg_store.blobs_bucket, acl="private")
+    pkg_store.create_channel(channel_name)
+
+    yield pkg_store
+
+    # cleanup
+    pkg_store.fs.rm(pkg_store._bucket_map(channel_name), recursive=True)
+    pkg_store.fs.rm(pkg_store.blobs_bucket, recursive=True)
+
+
+@pytest.mark.skipif(not s3_config['key'], reason="requires s3 credentials")
+def test_s3_store_deduplicate_upload(s3_dedup_store, channel_name):
+    pkg_store = s3_dedup_store
+    fs = pkg_store.fs
+    file_path = f"{pkg_store._bucket_map(channel_name)}/linux-64/test.tar.bz2"
+
+    _multipart_upload(pkg_store, channel_name)
+
+    # the reference of the uploaded file moved with it
+    sha256 = pkg_store._read_pointer(fs, file_path)
+    assert sha256
+    fs.invalidate_cache()
+    assert fs.find(pkg_store._refs_path(sha256)) == [
+        pkg_store._ref_path(sha256, channel_name, "linux-64/test.tar.bz2")
+    ]
+
+    # the blob of a replaced file is released
+    pkg_store.add_package(io.BytesIO(b"new content"), channel_name, ".uploads/new")
+    pkg_store.move_file(channel_name, ".uploads/new", "linux-64/test.tar.bz2")
+    fs.invalidate_cache()
+    assert not fs.exists(pkg_store._blob_path(sha256))
+    with pkg_store.serve_path(channel_name, "linux-64/test.tar.bz2") as f:
+        assert f.read() == b"new content"
+
+    pkg_store.delete_file(channel_name, "linux-64/test.tar.bz2")
+    fs.invalidate_cache()
+    assert not fs.find(pkg_store.blobs_bucket)
+
+
+@pytest.mark.skipif(not s3_config['key'], reason="requires s3 credentials")
+@pytest.mark.parametrize("deduplicate", [False, True])
+def test_s3_store_copy_file(mocker, s3_dedup_store, channel_name, deduplicate):
+    pkg_store = s3_dedup_store
+    pkg_store.deduplicate = deduplicate
+    other_channel = f"{channel_name}-other"
+    pkg_store.create_channel(other_channel)
+    pkg_store.add_package(io.BytesIO(b"content"), channel_name, "linux-64/a.tar.bz2")
+
+    try:
+        # the content is not read to copy it
+        serve_path = mocker.spy(pkg_store, "serve_path")
+        pkg_store.copy_file(
+            channel_name, "linux-64/a.tar.bz2", other_channel, "linux-64/a.tar.bz2"
+        )
+        serve_path.assert_not_called()
+
+        pkg_store.delete_file(channel_name, "linux-64/a.tar.bz2")
+        with pkg_store.serve_path(other_channel, "linux-64/a.tar.bz2") as f:
+            assert f.read() == b"content"
+
+        pkg_store.delete_file(other_channel, "linux-64/a.tar.bz2")
+        pkg_store.fs.invalidate_cache()
+        assert not pkg_store.fs.find(pkg_store.blobs_bucket)
+    finally:
+        pkg_store.fs.rm(pkg_store._bucket_map(other_channel), recursive=True)
@@ -0,0 +1,208 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from quetz import rest_models
+from quetz.dao import Dao
+from quetz.tasks import scheduler
+from quetz.tasks.scheduler import MirrorSyncScheduler, next_sync_time
+
+
+@pytest.fixture
+def mirror_channel(dao, user, db):
+
+    channel_data = rest_models.Channel(
+        name="test_mirror_channel",
+        private=False,
+        mirror_channel_url="http://host",
+        mirror_mode="mirror",
+    )
+
+    channel = dao.create_channel(channel_data, user.id, "owner")
+
+    yield channel
+
+    db.delete(channel)
+    db.commit()
+
+
+@pytest.fixture
+def owner(user, db):
+    user.role = "owner"
+    db.commit()
+    yield user
+
+
+@pytest.fixture
+def local_channel(dao, user, db):
+
+    channel_data = rest_models.Channel(name="test_local_channel", private=False)
+
+    channel = dao.create_channel(channel_data, user.id, "owner")
+
+    yield channel
+
+    db.delete(channel)
+    db.commit()
+
+
+@pytest.mark.parametrize(
+    "failures,max_backoff,expected",
+    [(0, 0, 60), (1, 0, 60), (1, 3600, 120), (3, 3600, 480), (10, 3600, 3600)],
+)
+def test_next_sync_time(failures, max_backoff, expected):
+    now = datetime.utcnow()
+    next_run = next_sync_time(now, 60, failures=failures, max_backoff=max_backoff)
+    assert next_run == now + timedelta(seconds=expected)
+
+
+def test_next_sync_time_jitter():
+    now = datetime.utcnow()
+    for _ in range(10):
+        next_run = next_sync_time(now, 100, jitter=0.5)
+        assert now + timedelta(seconds=100) <= next_run
+        assert next_run <= now + timedelta(seconds=150)
+
+
+def test_put_mirror_sync_schedule(auth_client, mirror_channel, local_channel, user):
+
+    response = auth_client.get(f"/api/channels/{mirror_channel.name}/sync/schedule")
+    assert response.status_code == 200
+    assert response.json()["interval"] is None
+    assert response.json()["status"] == "idle"
+
+    response = auth_client.put(
+        f"/api/channels/{mirror_channel.name}/sync/schedule", json={"interval": 3600}
+    )
+    assert response.status_code == 200
+
+    response = auth_client.get(f"/api/channels/{mirror_channel.name}/sync/schedule")
+    schedule = response.json()
+    assert schedule["interval"] == 3600
+    assert schedule["next_run"] is not None
+    assert schedule["failures"] == 0
+
+    response = auth_client.put(
+        f"/api/channels/{mirror_channel.name}/sync/schedule", json={"interval": None}
+    )
+    assert response.status_code == 200
+    assert response.json()["interval"] is None
+    assert response.json()["next_run"] is None
+
+    response = auth_client.put(
+        f"/api/channels/{local_channel.name}/sync/schedule", json={"interval": 3600}
+    )
+    assert response.status_code == 405
+
+
+def test_post_channel_with_sync_interval(auth_client, owner, dao, db):
+
+    response = auth_client.post(
+        "/api/channels",
+        json={
+            "name": "scheduled-mirror",
+            "private": False,
+            "mirror_channel_url": "http://host",
+            "mirror_mode": "mirror",
+            "sync_interval": 3600,
+            "metadata": {"actions": []},
+        },
+    )
+    assert response.status_code == 201
+
+    schedule = dao.get_mirror_sync_schedule("scheduled-mirror")
+    assert schedule.next_run > datetime.utcnow() + timedelta(seconds=3000)
+
+    db.delete(dao.get_channel("scheduled-mirror"))
+    db.commit()
+
+    response = auth_client.post(
+        "/api/channels",
+        json={"name": "scheduled-local", "private": False, "sync_interval": 3600},
+    )
+    assert response.status_code == 422
+
+
+def test_claim_mirror_sync(dao, mirror_channel, user):
+    dao.set_mirror_sync_interval(mirror_channel.name, 60, user.id)
+
+    now = datetime.utcnow()
+    stale_before = now - timedelta(hours=1)
+    assert not dao.get_due_mirror_syncs(now, stale_before)
+
+    now += timedelta(seconds=61)
+    assert dao.get_due_mirror_syncs(now, stale_before) == [mirror_channel.name]
+    assert dao.claim_mirror_sync(mirror_channel.name, now, stale_before)
+
+    # the synchronisation is running, it can not be claimed again
+    assert not dao.get_due_mirror_syncs(now, stale_before)
+    assert not dao.claim_mirror_sync(mirror_channel.name, now, stale_before)
+
+    # unless it was interrupted
+    later = now + timedelta(hours=2)
+    assert dao.claim_mirror_sync(mirror_channel.name, later, later - timedelta(hours=1))
+
+
+@pytest.mark.parametrize("sync_error", [None, RuntimeError("upstream unavailable")])
+def test_scheduler_dispatch_due(
+    config, dao, db, session_maker, mirror_channel, user, mocker, sync_error
+):
+    synchronize = mocker.patch(
+        "quetz.tasks.mirror.synchronize_packages", side_effect=sync_error
+    )
+    mocker.patch("quetz.tasks.scheduler.get_session", lambda _: session_maker())
+
+    dao.set_mirror_sync_interval(mirror_channel.name, 60, user.id)
+    schedule = dao.get_mirror_sync_schedule(mirror_channel.name)
+    schedule.next_run = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+    mirror_scheduler = MirrorSyncScheduler(config)
+
+    jobs = mirror_scheduler.dispatch_due()
+    assert len(jobs) == 1
+
+    # the synchronisation is not dispatched twice
+    assert not mirror_scheduler.dispatch_due()
+
+    for worker, job_db in jobs:
+        asyncio.run(mirror_scheduler._wait(worker, job_db))
+
+    db.expire_all()
+    synchronize.assert_called_once()
+    args, _ = synchronize.call_args
+    assert args[0] == mirror_channel.name
+    # the synchronisation is run on behalf of the user who scheduled it
+    assert args[3].get_user() == user.id
+
+    schedule = dao.get_mirror_sync_schedule(mirror_channel.name)
+    assert schedule.status == "idle"
+    assert schedule.last_finished is not None
+    assert schedule.next_run > datetime.utcnow()
+    if sync_error:
+        assert schedule.failures == 1
+        assert schedule.last_error == "upstream unavailable"
+    else:
+        assert schedule.failures == 0
+        assert schedule.last_error is None
+
+
+def test_run_scheduled_sync_backoff(
+    config, dao, session_maker, mirror_channel, user, mocker
+):
+    mocker.patch(
+        "quetz.tasks.mirror.synchronize_packages", side_effect=RuntimeError("down")
+    )
+    next_sync = mocker.spy(scheduler, "next_sync_time")
+
+    dao.set_mirror_sync_interval(mirror_channel.name, 60, user.id)
+
+    # the sync job rolls back its session on failure
+    job_dao = Dao(session_maker())
+    for expected_failures in [1, 2, 3]:
+        scheduler.run_scheduled_sync(
+            mirror_channel.name, job_dao, None, None, None, config
+        )
+        _, kwargs = next_sync.call_args
+        assert kwargs["failures"] == expected_failures
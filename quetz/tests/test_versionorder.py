@@ -14,9 +14,10 @@ from random import shuffle
 
 import pytest
 
+from quetz import channel_data
 from quetz.dao import Dao
 from quetz.rest_models import Channel, Package
-from quetz.versionorder import VersionOrder
+from quetz.versionorder import VersionOrder, sort_key, version_order
 
 
 @pytest.fixture
@@ -226,6 +227,119 @@ def test_hexrd():
     assert sorted(vos) == vos
 
 
+@pytest.mark.parametrize(
+    "versions",
+    [
+        # sorted lists of versions
+        ["0.4", "0.4.1.rc", "0.4.1", "0.5a1", "0.5", "0.9.6", "0.960923", "1.0"],
+        ["1.1dev1", "1.1_", "1.1a1", "1.1.0dev1", "1.1.a1", "1.1.0rc1", "1.1"],
+        ["1.1.0post1", "1.1post1", "1996.07.12", "1!0.4.1", "1!3.1.1.6", "2!0.4.1"],
+        ["1.0.1dev", "1.0.1_", "1.0.1a", "1.0.1rc1", "1.0.1", "1.0.1post.a"],
+        ["1.0a1", "1.0a2.dev456", "1.0a12", "1.0.dev456", "1.0", "1.0.post456"],
+        ["1.2+abc", "1.2+abc123def", "1.2+123abc", "1.2+1234.abc", "1.2+123456"],
+        ["0", "0.0.0.1", "0.0.1", "0.1", "1.0.0.0.1", "2.0b1pr0", "2.0"],
+        ["0.3.0.dev", "0.3.3", "2020.1", "2021.01.01", "20210101", "99999999999999"],
+    ],
+)
+def test_sort_key(versions):
+    keys = [sort_key(v) for v in versions]
+    assert sorted(keys) == keys
+    assert len(set(keys)) == len(keys)
+
+    for v1 in versions:
+        for v2 in versions:
+            assert (VersionOrder(v1) < VersionOrder(v2)) == (
+                VersionOrder(v1).sort_key() < VersionOrder(v2).sort_key()
+            )
+
+
+def test_sort_key_equal_versions():
+    assert sort_key("0.4") == sort_key("0.4.0") == sort_key("0.4.0.0")
+    assert sort_key("0.4.a1") == sort_key("0.4.0a1")
+    assert sort_key("0.4.1.rc") == sort_key("  0.4.1.RC  ")
+    assert sort_key("1.0") != sort_key("1.0+0.a")
+
+
+def test_sort_key_build_number():
+    assert sort_key("1.0", 0) < sort_key("1.0", 1) < sort_key("1.0", "10")
+    assert sort_key("1.0", 1000) < sort_key("1.0.1", 0)
+
+
+def test_version_order_cache():
+    version_order.cache_clear()
+
+    v = version_order("1.2.3")
+    assert version_order("1.2.3") is v
+    assert version_order.cache_info().hits == 1
+    assert v == VersionOrder("1.2.3")
+
+    # the instances are compact and hashable
+    assert not hasattr(v, "__dict__")
+    assert len({v, VersionOrder("1.2.3.0"), VersionOrder("1.2.4")}) == 2
+
+
+CONDA_FORGE_VERSIONS = [
+    "0.1.0",
+    "0.24.2",
+    "0.24.2.post1",
+    "1.0",
+    "1.0.0.post20210101",
+    "1.1.1k",
+    "1.1.1l",
+    "1.1.1_",
+    "1.21.0.dev0+4b7f1f0",
+    "1.21.5",
+    "1!2.3",
+    "2.0.0a0",
+    "2.0.0b1",
+    "2.0.0rc1",
+    "2.0.0.dev0",
+    "3.0.0+cuda11.2",
+    "3.9.7",
+    "3.10.0",
+    "3.10.0rc2",
+    "4.10.3",
+    "2021.02.24",
+    "2021.10.8",
+    "20210806",
+    "0.0.post0",
+    "1.2.3.4",
+    "5.0.0b3",
+    "0.5.0a1",
+    "3.7.4.3",
+]
+
+
+@pytest.mark.parametrize(
+    "versions",
+    [CONDA_FORGE_VERSIONS, ["1.0.1dev", "1.0.1_", "1.0.1a", "1.0.1", "1.0.1post.a"]],
+)
+def test_conda_equivalence(versions):
+    conda_exports = pytest.importorskip("conda.exports")
+
+    for v1 in versions:
+        for v2 in versions:
+            expected = conda_exports.VersionOrder(v1) < conda_exports.VersionOrder(v2)
+            assert (VersionOrder(v1) < VersionOrder(v2)) == expected
+            expected = conda_exports.VersionOrder(v1) == conda_exports.VersionOrder(v2)
+            assert (VersionOrder(v1) == VersionOrder(v2)) == expected
+
+
+@pytest.mark.parametrize(
+    "old_version,new_version,newer",
+    [("1.9", "1.10", True), ("1.0", "1.0.0", False), ("1.0rc1", "1.0", True)],
+)
+def test_channel_data_combine(old_version, new_version, newer):
+    old_data = {"version": old_version, "summary": "old", "subdirs": ["linux-64"]}
+    new_data = {"version": new_version, "summary": "new", "subdirs": ["noarch"]}
+
+    data = channel_data.combine(old_data, new_data)
+
+    assert data["version"] == (new_version if newer else old_version)
+    assert data["summary"] == ("new" if newer else "old")
+    assert data["subdirs"] == ["linux-64", "noarch"]
+
+
 def test_package_version(db, dao: Dao, user, channel_name, package_name):
     channel_data = Channel(name=channel_name, private=False)
     package_data = Package(name=package_name)
@@ -24,6 +24,30 @@ def add_entry_for_index(files, subdir, fname, data_bytes):
     )
 
 
+class HashingReader:
+    """File-like wrapper computing the size, md5 and sha256 of the data read."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        self.md5.update(data)
+        self.sha256.update(data)
+        return data
+
+    def hashes(self):
+        return {
+            "size": self.size,
+            "md5": self.md5.hexdigest(),
+            "sha256": self.sha256.hexdigest(),
+        }
+
+
 class TicToc:
     def __init__(self, description):
         self.description = description
@@ -9,6 +9,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import re
+from functools import lru_cache
 from itertools import zip_longest
 
 
@@ -21,6 +22,21 @@ class InvalidVersionSpec(ValueError):
 version_check_re = re.compile(r'^[\*\.\+!_0-9a-z]+$')
 version_split_re = re.compile(r'([0-9]+|[*]+|[^0-9*]+)')
 
+# tags of the byte strings returned by VersionOrder.sort_key, in increasing
+# order: strings < zeros followed by a string < end (zeros) < zeros followed
+# by a number < numbers < 'post'
+_STR = b'\x01'
+_ZEROS_STR = b'\x02'
+_END = b'\x03'
+_ZEROS_NUM = b'\x04'
+_NUM = b'\x05'
+_INF = b'\x06'
+_MAX_ZEROS = 0xFFFFFFFF
+_inf = float('inf')
+
+# number of parsed versions kept by version_order
+VERSION_CACHE_SIZE = 16384
+
 
 class VersionOrder:
     """
@@ -131,8 +147,14 @@ class VersionOrder:
     this problem by appending an underscore to plain version numbers:
 
       1.0.1_ < 1.0.1a =>  True   # ensure correct ordering for openssl
+
+    The parsed version is also encoded as a byte string with the same order
+    (see :meth:`sort_key`), which is used for all the comparisons. Use
+    :func:`version_order` to reuse the instances of frequent version strings.
     """
 
+    __slots__ = ('norm_version', 'fillvalue', 'version', 'local', '_key')
+
     def __init__(self, vstr: str):
         # version comparison is case-insensitive
         version = vstr.strip().rstrip().lower()
@@ -229,9 +251,10 @@ class VersionOrder:
         return True
 
     def __eq__(self, other):
-        return self._eq(self.version, other.version) and self._eq(
-            self.local, other.local
-        )
+        return self.sort_key() == other.sort_key()
+
+    def __hash__(self):
+        return hash(self.sort_key())
 
     def startswith(self, other):
         # Tests if the version lists match up to the last element in "other".
@@ -261,28 +284,109 @@ class VersionOrder:
         return not (self == other)
 
     def __lt__(self, other):
-        for t1, t2 in zip([self.version, self.local], [other.version, other.local]):
-            for v1, v2 in zip_longest(t1, t2, fillvalue=[]):
-                for c1, c2 in zip_longest(v1, v2, fillvalue=self.fillvalue):
-                    if c1 == c2:
-                        continue
-                    elif isinstance(c1, str):
-                        if not isinstance(c2, str):
-                            # str < int
-                            return True
-                    elif isinstance(c2, str):
-                        # not (int < str)
-                        return False
-                    # c1 and c2 have the same type
-                    return c1 < c2
-        # self == other
-        return False
+        return self.sort_key() < other.sort_key()
+
+    def sort_key(self) -> bytes:
+        """Byte string with the same order as the version.
+
+        ``a.sort_key() < b.sort_key()`` if and only if ``a < b`` (and the keys
+        are equal for equal versions), so the keys can be stored in a database
+        column and sorted there. The key is computed on first use."""
+
+        try:
+            return self._key
+        except AttributeError:
+            self._key = _encode_components(self.version) + _encode_components(
+                self.local
+            )
+            return self._key
 
     def __gt__(self, other):
-        return other < self
+        return self.sort_key() > other.sort_key()
 
     def __le__(self, other):
-        return not (other < self)
+        return self.sort_key() <= other.sort_key()
 
     def __ge__(self, other):
-        return not (self < other)
+        return self.sort_key() >= other.sort_key()
+
+
+def _encode_int(value: int) -> bytes:
+    # the length first, so that longer numbers are larger
+    if value < 256:
+        return bytes((1, value)) if value else b'\x00'
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return bytes([len(data)]) + data
+
+
+def _encode_zeros(zeros: int, sign: int) -> bytes:
+    # A run of zeros is encoded by its length and by whether it is followed by
+    # a smaller (string) or a larger item.
+    if sign < 0:
+        # the longer the run, the later the smaller item
+        return _ZEROS_STR + zeros.to_bytes(4, 'big')
+    return _ZEROS_NUM + (_MAX_ZEROS - zeros).to_bytes(4, 'big')
+
+
+def _encode_component(component):
+    # Subcomponents compare as if the component was padded with zeros, so
+    # trailing zeros are dropped and the end of the component sorts like a
+    # zero. Returns the sign of the component compared to a zero component.
+    encoded = []
+    sign = 0
+    zeros = 0
+    for c in component:
+        if isinstance(c, str):
+            c_sign = -1
+            # version strings do not contain null characters
+            data = _STR + c.encode() + b'\x00'
+        elif not c:
+            zeros += 1
+            continue
+        else:
+            c_sign = 1
+            data = _INF if c == _inf else _NUM + _encode_int(c)
+        if not sign:
+            sign = c_sign
+        if zeros:
+            encoded.append(_encode_zeros(zeros, c_sign))
+            zeros = 0
+        encoded.append(data)
+    encoded.append(_END)
+    return sign, b''.join(encoded)
+
+
+def _encode_components(components) -> bytes:
+    # same as the subcomponents: components made of zeros are zero items
+    encoded = []
+    zeros = 0
+    for component in components:
+        sign, data = _encode_component(component)
+        if not sign:
+            zeros += 1
+            continue
+        if zeros:
+            encoded.append(_encode_zeros(zeros, sign))
+            zeros = 0
+        encoded.append(_STR if sign < 0 else _NUM)
+        encoded.append(data)
+    encoded.append(_END)
+    return b''.join(encoded)
+
+
+@lru_cache(maxsize=VERSION_CACHE_SIZE)
+def version_order(vstr: str) -> VersionOrder:
+    """VersionOrder of a version string, parsed once for frequent versions.
+
+    The returned instances are shared and must not be modified."""
+
+    return VersionOrder(vstr)
+
+
+def sort_key(version: str, build_number: int = 0) -> bytes:
+    """Sort key of a package version and build number.
+
+    Keys of the package versions compare like the versions and, for the same
+    version, like the build numbers."""
+
+    return version_order(version).sort_key() + _encode_int(int(build_number or 0))
@@ -2,9 +2,15 @@
 # Distributed under the terms of the Modified BSD License.
 
 import argparse
+import hashlib
+import io
 import os
 import sys
+import threading
+import time
+import uuid
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urljoin, urlparse, urlunparse
 
 import appdirs
@@ -75,6 +81,349 @@ def urljoin_all(pieces):
     return result
 
 
+# number of consecutive failed requests before a chunked upload is abandoned
+CHUNK_RETRIES = 5
+
+# minimum interval (in seconds) between two updates of the progress line
+PROGRESS_INTERVAL = 0.5
+
+# longest wait (in seconds) between two attempts of a failed request
+MAX_BACKOFF = 60
+
+
+class UploadError(Exception):
+    pass
+
+
+def _check_response(response, expected_status=200):
+    if response.status_code != expected_status:
+        raise UploadError(
+            'Request failed:\n'
+            f'  HTTP status code: {response.status_code}\n'
+            f'  Message: {str(response.content.decode("utf-8"))}'
+        )
+    return response
+
+
+def _backoff(attempt):
+    return min(pow(2, attempt - 1), MAX_BACKOFF)
+
+
+def _is_retryable(status_code):
+    return status_code >= 500 or status_code == 429
+
+
+def _send_with_retries(send, retries):
+    """Send a request, retrying after connection errors and 429/5xx responses.
+
+    `send` sends the request and returns the response, it is called again
+    for every attempt with a growing wait in between. Returns the last
+    response and whether the request was retried."""
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(_backoff(attempt))
+        try:
+            response = send()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+            response = None
+            continue
+        if not _is_retryable(response.status_code):
+            break
+    if response is None:
+        raise UploadError(f'Request failed: {error}')
+    return response, attempt > 0
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fid:
+        for data in iter(lambda: fid.read(1024 * 1024), b''):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def _is_uploaded(channel_url, package, api_key, retries):
+    """Tell whether the channel has the package file with the same content.
+
+    Used when a retried request conflicts with the state of the server, which
+    happens if an earlier attempt succeeded but its response was lost."""
+    filename = os.path.basename(package)
+    package_name = filename.rsplit('-', 2)[0]
+    response, _ = _send_with_retries(
+        lambda: requests.get(
+            f'{channel_url}/packages/{package_name}/versions',
+            headers={'X-API-Key': api_key},
+        ),
+        retries,
+    )
+    if response.status_code != 200:
+        return False
+    sha256 = _file_sha256(package)
+    return any(
+        version['filename'] == filename and version['info'].get('sha256') == sha256
+        for version in response.json()
+    )
+
+
+class UploadProgress:
+    """Bytes sent and files uploaded, printed on one line of stderr."""
+
+    def __init__(self, n_files, total_size, enabled=True):
+        self.n_files = n_files
+        self.total_size = total_size
+        self.enabled = enabled
+        self.sent = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self._printed = 0
+        self._lock = threading.Lock()
+
+    def add_bytes(self, n_bytes):
+        with self._lock:
+            self.sent += n_bytes
+            self._print()
+
+    def add_files(self, n_files, failed=False):
+        with self._lock:
+            if failed:
+                self.failed += n_files
+            else:
+                self.uploaded += n_files
+            self._print(force=True)
+
+    def _line(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        line = (
+            f'{self.uploaded}/{self.n_files} files, '
+            f'{self.sent / 1e6:.1f}/{self.total_size / 1e6:.1f} MB, '
+            f'{self.sent / elapsed / 1e6:.1f} MB/s'
+        )
+        if self.failed:
+            line += f', {self.failed} failed'
+        return line
+
+    def _print(self, force=False):
+        now = time.monotonic()
+        if not self.enabled or (not force and now - self._printed < PROGRESS_INTERVAL):
+            return
+        self._printed = now
+        sys.stderr.write(f'\r{self._line()}')
+        sys.stderr.flush()
+
+    def close(self):
+        if self.enabled:
+            sys.stderr.write('\r')
+        print(f'{self._line()} in {time.monotonic() - self.start:.1f} s')
+
+
+class MultipartStream:
+    """multipart/form-data body read from the package files while it is sent
+
+    Its length is known in advance, so requests sends it with a
+    Content-Length header without loading the files in memory."""
+
+    def __init__(self, fields, files, on_read=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.on_read = on_read
+
+        # bytes are sent as they are, strings are paths of the files to send
+        self._parts = []
+        for name, value in fields:
+            self._parts.append(self._header(name) + f'{value}\r\n'.encode())
+        for name, path in files:
+            self._parts.append(self._header(name, os.path.basename(path)))
+            self._parts.append(path)
+            self._parts.append(b'\r\n')
+        self._parts.append(f'--{self.boundary}--\r\n'.encode())
+
+        self.length = sum(
+            len(part) if isinstance(part, bytes) else os.path.getsize(part)
+            for part in self._parts
+        )
+        self._next_parts = iter(self._parts)
+        self._current = None
+
+    def _header(self, name, filename=None):
+        header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"'
+        if filename is not None:
+            header += (
+                f'; filename="{filename}"\r\n' 'Content-Type: application/octet-stream'
+            )
+        return f'{header}\r\n\r\n'.encode()
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        data = []
+        remaining = size
+        while remaining > 0:
+            if self._current is None:
+                part = next(self._next_parts, None)
+                if part is None:
+                    break
+                if isinstance(part, bytes):
+                    self._current = io.BytesIO(part)
+                else:
+                    self._current = open(part, 'rb')
+            chunk = self._current.read(remaining)
+            if not chunk:
+                self._current.close()
+                self._current = None
+                continue
+            data.append(chunk)
+            remaining -= len(chunk)
+        data = b''.join(data)
+        if self.on_read is not None:
+            self.on_read(len(data))
+        return data
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
+def upload_package_files(channel_url, packages, api_key, force, retries, progress):
+    """Upload packages in one streamed request, retrying failed requests."""
+
+    def send():
+        sent = []
+
+        def on_read(n_bytes):
+            sent.append(n_bytes)
+            progress.add_bytes(n_bytes)
+
+        body = MultipartStream(
+            [('force', 'true')] if force else [],
+            [('files', package) for package in packages],
+            on_read=on_read,
+        )
+        response = None
+        try:
+            response = requests.post(
+                f'{channel_url}/files/',
+                data=body,
+                headers={'X-API-Key': api_key, 'Content-Type': body.content_type},
+            )
+            return response
+        finally:
+            body.close()
+            if response is None or response.status_code != 201:
+                # the bytes of a failed request are sent again
+                progress.add_bytes(-sum(sent))
+
+    response, retried = _send_with_retries(send, retries)
+    if (
+        response.status_code == 409
+        and retried
+        and all(
+            _is_uploaded(channel_url, package, api_key, retries) for package in packages
+        )
+    ):
+        # an earlier attempt added the packages, its response was lost
+        for package in packages:
+            progress.add_bytes(os.path.getsize(package))
+        return
+    _check_response(response, 201)
+
+
+def upload_package_in_chunks(
+    channel_url,
+    package,
+    api_key,
+    chunk_size,
+    force,
+    retries=CHUNK_RETRIES,
+    progress=None,
+):
+    """Upload a package in an upload session, resuming after failed chunks."""
+    headers = {'X-API-Key': api_key}
+    size = os.path.getsize(package)
+    sha256 = _file_sha256(package)
+
+    response, _ = _send_with_retries(
+        lambda: requests.post(
+            f'{channel_url}/upload-sessions',
+            json={
+                'filename': os.path.basename(package),
+                'size': size,
+                'sha256': sha256,
+            },
+            headers=headers,
+        ),
+        retries,
+    )
+    upload_session = _check_response(response, 201).json()
+    session_url = f'{channel_url}/upload-sessions/{upload_session["id"]}'
+    chunk_size = max(chunk_size, upload_session['min_chunk_size'])
+
+    def get_session():
+        response, _ = _send_with_retries(
+            lambda: requests.get(session_url, headers=headers), retries
+        )
+        return _check_response(response).json()
+
+    def send_chunk(fid, offset):
+        fid.seek(offset)
+        return requests.put(
+            session_url,
+            params={'offset': offset},
+            data=fid.read(chunk_size),
+            headers=headers,
+        )
+
+    conflicts = 0
+    offset = upload_session['offset']
+    if progress is not None:
+        progress.add_bytes(offset)
+    with open(package, 'rb') as fid:
+        while offset < size:
+            response, _ = _send_with_retries(lambda: send_chunk(fid, offset), retries)
+            if response.status_code == 409:
+                # the server received more (or less) than this client knows,
+                # for example a chunk of a request whose response was lost
+                upload_session = get_session()
+                conflicts += 1
+            else:
+                upload_session = _check_response(response).json()
+            new_offset = upload_session['offset']
+            if upload_session['size'] != size or not 0 <= new_offset <= size:
+                raise UploadError(
+                    f'Upload session of {package} does not match the file: '
+                    f'{new_offset} of {upload_session["size"]} bytes received'
+                )
+            if new_offset != offset:
+                conflicts = 0
+            elif conflicts > retries:
+                raise UploadError(f'Upload of {package} failed after {retries} retries')
+            if progress is not None:
+                progress.add_bytes(new_offset - offset)
+            offset = new_offset
+
+    response, retried = _send_with_retries(
+        lambda: requests.post(
+            f'{session_url}/finalize', params={'force': force}, headers=headers
+        ),
+        retries,
+    )
+    if (
+        response.status_code == 404
+        and retried
+        and _is_uploaded(channel_url, package, api_key, retries)
+    ):
+        # an earlier attempt added the package and closed the session, its
+        # response was lost
+        return
+    _check_response(response, 201)
+
+
 def upload_packages(args):
     channel = args.channel
     if channel.isalnum():
@@ -112,30 +461,67 @@ def upload_packages(args):
                 exit_on_error=True,
             )
 
-    files = [('files', open(package, 'rb')) for package in package_file_names]
-
-    if args.force:
-        files.append(('force', (None, 'true')))
+    # with chunked uploads every package is uploaded in its own session
+    batch_size = 1 if args.chunk_size else args.batch_size or len(package_file_names)
+    batches = [
+        package_file_names[i : i + batch_size]  # noqa: E203
+        for i in range(0, len(package_file_names), batch_size)
+    ]
 
     api_key = get_installed_api_key(channel_url)
     url = f'{channel_url}/files/'
+    if args.chunk_size:
+        url = f'{channel_url}/upload-sessions'
     if args.dry_run:
         package_lines = "\n  ".join(package_file_names)
         print(
             f'QUETZ_API_KEY found: {not not api_key}\n'
             f'URL: {url}\n'
+            f'requests: {len(batches)} ({args.concurrency} in parallel)\n'
             f'packages:\n  {package_lines} '
         )
-    else:
-        response = requests.post(url, files=files, headers={'X-API-Key': api_key})
+        return
 
-        if response.status_code != 201:
-            print(
-                'Request failed:\n'
-                f'  HTTP status code: {response.status_code}\n'
-                f'  Message: {str(response.content.decode("utf-8"))}'
+    progress = UploadProgress(
+        len(package_file_names),
+        sum(os.path.getsize(package) for package in package_file_names),
+        enabled=sys.stderr.isatty(),
+    )
+
+    def upload(batch):
+        if args.chunk_size:
+            upload_package_in_chunks(
+                channel_url,
+                batch[0],
+                api_key,
+                args.chunk_size * 1024 * 1024,
+                args.force,
+                args.retries,
+                progress,
+            )
+        else:
+            upload_package_files(
+                channel_url, batch, api_key, args.force, args.retries, progress
             )
-            sys.exit(1)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {executor.submit(upload, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                future.result()
+            except (UploadError, requests.RequestException) as e:
+                failed.append((batch, e))
+                progress.add_files(len(batch), failed=True)
+            else:
+                progress.add_files(len(batch))
+    progress.close()
+
+    for batch, error in failed:
+        print(f'Upload of {", ".join(batch)} failed:\n{error}')
+    if failed:
+        sys.exit(1)
 
 
 def main():
@@ -179,6 +565,43 @@ def main():
         ),
     )
 
+    upload_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help=(
+            "Upload the packages one by one in chunks of this size (in MB), "
+            "failed chunks are retried without restarting the upload"
+        ),
+    )
+
+    upload_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Number of upload requests sent in parallel",
+    )
+
+    upload_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help=(
+            "Number of packages uploaded in each request, "
+            "0 uploads all the packages in a single request"
+        ),
+    )
+
+    upload_parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help=(
+            "Number of times a failed request is retried, "
+            "waiting longer after each failure"
+        ),
+    )
+
     upload_parser.add_argument("-s", "--server", default="https://beta.mamba.pm")
 
     upload_parser.add_argument(
@@ -0,0 +1,338 @@
+import argparse
+import email
+import hashlib
+import json
+import uuid
+from collections import defaultdict
+
+import pytest
+import requests
+
+from quetz_client import command_line
+from quetz_client.command_line import (
+    MultipartStream,
+    UploadError,
+    UploadProgress,
+    upload_package_files,
+    upload_package_in_chunks,
+    upload_packages,
+)
+
+CHANNEL_URL = "http://server/api/channels/channel"
+
+
+def _response(status_code, data=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data).encode()
+    return response
+
+
+def _parse_multipart(content_type, body):
+    message = email.message_from_bytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    fields = {}
+    files = {}
+    for part in message.get_payload():
+        filename = part.get_filename()
+        if filename is None:
+            fields[
+                part.get_param("name", header="content-disposition")
+            ] = part.get_payload()
+        else:
+            files[filename] = part.get_payload(decode=True)
+    return fields, files
+
+
+class DummyServer:
+    """Upload endpoints of a quetz server, with failures scripted by the tests
+
+    A failure is a status code returned instead of handling the request,
+    "error" (the request does not reach the server) or "lost" (the request is
+    handled but its response is lost)."""
+
+    def __init__(self):
+        self.packages = {}
+        self.sessions = {}
+        self.requests = []
+        self.failures = defaultdict(list)
+
+    def fail(self, method, endpoint, *failures):
+        self.failures[(method, endpoint)].extend(failures)
+
+    def request(self, method, url, params=None, data=None, json=None, headers=None):
+        path = url[len(CHANNEL_URL) :].strip("/").split("/")  # noqa: E203
+        if len(path) > 1:
+            path[1] = "<name>" if path[0] == "packages" else "<id>"
+        endpoint = "/".join(path)
+        self.requests.append((method, endpoint))
+
+        if hasattr(data, "read"):
+            data = data.read()
+        failures = self.failures[(method, endpoint)]
+        failure = failures.pop(0) if failures else None
+        if failure == "error":
+            raise requests.ConnectionError("connection refused")
+        if isinstance(failure, int):
+            return _response(failure, {"detail": "try again later"})
+
+        handler = {
+            ("POST", "files"): self.post_files,
+            ("GET", "packages/<name>/versions"): self.get_versions,
+            ("POST", "upload-sessions"): self.post_session,
+            ("GET", "upload-sessions/<id>"): self.get_session,
+            ("PUT", "upload-sessions/<id>"): self.put_chunk,
+            ("POST", "upload-sessions/<id>/finalize"): self.post_finalize,
+        }[(method, endpoint)]
+        response = handler(url, params, data, json, headers)
+        if failure == "lost":
+            raise requests.ConnectionError("connection reset")
+        return response
+
+    def _path_item(self, url):
+        return url[len(CHANNEL_URL) :].strip("/").split("/")[1]  # noqa: E203
+
+    def _add_packages(self, files, force):
+        if not force and any(filename in self.packages for filename in files):
+            return _response(409, {"detail": "package version already exists"})
+        for filename, content in files.items():
+            self.packages[filename] = content
+        return _response(201)
+
+    def post_files(self, url, params, data, json_data, headers):
+        fields, files = _parse_multipart(headers["Content-Type"], data)
+        return self._add_packages(files, fields.get("force") == "true")
+
+    def get_versions(self, url, params, data, json_data, headers):
+        package_name = self._path_item(url)
+        return _response(
+            200,
+            [
+                {
+                    "filename": filename,
+                    "info": {"sha256": hashlib.sha256(content).hexdigest()},
+                }
+                for filename, content in self.packages.items()
+                if filename.rsplit("-", 2)[0] == package_name
+            ],
+        )
+
+    def _session(self, session):
+        return {
+            "id": session["id"],
+            "size": session["size"],
+            "offset": len(session["data"]),
+            "min_chunk_size": 1,
+        }
+
+    def post_session(self, url, params, data, json_data, headers):
+        session = dict(json_data, id=uuid.uuid4().hex, data=b"")
+        self.sessions[session["id"]] = session
+        return _response(201, self._session(session))
+
+    def get_session(self, url, params, data, json_data, headers):
+        return _response(200, self._session(self.sessions[self._path_item(url)]))
+
+    def put_chunk(self, url, params, data, json_data, headers):
+        session = self.sessions[self._path_item(url)]
+        if params["offset"] != len(session["data"]):
+            return _response(409, {"detail": "expected offset"})
+        session["data"] += data
+        return _response(200, self._session(session))
+
+    def post_finalize(self, url, params, data, json_data, headers):
+        session = self.sessions.pop(self._path_item(url), None)
+        if session is None:
+            return _response(404, {"detail": "upload session not found"})
+        return self._add_packages({session["filename"]: session["data"]}, False)
+
+
+@pytest.fixture
+def server(mocker):
+    server = DummyServer()
+    for method in ["get", "post", "put"]:
+        mocker.patch(
+            f"requests.{method}",
+            lambda url, method=method, **kwargs: server.request(
+                method.upper(), url, **kwargs
+            ),
+        )
+    mocker.patch.object(command_line.time, "sleep")
+    return server
+
+
+@pytest.fixture
+def packages(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"package-{i}-0.1-0.tar.bz2"
+        path.write_bytes(f"content of package {i}".encode() * (i + 1))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def progress(packages):
+    return UploadProgress(len(packages), 0, enabled=False)
+
+
+def test_multipart_stream(packages):
+    sent = []
+    body = MultipartStream(
+        [("force", "true")],
+        [("files", package) for package in packages[:2]],
+        on_read=sent.append,
+    )
+
+    # the body is read in small pieces while it is sent
+    data = b"".join(iter(lambda: body.read(7), b""))
+    body.close()
+
+    assert len(data) == len(body) == sum(sent)
+    fields, files = _parse_multipart(body.content_type, data)
+    assert fields == {"force": "true"}
+    assert list(files) == ["package-0-0.1-0.tar.bz2", "package-1-0.1-0.tar.bz2"]
+    with open(packages[1], "rb") as fid:
+        assert files["package-1-0.1-0.tar.bz2"] == fid.read()
+
+
+@pytest.mark.parametrize(
+    "failures", [[503], [429, "error"], ["lost"], ["lost", 502, "lost"]]
+)
+def test_upload_package_files_retries(server, packages, progress, failures):
+    server.fail("POST", "files", *failures)
+
+    upload_package_files(CHANNEL_URL, packages[:2], "key", False, 3, progress)
+
+    assert sorted(server.packages) == [
+        "package-0-0.1-0.tar.bz2",
+        "package-1-0.1-0.tar.bz2",
+    ]
+    # the bytes of the failed requests are not counted (the multipart headers
+    # of the request that succeeded are)
+    size = sum(len(content) for content in server.packages.values())
+    assert size <= progress.sent < size + 1000
+
+
+def test_upload_package_files_conflict(server, packages, progress):
+    # another version of the package is already in the channel
+    server.packages["package-0-0.1-0.tar.bz2"] = b"other content"
+
+    with pytest.raises(UploadError, match="409"):
+        upload_package_files(CHANNEL_URL, packages[:1], "key", False, 3, progress)
+
+    # also when the conflict is found after a retry
+    server.fail("POST", "files", 503)
+    with pytest.raises(UploadError, match="409"):
+        upload_package_files(CHANNEL_URL, packages[:1], "key", False, 3, progress)
+    assert server.packages["package-0-0.1-0.tar.bz2"] == b"other content"
+
+
+def test_upload_package_files_gives_up(server, packages, progress):
+    server.fail("POST", "files", 503, 503, 503)
+
+    with pytest.raises(UploadError, match="503"):
+        upload_package_files(CHANNEL_URL, packages[:1], "key", False, 2, progress)
+
+    # errors of the client are not retried
+    server.fail("POST", "files", 400)
+    with pytest.raises(UploadError, match="400"):
+        upload_package_files(CHANNEL_URL, packages[:1], "key", False, 2, progress)
+    assert server.requests == [("POST", "files")] * 4
+
+
+@pytest.mark.parametrize(
+    "endpoint,failures",
+    [
+        ("upload-sessions", [503, "error"]),
+        ("upload-sessions/<id>", [429, 503, "error"]),
+        ("upload-sessions/<id>", ["lost", "lost"]),
+        ("upload-sessions/<id>/finalize", [500, "error"]),
+        ("upload-sessions/<id>/finalize", ["lost"]),
+    ],
+)
+def test_upload_package_in_chunks_retries(
+    server, packages, progress, endpoint, failures
+):
+    method = "PUT" if endpoint == "upload-sessions/<id>" else "POST"
+    server.fail(method, endpoint, *failures)
+
+    upload_package_in_chunks(CHANNEL_URL, packages[4], "key", 10, False, 3, progress)
+
+    with open(packages[4], "rb") as fid:
+        content = fid.read()
+    assert server.packages == {"package-4-0.1-0.tar.bz2": content}
+    assert not server.sessions
+    assert progress.sent == len(content)
+
+
+def test_upload_package_in_chunks_resumes_from_server_offset(
+    server, packages, progress
+):
+    # the first chunk is received but its response is lost, the server then
+    # rejects it and tells where to resume from
+    server.fail("PUT", "upload-sessions/<id>", "lost")
+
+    upload_package_in_chunks(CHANNEL_URL, packages[4], "key", 10, False, 3, progress)
+
+    requests_sent = [
+        request for request in server.requests if request[1] == "upload-sessions/<id>"
+    ]
+    assert requests_sent[:3] == [
+        ("PUT", "upload-sessions/<id>"),
+        ("PUT", "upload-sessions/<id>"),
+        ("GET", "upload-sessions/<id>"),
+    ]
+    with open(packages[4], "rb") as fid:
+        assert server.packages["package-4-0.1-0.tar.bz2"] == fid.read()
+
+
+def test_upload_package_in_chunks_finalize_failed(server, packages, progress):
+    # the package was not added and the session is gone
+    def finalize_failed(url, params, data, json_data, headers):
+        if server.sessions.pop(server._path_item(url), None) is None:
+            return _response(404, {"detail": "upload session not found"})
+        return _response(500, {"detail": "internal server error"})
+
+    server.post_finalize = finalize_failed
+
+    with pytest.raises(UploadError, match="404"):
+        upload_package_in_chunks(
+            CHANNEL_URL, packages[0], "key", 10, False, 3, progress
+        )
+    assert not server.packages
+
+
+@pytest.mark.parametrize(
+    "batch_size,chunk_size,expected_requests",
+    [(2, 0, 3), (0, 0, 1), (1, 0, 5), (2, 1, 5)],
+)
+def test_upload_packages_batches(
+    server, packages, monkeypatch, batch_size, chunk_size, expected_requests
+):
+    monkeypatch.setenv("QUETZ_API_KEY", "key")
+    server.fail("POST", "files", 503)
+    server.fail("POST", "upload-sessions/<id>/finalize", 503)
+    args = argparse.Namespace(
+        channel="channel",
+        server="http://server",
+        packages=list(packages),
+        verify=False,
+        verify_ignore=None,
+        dry_run=False,
+        force=False,
+        chunk_size=chunk_size,
+        concurrency=3,
+        batch_size=batch_size,
+        retries=3,
+    )
+
+    upload_packages(args)
+
+    assert sorted(server.packages) == sorted(
+        package.rsplit("/", 1)[-1] for package in packages
+    )
+    endpoint = "upload-sessions/<id>/finalize" if chunk_size else "files"
+    # one request is sent again
+    assert server.requests.count(("POST", endpoint)) == expected_requests + 1